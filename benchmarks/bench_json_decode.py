@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+插件WebSocket消息JSON解码吞吐量基准测试
+
+用法：
+    python benchmarks/bench_json_decode.py [录制的消息文件 ...]
+
+不指定文件时使用生成的模拟弹幕消息
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blcsdk.client as sdk_client
+import frames as bench_frames
+
+
+def get_decoders():
+    decoders = {'json': json.loads}
+    try:
+        import orjson
+        decoders['orjson'] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import msgspec.json
+        decoders['msgspec'] = msgspec.json.decode
+    except ImportError:
+        pass
+    return decoders
+
+
+def bench_decoder(loads, frames, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            loads(frame)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON解码吞吐量基准测试')
+    parser.add_argument('paths', nargs='*', help='录制文件、录制目录或每行一条JSON的文本文件')
+    parser.add_argument('-n', '--count', type=int, default=100000, help='不指定文件时生成的消息数')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='重复次数，取最快的一次')
+    args = parser.parse_args()
+
+    if args.paths:
+        frames = list(bench_frames.load_frames(args.paths))
+    else:
+        frames = bench_frames.generate_frames(args.count)
+    if not frames:
+        print('没有消息')
+        return 1
+    total_bytes = sum(len(frame.encode('utf-8')) for frame in frames)
+
+    default_loads = sdk_client.get_default_json_loads()
+    print(f'消息数: {len(frames)}，平均长度: {total_bytes / len(frames):.0f} 字节')
+    print(f'BlcPluginClient默认解码器: {default_loads.__module__}.{default_loads.__qualname__}')
+    print()
+    print(f'{"解码器":<10}{"消息/秒":>14}{"MB/秒":>10}{"单条(us)":>12}{"加速比":>8}')
+    baseline = None
+    for name, loads in get_decoders().items():
+        elapsed = bench_decoder(loads, frames, args.repeat)
+        if baseline is None:
+            baseline = elapsed
+        print(
+            f'{name:<10}{len(frames) / elapsed:>14,.0f}{total_bytes / elapsed / 1e6:>10.1f}'
+            f'{elapsed / len(frames) * 1e6:>12.2f}{baseline / elapsed:>8.2f}'
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+插件启动耗时基准测试
+
+测量从启动插件进程到连接上blivechat（收到BLC_INIT）的时间，超过预算时返回非0，用于发现启动变慢。
+blivechat启动插件时如果插件连接得太慢，启动后最早的弹幕会丢失
+
+用法：
+    python benchmarks/bench_startup.py [--headless] [--repeat 5] [--budget 1.5]
+    python benchmarks/bench_startup.py --exe dist/niconico-rating/niconico-rating.exe
+    python benchmarks/bench_startup.py --importtime [--headless]
+
+--importtime用-X importtime分析源码入口的导入耗时。打包后的exe不能传-X选项，只能测量启动时间
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stub_server
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_PATH = os.path.join(PROJECT_DIR, 'main.py')
+
+DEFAULT_BUDGET = 1.5
+"""默认的启动时间预算（秒），源码入口的无界面模式在开发机上约0.25秒，GUI模式和打包后的exe更慢"""
+
+
+def get_plugin_command(args) -> List[str]:
+    if args.exe:
+        command = [args.exe]
+    else:
+        command = [sys.executable, MAIN_PATH]
+    if args.headless:
+        # 不开启控制端口，避免多次测试之间端口冲突
+        command += ['--headless', '--control-port', '0']
+    return command
+
+
+async def measure_once(command: List[str], timeout: float) -> float:
+    """启动一次插件，返回从启动进程到收到BLC_INIT的秒数"""
+    server = stub_server.StubBlcServer()
+    await server.start()
+    process: Optional[subprocess.Popen] = None
+    try:
+        # 在临时目录运行，不覆盖插件目录下的日志和结果页面
+        with tempfile.TemporaryDirectory() as cwd:
+            start_time = time.perf_counter()
+            process = subprocess.Popen(
+                command, cwd=cwd, env={**os.environ, **server.env},
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            await server.wait_plugin_connected(timeout)
+            elapsed = server.blc_init_time - start_time
+
+            process.terminate()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, process.wait, 10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        return elapsed
+    finally:
+        if process is not None and process.poll() is None:
+            process.kill()
+        await server.stop()
+
+
+async def measure_startup(args) -> List[float]:
+    command = get_plugin_command(args)
+    print(f'插件启动命令: {subprocess.list2cmdline(command)}')
+    # 第一次运行要编译.pyc、预热磁盘缓存，不计入结果
+    await measure_once(command, args.timeout)
+    results = []
+    for _ in range(args.repeat):
+        results.append(await measure_once(command, args.timeout))
+    return results
+
+
+def parse_importtime(stderr: str) -> List[Tuple[int, int, str]]:
+    """解析-X importtime的输出，返回[(自身耗时us, 累计耗时us, 模块名)]"""
+    results = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0])
+            cumulative_us = int(parts[1])
+        except ValueError:
+            # 表头
+            continue
+        results.append((self_us, cumulative_us, parts[2].rstrip()))
+    return results
+
+
+def run_importtime(args):
+    # GUI模式还要导入gui（wx），main.py中是延迟导入的
+    code = 'import main' if args.headless else 'import main; import gui'
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], cwd=PROJECT_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else f'导入失败，返回码 {proc.returncode}')
+        return 1
+
+    records = parse_importtime(proc.stderr)
+    total_us = sum(self_us for self_us, _cumulative_us, _name in records)
+    print(f'导入模块数: {len(records)}，总耗时: {total_us / 1000:.1f} ms')
+    print()
+    print(f'顶层导入（累计耗时）:')
+    for _self_us, cumulative_us, name in sorted(
+        (record for record in records if not record[2].startswith('  ')), key=lambda record: -record[1]
+    )[:args.top]:
+        print(f'{cumulative_us / 1000:10.1f} ms  {name.strip()}')
+    print()
+    print(f'自身耗时最多的模块:')
+    for self_us, _cumulative_us, name in sorted(records, key=lambda record: -record[0])[:args.top]:
+        print(f'{self_us / 1000:10.1f} ms  {name.strip()}')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='插件启动耗时基准测试')
+    parser.add_argument('--headless', action='store_true', help='测试无界面模式')
+    parser.add_argument('--exe', help='测试打包后的可执行文件，默认测试源码入口main.py')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='重复次数')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='启动时间预算（秒），中位数超过时返回1')
+    parser.add_argument('--timeout', type=float, default=30, help='等待插件连接的最长秒数')
+    parser.add_argument('--importtime', action='store_true', help='只分析源码入口的导入耗时')
+    parser.add_argument('--top', type=int, default=15, help='--importtime时显示的模块数')
+    args = parser.parse_args()
+
+    if args.importtime:
+        return run_importtime(args)
+
+    results = asyncio.run(measure_startup(args))
+    median = statistics.median(results)
+    print(f'到收到BLC_INIT的时间: 中位数={median * 1000:.0f}ms，最小={min(results) * 1000:.0f}ms，'
+          f'最大={max(results) * 1000:.0f}ms')
+    if median > args.budget:
+        print(f'超过预算 {args.budget * 1000:.0f}ms')
+        return 1
+    print(f'在预算 {args.budget * 1000:.0f}ms 以内')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
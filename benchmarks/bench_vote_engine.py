@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+投票统计核心基准测试，不依赖wx和网络，只测试VoteEngine的匹配、计入和快照
+
+用法：
+    python benchmarks/bench_vote_engine.py [录制的消息文件 ...] [-n 200000]
+
+不指定文件时使用生成的模拟弹幕消息
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blcsdk.models as sdk_models
+import frames as bench_frames
+import vote_matcher
+from vote_engine import VoteEngine
+
+DEFAULT_PATTERNS = {1: '^1$', 2: '^2$', 3: '^3$', 4: '^4$', 5: '^5$'}
+# 用户自定义的比较复杂的正则表达式，不能用字面值匹配
+REGEX_PATTERNS = {
+    1: '^(1|一|好评)+[!！]*$', 2: '^(2|二)+[!！]*$', 3: '^(3|三)+[!！]*$', 4: '^(4|四)+[!！]*$', 5: '^(5|五|差评)+[!！]*$'
+}
+
+
+def load_commands(args):
+    """解码消息，只保留弹幕，解码不计入耗时"""
+    if args.paths:
+        frames = bench_frames.load_frames(args.paths)
+    else:
+        frames = bench_frames.generate_frames(args.count, unique_voters=args.unique_voters)
+    commands = []
+    for frame in frames:
+        command = json.loads(frame)
+        if command['cmd'] == sdk_models.Command.ADD_TEXT:
+            commands.append(command)
+    return commands
+
+
+def run_engine(engine: VoteEngine, commands):
+    """和VoteHandler一样先跳过已经投过票的账号，再匹配，匹配到投票再计入"""
+    has_voted = engine.has_voted
+    match = engine.match
+    ingest = engine.ingest
+    room_keys = {}
+    for command in commands:
+        data = command['data']
+        extra = command['extra']
+        room_key_dict = extra['roomKey']
+        if has_voted((room_key_dict['type'], room_key_dict['value']), data[16]):
+            continue
+        level = match(data[4], data[1])
+        if level is None:
+            continue
+        room_key = room_keys.get(extra['roomId'], None)
+        if room_key is None:
+            room_key = room_keys[extra['roomId']] = sdk_models.RoomKey.from_dict(extra['roomKey'])
+        ingest(room_key, data[16], level)
+
+
+def bench(engine: VoteEngine, commands, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        engine.start(3600)
+        start = time.perf_counter()
+        run_engine(engine, commands)
+        best = min(best, time.perf_counter() - start)
+        engine.stop()
+    return best
+
+
+def bench_snapshot(engine: VoteEngine, repeat=10000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        engine.snapshot()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='投票统计核心基准测试')
+    parser.add_argument('paths', nargs='*', help='录制文件、录制目录或每行一条JSON的文本文件')
+    parser.add_argument('-n', '--count', type=int, default=200000, help='不指定文件时生成的消息数')
+    parser.add_argument('--unique-voters', type=int, default=50000, help='不指定文件时不同uid的数量')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='重复次数，取最快的一次')
+    parser.add_argument('--regex', action='store_true', help='使用不能按字面值匹配的正则表达式')
+    parser.add_argument(
+        '--cache-size', type=int, default=vote_matcher.DEFAULT_CONFIG['match_cache_size'],
+        help='匹配缓存大小，0表示不缓存'
+    )
+    args = parser.parse_args()
+
+    commands = load_commands(args)
+    if not commands:
+        print('没有弹幕消息')
+        return 1
+
+    engine = VoteEngine()
+    options = vote_matcher.MatcherOptions(match_cache_size=args.cache_size)
+    engine.set_patterns(REGEX_PATTERNS if args.regex else DEFAULT_PATTERNS, options)
+    elapsed = bench(engine, commands, args.repeat)
+
+    # 再统计一次，用于输出计入的票数和快照耗时
+    engine.start(3600)
+    run_engine(engine, commands)
+    snapshot = engine.snapshot()
+    snapshot_cost = bench_snapshot(engine)
+    engine.stop()
+
+    print(f'弹幕数: {len(commands)}，匹配方式: {engine.matcher.mode}')
+    print(f'计入票数: {snapshot.merged.total_votes}，房间数: {len(snapshot.rooms)}')
+    print(f'吞吐量: {len(commands) / elapsed:,.0f} 弹幕/秒，单条 {elapsed / len(commands) * 1e6:.2f} us')
+    print(f'快照耗时: {snapshot_cost * 1e6:.2f} us')
+    cache_stats = engine.matcher.get_cache_stats()
+    if cache_stats is not None:
+        print(f'匹配缓存命中率: {cache_stats["hit_rate"]:.1%}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
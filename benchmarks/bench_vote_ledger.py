@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+投票记录内存占用基准测试，对比dict和VoteLedger
+
+用法：
+    python benchmarks/bench_vote_ledger.py [-n 1000000]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vote_ledger import VoteLedger
+
+
+def generate_uids(count, seed=0):
+    """生成类似Open ID的uid"""
+    rng = random.Random(seed)
+    return [
+        f'{rng.getrandbits(32):08x}-{rng.getrandbits(16):04x}-{rng.getrandbits(16):04x}-'
+        f'{rng.getrandbits(16):04x}-{rng.getrandbits(48):012x}'
+        for _ in range(count)
+    ]
+
+
+def build_dict(uids):
+    records = {}
+    for uid in uids:
+        if uid not in records:
+            records[uid] = 1
+    return records
+
+
+def build_ledger(uids):
+    ledger = VoteLedger()
+    for uid in uids:
+        ledger.add(uid, 1)
+    return ledger
+
+
+def measure_memory(build, uids):
+    """
+    测量容器占用的内存，包括容器保留的uid字符串
+
+    uid字符串在循环里逐个复制出来，模拟每条弹幕解码出一个新的字符串，容器不保留的字符串会被立即释放
+    """
+    gc.collect()
+    tracemalloc.start()
+    container = build(''.join(uid) for uid in map(list, uids))
+    gc.collect()
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del container
+    return current
+
+
+def measure_time(build, uids):
+    """tracemalloc会拖慢分配，所以单独测量插入和查询的耗时"""
+    gc.collect()
+    start_time = time.perf_counter()
+    container = build(uids)
+    insert_elapsed = time.perf_counter() - start_time
+
+    sample = uids[:100000]
+    start_time = time.perf_counter()
+    for uid in sample:
+        _ = uid in container
+    lookup_elapsed = time.perf_counter() - start_time
+    assert len(container) == len(uids)
+    return insert_elapsed / len(uids), lookup_elapsed / len(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='投票记录内存占用基准测试')
+    parser.add_argument('-n', '--count', type=int, default=1_000_000, help='不同投票者的数量')
+    args = parser.parse_args()
+
+    uids = generate_uids(args.count)
+    print(f'投票者数量: {args.count:,}')
+    print(f'{"容器":<12}{"总内存(MB)":>12}{"每人(字节)":>12}{"插入(us)":>10}{"查询(us)":>10}')
+    for name, build in (('dict', build_dict), ('VoteLedger', build_ledger)):
+        memory = measure_memory(build, uids)
+        insert_time, lookup_time = measure_time(build, uids)
+        print(
+            f'{name:<12}{memory / 1e6:>12.1f}{memory / args.count:>12.1f}'
+            f'{insert_time * 1e6:>10.2f}{lookup_time * 1e6:>10.2f}'
+        )
+
+    ledger = build_ledger(uids)
+    start_time = time.perf_counter()
+    ledger.clear()
+    print(f'VoteLedger.clear(): {(time.perf_counter() - start_time) * 1e6:.1f}us')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+生成和读取基准测试用的插件WebSocket消息
+
+生成的消息和blivechat发给插件的消息格式完全一致，见blcsdk.models
+"""
+import json
+import os
+import random
+import time
+from typing import Iterable, Iterator, List, Optional
+
+import blcsdk.models as sdk_models
+import recorder
+
+# 非投票弹幕的内容
+CHAT_CONTENTS = [
+    '草', '哈哈哈哈哈哈', '好耶', '来了来了', '？？？', '太好看了吧', '这集神了', '前排', '下周见',
+    '呜呜呜', '名场面', '打卡', '泪目', '经典', 'awsl', '8888888', '辛苦了', '好活当赏',
+]
+
+
+def make_add_text_data(
+    content: str,
+    uid: str,
+    *,
+    author_name: str = '',
+    timestamp: Optional[int] = None,
+    msg_id: str = '',
+) -> list:
+    """生成ADD_TEXT消息的data，字段顺序见AddTextMsg.from_command"""
+    if timestamp is None:
+        timestamp = int(time.time())
+    return [
+        '',  # avatarUrl
+        timestamp,
+        author_name or uid[:8],
+        sdk_models.AuthorType.NORMAL.value,
+        content,
+        sdk_models.GuardLevel.NONE.value,
+        0,  # isGiftDanmaku
+        1,  # authorLevel
+        0,  # isNewbie
+        1,  # isMobileVerified
+        0,  # medalLevel
+        msg_id,
+        '',  # translation
+        sdk_models.ContentType.TEXT.value,
+        [],  # contentTypeParams
+        [],  # textEmoticons
+        uid,
+        '',  # medalName
+    ]
+
+
+def make_extra(room_id: int = 1, is_from_plugin: bool = False) -> dict:
+    return {
+        'roomId': room_id,
+        'roomKey': {'type': sdk_models.RoomKeyType.ROOM_ID.value, 'value': room_id},
+        'isFromPlugin': is_from_plugin,
+    }
+
+
+def make_add_text_frame(content: str, uid: str, room_id: int = 1, **kwargs) -> str:
+    """生成一条ADD_TEXT消息的原始文本"""
+    return json.dumps({
+        'cmd': sdk_models.Command.ADD_TEXT.value,
+        'data': make_add_text_data(content, uid, **kwargs),
+        'extra': make_extra(room_id),
+    }, ensure_ascii=False)
+
+
+def generate_frames(
+    count: int,
+    *,
+    vote_ratio: float = 0.1,
+    unique_voters: int = 10000,
+    room_id: int = 1,
+    seed: Optional[int] = 0,
+) -> List[str]:
+    """
+    生成模拟弹幕消息
+
+    :param count: 消息数
+    :param vote_ratio: 投票弹幕（内容为1-5）的比例
+    :param unique_voters: 不同uid的数量，小于count时会有重复投票
+    :param room_id: 房间ID
+    :param seed: 随机数种子
+    """
+    rng = random.Random(seed)
+    uids = [f'{i:08x}-{rng.getrandbits(32):08x}-{rng.getrandbits(64):016x}' for i in range(unique_voters)]
+    frames = []
+    for i in range(count):
+        if rng.random() < vote_ratio:
+            content = str(rng.randint(1, 5))
+        else:
+            content = rng.choice(CHAT_CONTENTS)
+        frames.append(make_add_text_frame(content, rng.choice(uids), room_id, msg_id=str(i)))
+    return frames
+
+
+def load_frames(paths: Iterable[str]) -> Iterator[str]:
+    """读取录制的消息，可以是录制文件（*.rec.gz）、录制目录或每行一条JSON的文本文件"""
+    for path in paths:
+        if os.path.isdir(path) or path.endswith(recorder.SEGMENT_SUFFIX):
+            for _recv_time, frame in recorder.iter_recordings([path]):
+                yield frame
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
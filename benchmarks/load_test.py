@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+端到端负载测试
+
+在本进程内启动blivechat替身服务器和完整的插件流程（NetworkWorker -> blcsdk -> VoteHandler -> VoteEngine，同时运行VoteFrame），
+按指定速率回放弹幕，统计持续吞吐量和从消息发出到投票被计入的延迟
+
+用法：
+    python benchmarks/load_test.py --rate 5000 --count 100000
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wx
+
+import frames as bench_frames
+import listener
+import main as plugin_main
+import stub_server
+from gui import VoteFrame
+
+_app: Optional[wx.App] = None
+
+
+def start_shut_down():
+    """blivechat断开时调用"""
+    if _app is not None and _app.IsMainLoopRunning():
+        _app.ExitMainLoop()
+
+
+def generate_load(count: int, vote_ratio: float, seed: int = 0) -> Tuple[List[str], Dict[int, str]]:
+    """
+    生成负载，每张投票的uid都不同，所以每张投票都会被计入
+
+    :return: (原始消息, 消息序号 -> 投票的uid)
+    """
+    rng = random.Random(seed)
+    frames = []
+    vote_uids = {}
+    for index in range(count):
+        if rng.random() < vote_ratio:
+            uid = f'voter-{index}'
+            vote_uids[index] = uid
+            frame = bench_frames.make_add_text_frame(str(rng.randint(1, 5)), uid, msg_id=str(index))
+        else:
+            uid = f'viewer-{rng.randrange(10000)}'
+            frame = bench_frames.make_add_text_frame(rng.choice(bench_frames.CHAT_CONTENTS), uid, msg_id=str(index))
+        frames.append(frame)
+    return frames, vote_uids
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return float('nan')
+    index = min(int(len(sorted_values) * p), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class StubServerThread:
+    """在单独的线程运行替身服务器，模拟blivechat进程"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.server: Optional[stub_server.StubBlcServer] = None
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self.server = stub_server.StubBlcServer()
+        self.run(self.server.start()).result(10)
+
+    def stop(self):
+        self.run(self.server.stop()).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(10)
+
+    def run(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+def run_load_test(args):
+    global _app
+    frames, vote_uids = generate_load(args.count, args.vote_ratio)
+    uid_to_index = {uid: index for index, uid in vote_uids.items()}
+    send_times: List[float] = [0.0] * len(frames)
+    count_times: Dict[str, float] = {}
+
+    stub = StubServerThread()
+    stub.start()
+    # blcsdk.init从环境变量读取blivechat的端口和token
+    os.environ.update(stub.server.env)
+
+    _app = wx.App(False)
+    frame = VoteFrame(None)
+
+    engine = listener.vote_engine
+    original_ingest = engine.ingest
+
+    def ingest(room_key, uid: str, level: int):
+        is_counted = original_ingest(room_key, uid, level)
+        count_times.setdefault(uid, time.perf_counter())
+        return is_counted
+    engine.ingest = ingest
+
+    network_worker = plugin_main.NetworkWorker()
+    listener.set_shut_down_handler(lambda: wx.CallAfter(start_shut_down))
+    network_worker.init()
+    stub.run(stub.server.wait_plugin_connected()).result(10)
+
+    # 开始一次足够长的统计
+    frame.minutes_entry.SetValue('600')
+    frame.seconds_entry.SetValue('0')
+    frame.start_counting(None)
+
+    def on_sent(index, send_time):
+        send_times[index] = send_time
+
+    print(f'回放 {len(frames)} 条消息（其中投票 {len(vote_uids)} 条），目标速率 {args.rate or "不限"} 条/秒')
+    replay_future = stub.run(stub.server.replay(frames, args.rate, on_sent))
+    replay_elapsed = [0.0]
+    deadline = [0.0]
+
+    def poll_finished():
+        if not replay_future.done():
+            wx.CallLater(50, poll_finished)
+            return
+        if not deadline[0]:
+            replay_elapsed[0] = replay_future.result()
+            deadline[0] = time.perf_counter() + args.drain_timeout
+        if len(count_times) < len(vote_uids) and time.perf_counter() < deadline[0]:
+            wx.CallLater(50, poll_finished)
+            return
+        _app.ExitMainLoop()
+    wx.CallLater(50, poll_finished)
+    _app.MainLoop()
+
+    frame.update_timer.Stop()
+    frame.stop_counting(None)
+    listener.shut_down()
+    network_worker.start_shut_down()
+    network_worker.join(10)
+    stub.stop()
+
+    latencies = sorted(
+        count_time - send_times[uid_to_index[uid]]
+        for uid, count_time in count_times.items()
+        if uid in uid_to_index
+    )
+    first_send = send_times[0]
+    last_count = max(count_times.values(), default=first_send)
+    total_elapsed = max(last_count - first_send, replay_elapsed[0], 1e-9)
+
+    result = {
+        'frames': len(frames),
+        'votes_sent': len(vote_uids),
+        'votes_counted': len(latencies),
+        'messages_per_sec': len(frames) / total_elapsed,
+        'votes_per_sec': len(latencies) / total_elapsed,
+        'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'latency_mean_ms': (statistics.fmean(latencies) * 1000) if latencies else float('nan'),
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端负载测试')
+    parser.add_argument('--rate', type=float, default=5000, help='每秒回放的消息数，0表示尽快发送')
+    parser.add_argument('--count', type=int, default=50000, help='消息数')
+    parser.add_argument('--vote-ratio', type=float, default=0.3, help='投票弹幕的比例')
+    parser.add_argument('--drain-timeout', type=float, default=10, help='回放结束后等待投票被计入的最长秒数')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+
+    result = run_load_test(args)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return 0 if result['votes_counted'] == result['votes_sent'] else 1
+
+    print(f'消息数:         {result["frames"]}')
+    print(f'投票计入/发送:  {result["votes_counted"]}/{result["votes_sent"]}')
+    print(f'持续吞吐量:     {result["messages_per_sec"]:,.0f} 消息/秒，{result["votes_per_sec"]:,.0f} 票/秒')
+    print(
+        f'计入延迟:       p50={result["latency_p50_ms"]:.1f}ms，p99={result["latency_p99_ms"]:.1f}ms，'
+        f'平均={result["latency_mean_ms"]:.1f}ms'
+    )
+    return 0 if result['votes_counted'] == result['votes_sent'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
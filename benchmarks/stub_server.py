@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地的blivechat替身服务器，用于在没有blivechat的情况下测试插件
+
+实现了插件用到的接口：
+- /api/plugin/websocket：发送BLC_INIT、心跳、房间消息，接收插件的心跳、日志、发送弹幕请求
+- /api/plugin/rooms：返回房间列表
+
+单独运行时启动服务器，按指定速率回放录制的或生成的弹幕，并可以启动插件进程：
+    python benchmarks/stub_server.py --rate 1000 -- python main.py
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import aiohttp
+from aiohttp import web
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blcsdk
+import blcsdk.models as sdk_models
+import frames as bench_frames
+
+logger = logging.getLogger('stub-server')
+
+HEARTBEAT_INTERVAL = 10
+"""发送心跳的间隔，插件客户端超过35秒没有收到消息就会断开"""
+
+
+class StubBlcServer:
+    """
+    blivechat替身服务器
+
+    :param port: 监听端口，0表示自动分配
+    :param token: 插件认证用的token，默认随机生成
+    :param room_ids: 房间ID列表
+    :param plugin_id: BLC_INIT里的插件ID
+    """
+
+    def __init__(
+        self,
+        *,
+        port: int = 0,
+        token: Optional[str] = None,
+        room_ids: Sequence[int] = (1,),
+        plugin_id: str = 'niconico-rating',
+    ):
+        self.port = port
+        self.token = token if token is not None else secrets.token_hex(16)
+        self.room_ids = list(room_ids)
+        self.plugin_id = plugin_id
+
+        self._runner: Optional[web.AppRunner] = None
+        self._websockets: List[web.WebSocketResponse] = []
+        self._plugin_connected_event = asyncio.Event()
+        self.received_commands: List[dict] = []
+        """插件发来的非心跳消息"""
+        self.blc_init_time: Optional[float] = None
+        """第一次发送BLC_INIT的time.perf_counter()，即插件连接上的时间"""
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """启动插件进程时需要设置的环境变量"""
+        return {'BLC_PORT': str(self.port), 'BLC_TOKEN': self.token}
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/plugin/websocket', self._handle_websocket)
+        app.router.add_get('/api/plugin/rooms', self._handle_get_rooms)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # noqa
+        logger.info('Stub server listening on port %d', self.port)
+
+    async def stop(self):
+        for websocket in list(self._websockets):
+            await websocket.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def wait_plugin_connected(self, timeout: Optional[float] = None):
+        await asyncio.wait_for(self._plugin_connected_event.wait(), timeout)
+
+    def _check_auth(self, request: web.Request):
+        if request.headers.get('Authorization', '') != f'Bearer {self.token}':
+            raise web.HTTPForbidden()
+
+    async def _handle_get_rooms(self, request: web.Request):
+        self._check_auth(request)
+        return web.json_response({'rooms': [
+            {'roomId': room_id, 'roomKey': self._make_room_key_dict(room_id)}
+            for room_id in self.room_ids
+        ]})
+
+    @staticmethod
+    def _make_room_key_dict(room_id):
+        return {'type': sdk_models.RoomKeyType.ROOM_ID.value, 'value': room_id}
+
+    async def _handle_websocket(self, request: web.Request):
+        self._check_auth(request)
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self._websockets.append(websocket)
+        heartbeat_task = asyncio.create_task(self._send_heartbeats(websocket))
+        try:
+            await self._send_cmd_data(websocket, sdk_models.Command.BLC_INIT, {
+                'blcVersion': 'stub',
+                'sdkVersion': blcsdk.__version__,
+                'pluginId': self.plugin_id,
+            })
+            if self.blc_init_time is None:
+                self.blc_init_time = time.perf_counter()
+            self._plugin_connected_event.set()
+
+            async for message in websocket:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                self._on_plugin_command(message.json())
+        finally:
+            heartbeat_task.cancel()
+            self._websockets.remove(websocket)
+        return websocket
+
+    async def _send_heartbeats(self, websocket: web.WebSocketResponse):
+        while not websocket.closed:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self._send_cmd_data(websocket, sdk_models.Command.HEARTBEAT, {})
+            except ConnectionResetError:
+                break
+
+    @staticmethod
+    async def _send_cmd_data(websocket: web.WebSocketResponse, cmd: sdk_models.Command, data, extra=None):
+        body = {'cmd': cmd.value, 'data': data}
+        if extra is not None:
+            body['extra'] = extra
+        await websocket.send_str(json.dumps(body, ensure_ascii=False))
+
+    def _on_plugin_command(self, command: dict):
+        cmd = command['cmd']
+        if cmd == sdk_models.Command.HEARTBEAT:
+            return
+        self.received_commands.append(command)
+        if cmd == sdk_models.Command.LOG_REQ:
+            logger.info('Plugin log: %s', command['data']['msg'])
+
+    async def broadcast(self, frame: str):
+        """发送一条原始消息给所有插件"""
+        for websocket in self._websockets:
+            await websocket.send_str(frame)
+
+    async def send_add_room(self, room_id: int):
+        """模拟添加房间并初始化成功"""
+        extra = {'roomId': None, 'roomKey': self._make_room_key_dict(room_id), 'isFromPlugin': False}
+        for websocket in self._websockets:
+            await self._send_cmd_data(websocket, sdk_models.Command.ADD_ROOM, {}, extra)
+        extra = {**extra, 'roomId': room_id}
+        for websocket in self._websockets:
+            await self._send_cmd_data(websocket, sdk_models.Command.ROOM_INIT, {'isSuccess': True}, extra)
+
+    async def replay(
+        self,
+        frames: Sequence[str],
+        rate: float,
+        on_sent: Optional[Callable[[int, float], None]] = None,
+    ) -> float:
+        """
+        按指定速率回放消息
+
+        :param frames: 原始消息
+        :param rate: 每秒发送的消息数，0表示尽快发送
+        :param on_sent: 每条消息发送后调用，参数是消息序号和发送时的time.perf_counter()
+        :return: 实际用时（秒）
+        """
+        start_time = time.perf_counter()
+        for index, frame in enumerate(frames):
+            if rate > 0:
+                delay = start_time + index / rate - time.perf_counter()
+                if delay > 0.001:
+                    await asyncio.sleep(delay)
+            elif index % 100 == 0:
+                await asyncio.sleep(0)
+
+            await self.broadcast(frame)
+            if on_sent is not None:
+                on_sent(index, time.perf_counter())
+        return time.perf_counter() - start_time
+
+
+def load_or_generate_frames(args) -> List[str]:
+    if args.frames:
+        return list(bench_frames.load_frames(args.frames))
+    return bench_frames.generate_frames(args.count, vote_ratio=args.vote_ratio, room_id=args.room_ids[0])
+
+
+async def run_cli(args):
+    server = StubBlcServer(port=args.port, token=args.token, room_ids=args.room_ids)
+    await server.start()
+    print(f'BLC_PORT={server.port}')
+    print(f'BLC_TOKEN={server.token}')
+
+    process = None
+    if args.command:
+        process = subprocess.Popen(args.command, env={**os.environ, **server.env})
+    try:
+        print('等待插件连接...')
+        await server.wait_plugin_connected()
+        frames = load_or_generate_frames(args)
+        print(f'开始回放 {len(frames)} 条消息，速率 {args.rate or "不限"} 条/秒')
+        elapsed = await server.replay(frames, args.rate)
+        print(f'回放完成，用时 {elapsed:.2f} 秒，实际速率 {len(frames) / max(elapsed, 1e-9):.0f} 条/秒')
+
+        while process is None or process.poll() is None:
+            await asyncio.sleep(1)
+    finally:
+        await server.stop()
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='blivechat替身服务器')
+    parser.add_argument('--port', type=int, default=12450, help='监听端口')
+    parser.add_argument('--token', default=None, help='插件认证用的token，默认随机生成')
+    parser.add_argument('--room-ids', type=int, nargs='+', default=[1], help='房间ID列表')
+    parser.add_argument('--rate', type=float, default=100, help='每秒回放的消息数，0表示尽快发送')
+    parser.add_argument('--count', type=int, default=10000, help='不指定录制文件时生成的消息数')
+    parser.add_argument('--vote-ratio', type=float, default=0.1, help='生成的消息中投票弹幕的比例')
+    parser.add_argument('--frames', nargs='*', default=[], help='录制文件、录制目录或每行一条JSON的文本文件')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='插件启动命令，放在--之后')
+    args = parser.parse_args()
+    if args.command and args.command[0] == '--':
+        args.command = args.command[1:]
+
+    logging.basicConfig(format='{asctime} {levelname} [{name}]: {message}', style='{', level=logging.INFO)
+    try:
+        asyncio.run(run_cli(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
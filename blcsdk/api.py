@@ -20,6 +20,9 @@ __all__ = (
     'init',
     'shut_down',
     'set_msg_handler',
+    'set_frame_recorder',
+    'set_stats_hook',
+    'get_ingest_stats',
     'is_sdk_version_compatible',
     'get_blc_port',
     'get_blc_version',
@@ -55,13 +58,21 @@ _msg_handler: Optional[handlers.HandlerInterface] = None
 """插件消息处理器"""
 _msg_handler_wrapper: Optional['_HandlerWrapper'] = None
 """用于SDK处理一些消息，然后转发给插件消息处理器"""
+_frame_recorder: Optional[cli.FrameRecordFunc] = None
+"""录制原始消息的函数"""
+_stats_hook: Optional[cli.StatsHookInterface] = None
+"""统计各阶段耗时的钩子"""
 
 
-async def init():
+async def init(*, ingest_queue_size: int = 0, overflow_policy: Union[str, cli.OverflowPolicy] = 'block'):
     """
     初始化SDK
 
     在调用除了set_msg_handler以外的其他接口之前必须先调用这个。如果抛出任何异常，应该退出当前程序
+
+    :param ingest_queue_size: 大于0时开启接收队列，接收消息和调用消息处理器在不同的协程，处理器慢的时候不会卡住接收。
+                              这是队列中最多的房间内消息数，0表示不开启
+    :param overflow_policy: 接收队列满时的处理方式，见OverflowPolicy
     """
     try:
         global _blc_port, _blc_base_url, _token, _init_future, _init_msg, _http_session, _plugin_client, \
@@ -83,8 +94,15 @@ async def init():
 
         # 连接blivechat
         _msg_handler_wrapper = _HandlerWrapper()
-        _plugin_client = cli.BlcPluginClient(blc_ws_url, session=_http_session)
+        _plugin_client = cli.BlcPluginClient(
+            blc_ws_url,
+            session=_http_session,
+            ingest_queue_size=ingest_queue_size,
+            overflow_policy=cli.OverflowPolicy(overflow_policy),
+        )
         _plugin_client.set_handler(_msg_handler_wrapper)
+        _plugin_client.set_frame_recorder(_frame_recorder)
+        _plugin_client.set_stats_hook(_stats_hook)
         _plugin_client.start()
 
         # 等待初始化消息
@@ -117,6 +135,37 @@ def set_msg_handler(handler: Optional[handlers.HandlerInterface]):
     _msg_handler = handler
 
 
+def set_frame_recorder(recorder: Optional[cli.FrameRecordFunc]):
+    """
+    设置录制原始消息的函数，可以在init之前调用
+
+    :param recorder: 录制函数，参数是原始消息文本和接收时的time.time()，None表示不录制
+    """
+    global _frame_recorder
+    _frame_recorder = recorder
+    if _plugin_client is not None:
+        _plugin_client.set_frame_recorder(recorder)
+
+
+def set_stats_hook(stats_hook: Optional[cli.StatsHookInterface]):
+    """
+    设置统计各阶段耗时的钩子，可以在init之前调用
+
+    :param stats_hook: 统计钩子，见StatsHookInterface，None表示不统计
+    """
+    global _stats_hook
+    _stats_hook = stats_hook
+    if _plugin_client is not None:
+        _plugin_client.set_stats_hook(stats_hook)
+
+
+def get_ingest_stats() -> Optional[dict]:
+    """取接收队列的统计，见BlcPluginClient.get_ingest_stats。没有开启接收队列时返回None"""
+    if _plugin_client is None:
+        return None
+    return _plugin_client.get_ingest_stats()
+
+
 class _HandlerWrapper(handlers.HandlerInterface):
     """用于SDK处理一些消息，然后转发给插件消息处理器"""
 
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import collections
+import enum
+import json
 import logging
+import time
 from typing import *
 
 import aiohttp
@@ -9,11 +13,180 @@ from . import handlers
 from . import models
 
 __all__ = (
+    'OverflowPolicy',
+    'StatsHookInterface',
     'BlcPluginClient',
 )
 
 logger = logging.getLogger('blcsdk')
 
+JsonLoads = Callable[[Union[str, bytes]], Any]
+FrameRecordFunc = Callable[[str, float], Any]
+"""录制原始消息的函数，参数是原始消息文本和接收时的time.time()"""
+
+
+class StatsHookInterface:
+    """
+    网络协程各阶段的统计钩子，用于导出运行指标
+
+    在网络协程中对每条消息同步调用，实现应该只做计数之类的轻量操作，不能抛出异常。耗时都是time.perf_counter()的差
+    """
+
+    def on_frame_decoded(self, cmd: Optional[int], decode_seconds: float):
+        """
+        收到并解码了一条文本消息
+
+        :param cmd: 消息类型，解码后没有cmd时为None
+        :param decode_seconds: 解码耗时
+        """
+
+    def on_command_handled(self, cmd: Optional[int], handle_seconds: float, queue_seconds: Optional[float]):
+        """
+        消息处理器处理完一条消息
+
+        :param cmd: 消息类型
+        :param handle_seconds: 消息处理器的耗时
+        :param queue_seconds: 在接收队列中等待的时间，没有开启接收队列时为None
+        """
+
+
+def get_default_json_loads() -> JsonLoads:
+    """取已安装的最快的JSON解码函数，优先级：orjson > msgspec > 标准库json"""
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        pass
+    try:
+        import msgspec.json
+        return msgspec.json.decode
+    except ImportError:
+        pass
+    return json.loads
+
+
+class OverflowPolicy(str, enum.Enum):
+    """接收队列满时的处理方式。控制消息（BLC_INIT、ADD_ROOM等）在任何方式下都不会被丢弃，也不受队列长度限制"""
+    BLOCK = 'block'
+    """暂停接收，等待队列有空位"""
+    DROP_NON_TEXT = 'drop_non_text'
+    """丢弃弹幕以外的房间内消息（礼物、上舰、醒目留言等），只剩弹幕时暂停接收"""
+    DROP_OLDEST = 'drop_oldest'
+    """丢弃队列中最早的房间内消息，包括弹幕"""
+
+
+_ROOM_MSG_COMMANDS = frozenset((
+    models.Command.ADD_TEXT,
+    models.Command.ADD_GIFT,
+    models.Command.ADD_MEMBER,
+    models.Command.ADD_SUPER_CHAT,
+    models.Command.DEL_SUPER_CHAT,
+    models.Command.UPDATE_TRANSLATION,
+))
+"""可以丢弃的房间内消息，其他都是控制消息"""
+
+_CONSUMER_BATCH_SIZE = 100
+"""消费协程每处理这么多条消息让出一次事件循环，让接收消息和发心跳包的协程运行"""
+
+
+class _IngestQueue:
+    """
+    接收消息和处理消息之间的有界队列
+
+    :param max_size: 队列中最多的房间内消息数
+    :param policy: 队列满时的处理方式
+    """
+
+    def __init__(self, max_size: int, policy: OverflowPolicy):
+        self._max_size = max_size
+        self._policy = policy
+        self._commands: Deque[Tuple[dict, float]] = collections.deque()
+        """(消息, 放入时的time.perf_counter())"""
+        self._room_msg_count = 0
+        """队列中房间内消息的数量，只有它受max_size限制"""
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+        self.max_depth = 0
+        """队列最长时的消息数"""
+        self.block_count = 0
+        """因为队列满暂停接收的次数"""
+        self.dropped_counts: Dict[int, int] = {}
+        """cmd -> 丢弃的消息数"""
+
+    def __len__(self):
+        return len(self._commands)
+
+    async def put(self, command: dict):
+        """放入一条解码后的消息，队列满时按处理方式丢弃消息或者等待队列有空位。等待的时间也算在队列中的时间"""
+        enqueue_time = time.perf_counter()
+        cmd = command.get('cmd', None)
+        if cmd in _ROOM_MSG_COMMANDS:
+            yielded = False
+            while self._room_msg_count >= self._max_size:
+                if not yielded and self._policy is not OverflowPolicy.BLOCK:
+                    # 连续收到已经缓冲的消息时接收协程不会让出事件循环，消费协程没有机会处理。
+                    # 丢弃之前先让出一次，处理器跟得上时队列就不满了，只有仍然满时才丢弃
+                    yielded = True
+                    await asyncio.sleep(0)
+                    continue
+                if self._policy is OverflowPolicy.DROP_NON_TEXT:
+                    if cmd != models.Command.ADD_TEXT:
+                        self._count_dropped(cmd)
+                        return
+                elif self._policy is OverflowPolicy.DROP_OLDEST:
+                    if self._drop_oldest_room_msg():
+                        continue
+                # 暂停接收
+                self.block_count += 1
+                self._not_full.clear()
+                await self._not_full.wait()
+            self._room_msg_count += 1
+
+        commands = self._commands
+        commands.append((command, enqueue_time))
+        if len(commands) > self.max_depth:
+            self.max_depth = len(commands)
+        self._not_empty.set()
+
+    def _drop_oldest_room_msg(self) -> bool:
+        commands = self._commands
+        for index, (command, _enqueue_time) in enumerate(commands):
+            cmd = command.get('cmd', None)
+            if cmd in _ROOM_MSG_COMMANDS:
+                del commands[index]
+                self._room_msg_count -= 1
+                self._count_dropped(cmd)
+                return True
+        return False
+
+    def _count_dropped(self, cmd: int):
+        self.dropped_counts[cmd] = self.dropped_counts.get(cmd, 0) + 1
+
+    async def get(self) -> Tuple[dict, float]:
+        """
+        :return: (消息, 放入时的time.perf_counter())
+        """
+        commands = self._commands
+        while not commands:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        item = commands.popleft()
+        if item[0].get('cmd', None) in _ROOM_MSG_COMMANDS:
+            self._room_msg_count -= 1
+            if self._room_msg_count < self._max_size:
+                self._not_full.set()
+        return item
+
+    def pop_all(self) -> List[Tuple[dict, float]]:
+        """取出队列中剩下的所有消息"""
+        items = list(self._commands)
+        self._commands.clear()
+        self._room_msg_count = 0
+        self._not_full.set()
+        return items
+
 
 class BlcPluginClient:
     """
@@ -22,6 +195,10 @@ class BlcPluginClient:
     :param ws_url: blivechat消息转发服务WebSocket地址
     :param session: 连接池
     :param heartbeat_interval: 发送心跳包的间隔时间（秒）
+    :param json_loads: 解码消息用的JSON解码函数，默认自动选择已安装的最快的实现
+    :param ingest_queue_size: 大于0时开启接收队列：接收协程只负责接收和解码，把消息放进队列，由单独的协程调用消息处理器，
+                              处理器慢的时候不会卡住接收。这是队列中最多的房间内消息数。0表示在接收协程中直接处理
+    :param overflow_policy: 接收队列满时的处理方式
     """
 
     def __init__(
@@ -30,6 +207,9 @@ class BlcPluginClient:
         *,
         session: Optional[aiohttp.ClientSession] = None,
         heartbeat_interval: float = 30,
+        json_loads: Optional[JsonLoads] = None,
+        ingest_queue_size: int = 0,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
     ):
         self._ws_url = ws_url
 
@@ -42,9 +222,16 @@ class BlcPluginClient:
             assert self._session.loop is asyncio.get_event_loop()  # noqa
 
         self._heartbeat_interval = heartbeat_interval
+        self._json_loads = json_loads if json_loads is not None else get_default_json_loads()
+        self._ingest_queue_size = ingest_queue_size
+        self._overflow_policy = OverflowPolicy(overflow_policy)
 
         self._handler: Optional[handlers.HandlerInterface] = None
         """消息处理器"""
+        self._frame_recorder: Optional[FrameRecordFunc] = None
+        """录制原始消息的函数"""
+        self._stats_hook: Optional[StatsHookInterface] = None
+        """统计各阶段耗时的钩子"""
 
         # 在运行时初始化的字段
         self._websocket: Optional[aiohttp.ClientWebSocketResponse] = None
@@ -53,6 +240,8 @@ class BlcPluginClient:
         """网络协程的future"""
         self._heartbeat_timer_handle: Optional[asyncio.TimerHandle] = None
         """发心跳包定时器的handle"""
+        self._ingest_queue: Optional[_IngestQueue] = None
+        """接收队列，没有开启时为None"""
 
     @property
     def is_running(self) -> bool:
@@ -70,6 +259,47 @@ class BlcPluginClient:
         """
         self._handler = handler
 
+    def set_frame_recorder(self, recorder: Optional[FrameRecordFunc]):
+        """
+        设置录制原始消息的函数
+
+        收到的每条文本消息在解码之前都会以原始文本调用它，它和网络协程运行在同一个协程，应该只做入队之类的轻量操作
+
+        :param recorder: 录制函数，None表示不录制
+        """
+        self._frame_recorder = recorder
+
+    def set_stats_hook(self, stats_hook: Optional[StatsHookInterface]):
+        """
+        设置统计钩子，没有设置时不会额外计时
+
+        :param stats_hook: 统计钩子，None表示不统计
+        """
+        self._stats_hook = stats_hook
+
+    def get_ingest_stats(self) -> Optional[dict]:
+        """
+        接收队列的统计，没有开启接收队列或者没有连接时返回None
+
+        - depth: 当前队列中的消息数
+        - max_depth: 队列最长时的消息数
+        - capacity: 队列中最多的房间内消息数
+        - policy: 队列满时的处理方式
+        - block_count: 因为队列满暂停接收的次数
+        - dropped: cmd的名字 -> 丢弃的消息数
+        """
+        ingest_queue = self._ingest_queue
+        if ingest_queue is None:
+            return None
+        return {
+            'depth': len(ingest_queue),
+            'max_depth': ingest_queue.max_depth,
+            'capacity': self._ingest_queue_size,
+            'policy': self._overflow_policy.value,
+            'block_count': ingest_queue.block_count,
+            'dropped': {models.Command(cmd).name: count for cmd, count in ingest_queue.dropped_counts.items()},
+        }
+
     def start(self):
         """启动本客户端"""
         if self.is_running:
@@ -153,14 +383,55 @@ class BlcPluginClient:
                 await self._on_ws_connect()
 
                 # 处理消息
-                message: aiohttp.WSMessage
-                async for message in websocket:
-                    self._on_ws_message(message)
+                if self._ingest_queue_size > 0:
+                    await self._receive_to_queue(websocket)
+                else:
+                    message: aiohttp.WSMessage
+                    async for message in websocket:
+                        command = self._on_ws_message(message)
+                        if command is not None:
+                            self._handle_command(command, None)
         finally:
             self._websocket = None
             await self._on_ws_close()
         # 插件消息都是本地通信的，这里不可能是因为网络问题而掉线，所以不尝试重连
 
+    async def _receive_to_queue(self, websocket: aiohttp.ClientWebSocketResponse):
+        """接收消息放进接收队列，由_consumer_coroutine处理"""
+        self._ingest_queue = ingest_queue = _IngestQueue(self._ingest_queue_size, self._overflow_policy)
+        consumer_future = asyncio.create_task(self._consumer_coroutine(ingest_queue))
+        try:
+            message: aiohttp.WSMessage
+            async for message in websocket:
+                command = self._on_ws_message(message)
+                if command is not None:
+                    await ingest_queue.put(command)
+            # 连接断开时把已经收到的消息处理完，不丢弃。消费协程这时停在await上，不会和这里交错处理
+            for command, enqueue_time in ingest_queue.pop_all():
+                self._handle_command(command, enqueue_time)
+        finally:
+            consumer_future.cancel()
+            # 用wait等待，不会吞掉外层的取消
+            await asyncio.wait([consumer_future])
+            self._log_ingest_stats()
+
+    def _log_ingest_stats(self):
+        stats = self.get_ingest_stats()
+        if stats is None:
+            return
+        logger.info(
+            'Ingest queue stats: max_depth=%d, capacity=%d, policy=%s, block_count=%d, dropped=%s',
+            stats['max_depth'], stats['capacity'], stats['policy'], stats['block_count'], stats['dropped']
+        )
+
+    async def _consumer_coroutine(self, ingest_queue: _IngestQueue):
+        """从接收队列取消息调用消息处理器"""
+        while True:
+            for _ in range(_CONSUMER_BATCH_SIZE):
+                command, enqueue_time = await ingest_queue.get()
+                self._handle_command(command, enqueue_time)
+            await asyncio.sleep(0)
+
     async def _on_ws_connect(self):
         """WebSocket连接成功"""
         self._heartbeat_timer_handle = asyncio.get_running_loop().call_later(
@@ -193,31 +464,55 @@ class BlcPluginClient:
         except Exception:  # noqa
             logger.exception('Plugin client _send_heartbeat() failed:')
 
-    def _on_ws_message(self, message: aiohttp.WSMessage):
+    def _on_ws_message(self, message: aiohttp.WSMessage) -> Optional[dict]:
         """
         收到WebSocket消息
 
         :param message: WebSocket消息
+        :return: 解码后的业务消息，不是文本消息时返回None
         """
         if message.type != aiohttp.WSMsgType.TEXT:
             logger.warning('Unknown websocket message type=%s, data=%s', message.type, message.data)
-            return
+            return None
+
+        recorder = self._frame_recorder
+        if recorder is not None:
+            recorder(message.data, time.time())
 
+        stats_hook = self._stats_hook
+        start_time = time.perf_counter() if stats_hook is not None else 0.0
         try:
-            body = message.json()
-            self._handle_command(body)
+            command = self._json_loads(message.data)
         except Exception:
             logger.error('body=%s', message.data)
             raise
-
-    def _handle_command(self, command: dict):
+        # 业务消息都是JSON对象，其他值不放进接收队列，也不交给消息处理器
+        if not isinstance(command, dict):
+            logger.warning('Unknown command format, body=%s', message.data)
+            return None
+        if stats_hook is not None:
+            stats_hook.on_frame_decoded(command.get('cmd', None), time.perf_counter() - start_time)
+        return command
+
+    def _handle_command(self, command: dict, enqueue_time: Optional[float]):
         """
         处理业务消息
 
         :param command: 业务消息
+        :param enqueue_time: 放入接收队列时的time.perf_counter()，没有开启接收队列时为None
         """
-        if self._handler is not None:
-            try:
-                self._handler.handle(self, command)
-            except Exception as e:
-                logger.exception('Plugin client _handle_command() failed, command=%s', command, exc_info=e)
+        if self._handler is None:
+            return
+        stats_hook = self._stats_hook
+        start_time = time.perf_counter() if stats_hook is not None else 0.0
+        try:
+            self._handler.handle(self, command)
+        except Exception as e:
+            logger.exception('Plugin client _handle_command() failed, command=%s', command, exc_info=e)
+        if stats_hook is not None:
+            end_time = time.perf_counter()
+            stats_hook.on_command_handled(
+                command.get('cmd', None),
+                end_time - start_time,
+                start_time - enqueue_time if enqueue_time is not None else None,
+            )
@@ -6,6 +6,7 @@ from . import models
 
 __all__ = (
     'HandlerInterface',
+    'make_msg_callback',
     'BaseHandler',
 )
 
@@ -24,7 +25,12 @@ class HandlerInterface:
         """
 
 
-def _make_msg_callback(method_name, message_cls):
+def make_msg_callback(method_name, message_cls):
+    """
+    生成BaseHandler._CMD_CALLBACK_DICT里的处理回调：把业务消息转换成message_cls，然后调用名为method_name的方法
+
+    子类可以用它覆盖_CMD_CALLBACK_DICT里的项，例如用AddTextMsgView代替AddTextMsg
+    """
     def callback(self: 'BaseHandler', client: cli.BlcPluginClient, command: dict):
         method = getattr(self, method_name)
         msg = message_cls.from_command(command['data'])
@@ -43,25 +49,50 @@ class BaseHandler(HandlerInterface):
             Any
         ]]
     ] = {
-        models.Command.ADD_ROOM: _make_msg_callback('_on_add_room', models.AddRoomMsg),
-        models.Command.ROOM_INIT: _make_msg_callback('_on_room_init', models.RoomInitMsg),
-        models.Command.DEL_ROOM: _make_msg_callback('_on_del_room', models.DelRoomMsg),
-        models.Command.OPEN_PLUGIN_ADMIN_UI: _make_msg_callback(
+        models.Command.ADD_ROOM: make_msg_callback('_on_add_room', models.AddRoomMsg),
+        models.Command.ROOM_INIT: make_msg_callback('_on_room_init', models.RoomInitMsg),
+        models.Command.DEL_ROOM: make_msg_callback('_on_del_room', models.DelRoomMsg),
+        models.Command.OPEN_PLUGIN_ADMIN_UI: make_msg_callback(
             '_on_open_plugin_admin_ui', models.OpenPluginAdminUiMsg
         ),
-        models.Command.ADD_TEXT: _make_msg_callback('_on_add_text', models.AddTextMsg),
-        models.Command.ADD_GIFT: _make_msg_callback('_on_add_gift', models.AddGiftMsg),
-        models.Command.ADD_MEMBER: _make_msg_callback('_on_add_member', models.AddMemberMsg),
-        models.Command.ADD_SUPER_CHAT: _make_msg_callback('_on_add_super_chat', models.AddSuperChatMsg),
-        models.Command.DEL_SUPER_CHAT: _make_msg_callback('_on_del_super_chat', models.DelSuperChatMsg),
-        models.Command.UPDATE_TRANSLATION: _make_msg_callback('_on_update_translation', models.UpdateTranslationMsg),
+        models.Command.ADD_TEXT: make_msg_callback('_on_add_text', models.AddTextMsg),
+        models.Command.ADD_GIFT: make_msg_callback('_on_add_gift', models.AddGiftMsg),
+        models.Command.ADD_MEMBER: make_msg_callback('_on_add_member', models.AddMemberMsg),
+        models.Command.ADD_SUPER_CHAT: make_msg_callback('_on_add_super_chat', models.AddSuperChatMsg),
+        models.Command.DEL_SUPER_CHAT: make_msg_callback('_on_del_super_chat', models.DelSuperChatMsg),
+        models.Command.UPDATE_TRANSLATION: make_msg_callback('_on_update_translation', models.UpdateTranslationMsg),
     }
     """cmd -> 处理回调"""
 
+    _cmd_filter_dict: Optional[Dict[int, Callable[[dict], bool]]] = None
+    """cmd -> 预过滤函数，用set_command_filter设置"""
+
+    def set_command_filter(self, cmd: int, predicate: Optional[Callable[[dict], bool]]):
+        """
+        设置某种消息的预过滤函数
+
+        预过滤函数在构造消息对象之前调用，参数是原始的业务消息（包含cmd、data、extra），返回False则直接丢弃这条消息。
+        可以用来在高频消息中快速排除不关心的消息，省去构造消息对象的开销，所以预过滤函数本身应该尽量简单
+
+        :param cmd: 消息类型，见Command
+        :param predicate: 预过滤函数，None表示取消预过滤
+        """
+        filter_dict = dict(self._cmd_filter_dict or {})
+        if predicate is not None:
+            filter_dict[cmd] = predicate
+        else:
+            filter_dict.pop(cmd, None)
+        self._cmd_filter_dict = filter_dict or None
+
     def handle(self, client: cli.BlcPluginClient, command: dict):
         cmd = command['cmd']
         callback = self._CMD_CALLBACK_DICT.get(cmd, None)
         if callback is not None:
+            filter_dict = self._cmd_filter_dict
+            if filter_dict is not None:
+                predicate = filter_dict.get(cmd, None)
+                if predicate is not None and not predicate(command):
+                    return
             callback(self, client, command)
 
     def _on_add_room(self, client: cli.BlcPluginClient, message: models.AddRoomMsg, extra: models.ExtraData):
@@ -16,6 +16,7 @@ __all__ = (
     'GuardLevel',
     'ContentType',
     'AddTextMsg',
+    'AddTextMsgView',
     'AddGiftMsg',
     'AddMemberMsg',
     'AddSuperChatMsg',
@@ -250,6 +251,75 @@ class AddTextMsg:
         )
 
 
+def _data_field(index: int, doc: str, convert: Optional[Callable[[Any], Any]] = None) -> property:
+    if convert is None:
+        def getter(self: 'AddTextMsgView'):
+            return self._data[index]
+    else:
+        def getter(self: 'AddTextMsgView'):
+            return convert(self._data[index])
+    return property(getter, doc=doc)
+
+
+_UNSET = object()
+
+
+class AddTextMsgView:
+    """
+    弹幕消息的只读视图
+
+    直接包装原始的data列表，不复制字段，字段在访问时才解码。属性名和AddTextMsg相同，可以代替AddTextMsg传给_on_add_text，
+    用于在弹幕很多时减少对象分配。需要完整的消息对象时调用to_msg()
+
+    注意视图持有原始的data列表，不要修改它
+    """
+
+    __slots__ = ('_data', '_content_type_params')
+
+    def __init__(self, data: list):
+        self._data = data
+        self._content_type_params = _UNSET
+
+    @classmethod
+    def from_command(cls, data: list):
+        return cls(data)
+
+    def to_msg(self) -> AddTextMsg:
+        """转换成完整的AddTextMsg"""
+        return AddTextMsg.from_command(self._data)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(uid={self.uid!r}, content={self.content!r})'
+
+    avatar_url: str = _data_field(0, '用户头像URL')
+    timestamp: int = _data_field(1, '时间戳（秒）')
+    author_name: str = _data_field(2, '用户名')
+    author_type: int = _data_field(3, '用户类型，见AuthorType')
+    content: str = _data_field(4, '弹幕内容')
+    privilege_type: int = _data_field(5, '舰队等级，见GuardLevel')
+    is_gift_danmaku: bool = _data_field(6, '是否礼物弹幕', bool)
+    author_level: int = _data_field(7, '用户等级')
+    is_newbie: bool = _data_field(8, '是否正式会员', bool)
+    is_mobile_verified: bool = _data_field(9, '是否绑定手机', bool)
+    medal_level: int = _data_field(10, '勋章等级，如果没戴当前房间勋章则为0')
+    id: str = _data_field(11, '消息ID')
+    translation: str = _data_field(12, '弹幕内容翻译')
+    content_type: int = _data_field(13, '内容类型，见ContentType')
+    uid: str = _data_field(16, '用户Open ID或ID')
+    medal_name: str = _data_field(17, '勋章名')
+
+    @property
+    def content_type_params(self) -> Union[dict, list]:
+        """跟内容类型相关的参数"""
+        content_type_params = self._content_type_params
+        if content_type_params is _UNSET:
+            content_type_params = self._data[14]
+            if self._data[13] == ContentType.EMOTICON:
+                content_type_params = {'url': content_type_params[0]}
+            self._content_type_params = content_type_params
+        return content_type_params
+
+
 @dataclasses.dataclass
 class AddGiftMsg:
     """礼物消息"""
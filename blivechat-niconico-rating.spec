@@ -24,6 +24,7 @@ DATAS = [
     ('LICENSE', '.'),
     ('icon.ico', '.'),
     ('config.json', '.'),
+    ('sample_danmaku.txt', '.'),
     ('log/.gitkeep', 'log'),
 ]
 
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+"""配置文件在插件目录下，文件名是config.json"""
+
+
+def load_config() -> dict:
+    """读取配置文件，文件不存在时返回空字典"""
+    if not os.path.exists(CONFIG_PATH):
+        return {}
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_config(config: dict):
+    """保存配置，合并到已有的配置中，不会丢失GUI界面以外的配置项"""
+    try:
+        merged_config = load_config()
+    except (OSError, ValueError):
+        merged_config = {}
+    merged_config.update(config)
+    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
+        json.dump(merged_config, f, ensure_ascii=False, indent=2)
+
+
+def get_section(name: str, defaults: dict) -> dict:
+    """读取配置文件中的一个子配置，缺少的项使用默认值。配置文件读取失败时返回默认值"""
+    try:
+        section = load_config().get(name, None)
+    except (OSError, ValueError):
+        section = None
+    if not isinstance(section, dict):
+        section = {}
+    return {**defaults, **section}
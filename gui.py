@@ -1,14 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import logging
+import math
 import os
 import re
-import json
+import threading
+import time
+from typing import Optional
 
 import wx
-import wx.grid
 
+import config as config_module
 import listener
+import metrics
 import result_exporter
+import result_server
+import vote_matcher
+import vote_timeline
+from regex_safety import find_backtracking_risks
+from vote_session import room_slug
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+app: Optional['VoteApp'] = None
+
+# 刷新显示的最小、最大间隔（毫秒）。有新投票时才刷新，投票密集时根据每次刷新的耗时在这个范围内调整间隔
+_MIN_REFRESH_INTERVAL = 100
+_MAX_REFRESH_INTERVAL = 1000
+# 刷新间隔至少是刷新耗时的这个倍数，即刷新最多占用GUI线程1/20的时间，给OBS留出CPU
+_REFRESH_COST_FACTOR = 20
+# 性能分析的选项，(值, 显示的文本)
+_PROFILE_THREAD_CHOICES = [("network", "网络线程"), ("gui", "界面线程")]
+_PROFILE_MODE_CHOICES = [("sample", "采样（开销小）"), ("cprofile", "cProfile"), ("tracemalloc", "内存分配")]
 
 class SilentInfoDialog(wx.Dialog):
     def __init__(self, parent, message, title="提示"):
@@ -40,30 +63,120 @@ class SilentInfoDialog(wx.Dialog):
         self.EndModal(wx.ID_OK)
 
 
+class ReportDialog(wx.Dialog):
+    """显示多行报告，内容可以复制"""
+    def __init__(self, parent, message, title="测试结果"):
+        super().__init__(parent, title=title, style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER | wx.STAY_ON_TOP)
+        
+        self.SetSize((520, 420))
+        self.Center()
+        
+        text = wx.TextCtrl(self, value=message, style=wx.TE_MULTILINE | wx.TE_READONLY)
+        
+        ok_btn = wx.Button(self, id=wx.ID_OK, label="确定")
+        ok_btn.Bind(wx.EVT_BUTTON, self.on_ok)
+        
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        vbox.Add(text, proportion=1, flag=wx.EXPAND | wx.ALL, border=10)
+        vbox.Add(ok_btn, flag=wx.ALIGN_CENTER | wx.BOTTOM, border=10)
+        
+        self.SetSizer(vbox)
+    
+    def on_ok(self, event):
+        self.EndModal(wx.ID_OK)
+
+
+class TimelineChart(wx.Panel):
+    """各等级的累计票数曲线，颜色和结果页面上的相同"""
+    def __init__(self, parent):
+        super().__init__(parent, style=wx.BORDER_NONE)
+        self.SetMinSize((-1, 90))
+        self.SetBackgroundStyle(wx.BG_STYLE_PAINT)
+        self.points = []
+        self._pens = [wx.Pen(wx.Colour(color), 2) for color in result_exporter.TIMELINE_COLORS]
+        self.Bind(wx.EVT_PAINT, self.on_paint)
+        self.Bind(wx.EVT_SIZE, lambda evt: self.Refresh())
+    
+    def set_points(self, points):
+        """:param points: VoteTimeline.get_cumulative_points的返回值"""
+        self.points = points
+        self.Refresh()
+    
+    def on_paint(self, event):
+        dc = wx.AutoBufferedPaintDC(self)
+        dc.SetBackground(wx.WHITE_BRUSH)
+        dc.Clear()
+        points = self.points
+        if len(points) < 2:
+            return
+        width, height = self.GetClientSize()
+        padding = 4
+        plot_width = max(width - padding * 2, 1)
+        plot_height = max(height - padding * 2, 1)
+        last_second = max(points[-1][0], 1)
+        max_count = max(max(points[-1][1]), 1)
+        xs = [padding + int(second / last_second * plot_width) for second, _ in points]
+        for level_index, pen in enumerate(self._pens):
+            dc.SetPen(pen)
+            dc.DrawLines([
+                wx.Point(x, padding + plot_height - int(counts[level_index] / max_count * plot_height))
+                for x, (_, counts) in zip(xs, points)
+            ])
+        dc.SetTextForeground(wx.Colour("#888888"))
+        text = f"{points[-1][0]}s"
+        text_width, text_height = dc.GetTextExtent(text)
+        dc.DrawText(text, width - padding - text_width, padding)
+
+
 class VoteFrame(wx.Frame):
     def __init__(self, parent):
         super().__init__(parent, title="niconico风格弹幕投票系统", size=(800, 800))
         
         self.vote_levels = {1: "^1$", 2: "^2$", 3: "^3$", 4: "^4$", 5: "^5$"}
-        self.is_counting = False
-        self.vote_counts = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-        self.vote_records = {}
-        self.total_votes = 0
+        # 统计状态都在引擎里，GUI只读取快照
+        self.engine = listener.vote_engine
+        self.snapshot = self.engine.snapshot()
+        # 实时统计表格显示的房间，None表示合并视图
+        self.display_room_keys = [None]
+        # 结果页面的统计风格，实时推送时使用
+        self.result_mode = "traditional"
         self.label_defaults = ["", "とても良かった", "まぁまぁ良かった", "ふつうだった", "あまり良くなかった", "良くなかった"]
         
         # 倒计时相关变量
-        self.countdown_timer = None
         self.countdown_seconds = 0
         self.is_countdown_active = False
         
-        listener.set_vote_frame(self)
+        # 表格中已经显示的内容，(行, 列) -> 文本，只重绘变化的单元格
+        self._displayed_cells = {}
+        self._displayed_total = None
+        # 已经显示的房间和它的统计结果的版本号，都没变时跳过重绘
+        self._displayed_room_key = None
+        self._displayed_version = -1
+        self._displayed_timeline_version = -1
+        self._refresh_interval = _MIN_REFRESH_INTERVAL
+        # 等待刷新的统计结果最早变化的时间，用于记录从网络线程交给GUI线程到刷新完成的延迟
+        self._pending_change_time = None
+        
+        listener.set_open_admin_ui_handler(lambda: wx.CallAfter(self.on_open_admin_ui))
         
         self.setup_ui()
         
-        # 定时器用于更新显示
+        # 倒计时定时器，只绑定一次，每次在显示的秒数变化时单次启动
+        self.countdown_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_countdown_timer, self.countdown_timer)
+        
+        # 定时器用于更新显示，只在有新投票时单次启动，没有投票时GUI线程完全空闲
         self.update_timer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.on_update_timer, self.update_timer)
-        self.update_timer.Start(100)  # 每100ms更新一次
+        # 统计结果变化时合并唤醒GUI线程，读取快照之前不会重复唤醒
+        self.engine.set_on_changed(lambda: wx.CallAfter(self.request_refresh, time.perf_counter()))
+        self.engine.set_on_closed(lambda: wx.CallAfter(self.on_vote_deadline))
+        
+        # 结果页面的设置修改后也要推送到实时结果页面
+        for entry in (self.title_entry, *self.label_entries.values()):
+            entry.Bind(wx.EVT_TEXT, lambda evt: self.request_refresh())
+        self.default_level_entry.Bind(wx.EVT_COMBOBOX, lambda evt: self.request_refresh())
+        self.include_repo_checkbox.Bind(wx.EVT_CHECKBOX, lambda evt: self.request_refresh())
         
         # 绑定关闭事件
         self.Bind(wx.EVT_CLOSE, self.on_close)
@@ -100,6 +213,13 @@ class VoteFrame(wx.Frame):
         self.setup_btn.Bind(wx.EVT_BUTTON, self.apply_settings)  
         vote_grid.Add(self.setup_btn, 0)
         vote_sizer.Add(vote_grid, 0, wx.EXPAND | wx.ALL, 5)
+        
+        # 规范化弹幕内容，应用正则表达式设置后生效
+        self.normalize_checkbox = wx.CheckBox(panel, label="匹配前规范化弹幕（全角数字、圈数字、半角假名、零宽字符等）")
+        self.normalize_checkbox.SetValue(
+            bool(config_module.get_section('regex', vote_matcher.DEFAULT_CONFIG)['normalize'])
+        )
+        vote_sizer.Add(self.normalize_checkbox, 0, wx.LEFT | wx.BOTTOM, 5)
 
         
         main_sizer.Add(vote_sizer, 0, wx.EXPAND | wx.ALL, 5)
@@ -157,7 +277,17 @@ class VoteFrame(wx.Frame):
         realtime_group = wx.StaticBox(panel, label="实时统计结果")
         realtime_sizer = wx.StaticBoxSizer(realtime_group, wx.VERTICAL)
         
-        self.table = wx.grid.Grid(panel)
+        room_row = wx.BoxSizer(wx.HORIZONTAL)
+        room_row.Add(wx.StaticText(panel, label="显示房间:"), 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        self.room_choice = wx.Choice(panel, choices=["全部房间(去重)"])
+        self.room_choice.SetSelection(0)
+        self.room_choice.Bind(wx.EVT_CHOICE, lambda evt: self.update_display())
+        room_row.Add(self.room_choice, 1)
+        realtime_sizer.Add(room_row, 0, wx.EXPAND | wx.ALL, 5)
+        
+        # wx.grid只有这里用到，等网络线程开始连接blivechat之后再导入
+        from wx import grid
+        self.table = grid.Grid(panel)
         self.table.CreateGrid(5, 3)
         self.table.SetColLabelValue(0, "等级")
         self.table.SetColLabelValue(1, "票数")
@@ -186,6 +316,12 @@ class VoteFrame(wx.Frame):
         self.total_label.SetFont(font)
         realtime_sizer.Add(self.total_label, 0, wx.ALL, 5)
         
+        # 合并视图的累计票数曲线，不随显示的房间切换
+        realtime_sizer.Add(wx.StaticText(panel, label="累计票数曲线(全部房间去重):"), 0, wx.LEFT | wx.RIGHT, 5)
+        self.timeline_chart = TimelineChart(panel)
+        realtime_sizer.Add(self.timeline_chart, 0, wx.EXPAND | wx.ALL, 5)
+        self.timeline_config = config_module.get_section("timeline", vote_timeline.DEFAULT_CONFIG)
+        
         main_sizer.Add(realtime_sizer, 1, wx.EXPAND | wx.ALL, 5)
         
         result_group = wx.StaticBox(panel, label="结果页面设置")
@@ -236,10 +372,20 @@ class VoteFrame(wx.Frame):
         result_path = os.path.join(result_dir, "result.html")
         self.result_html_path = result_path
         self.web_url_text = wx.TextCtrl(panel, value=result_path, style=wx.TE_READONLY)
-        main_sizer.Add(self.web_url_text, 0, wx.EXPAND | wx.ALL, 10)
+        main_sizer.Add(self.web_url_text, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, 10)
+
+        # 实时结果页面的URL，结果有更新时自动刷新
+        server_config = config_module.get_section('result_server', result_server.DEFAULT_CONFIG)
+        if server_config['enabled']:
+            live_url = f"http://127.0.0.1:{server_config['port']}/"
+            live_url_row = wx.BoxSizer(wx.HORIZONTAL)
+            live_url_row.Add(wx.StaticText(panel, label="实时结果页面(自动刷新):"), 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+            self.live_url_text = wx.TextCtrl(panel, value=live_url, style=wx.TE_READONLY)
+            live_url_row.Add(self.live_url_text, 1)
+            main_sizer.Add(live_url_row, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
 
         # 写入配置文件与读取配置文件的按钮，配置文件在当前目录下，文件名是config.json
-        self.config_path = os.path.join(os.path.dirname(__file__), "config.json")
+        self.config_path = config_module.CONFIG_PATH
         
         # 配置文件按钮
         config_group = wx.StaticBox(panel, label="配置文件管理")
@@ -257,53 +403,133 @@ class VoteFrame(wx.Frame):
         config_sizer.Add(config_btn_sizer, 0, wx.ALIGN_CENTER | wx.ALL, 5)
         main_sizer.Add(config_sizer, 0, wx.EXPAND | wx.ALL, 5)
         
+        # 直播中卡顿时不重启blivechat分析运行中的插件，结果写到log目录
+        profile_group = wx.StaticBox(panel, label="性能分析")
+        profile_sizer = wx.StaticBoxSizer(profile_group, wx.HORIZONTAL)
+        self.profile_thread_choice = wx.Choice(panel, choices=[label for _value, label in _PROFILE_THREAD_CHOICES])
+        self.profile_thread_choice.SetSelection(0)
+        profile_sizer.Add(self.profile_thread_choice, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+        self.profile_mode_choice = wx.Choice(panel, choices=[label for _value, label in _PROFILE_MODE_CHOICES])
+        self.profile_mode_choice.SetSelection(0)
+        profile_sizer.Add(self.profile_mode_choice, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+        self.profile_seconds_entry = wx.TextCtrl(panel, value="30", size=(50, -1))
+        profile_sizer.Add(self.profile_seconds_entry, 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 5)
+        profile_sizer.Add(wx.StaticText(panel, label="秒"), 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+        self.profile_btn = wx.Button(panel, label="开始分析")
+        self.profile_btn.Bind(wx.EVT_BUTTON, self.start_profiling)
+        profile_sizer.Add(self.profile_btn, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+        main_sizer.Add(profile_sizer, 0, wx.EXPAND | wx.ALL, 5)
+        
         panel.SetSizer(main_sizer)
         self.update_display()
     
     def apply_settings(self, event):
+        """应用正则表达式设置，有灾难性回溯风险时不应用，返回是否应用了"""
+        patterns = {}
         for level, entry in self.vote_entries.items():
             pattern = entry.GetValue().strip()
-            self.vote_levels[level] = pattern if pattern else f"^{level}$"
-        listener.update_vote_patterns()
+            patterns[level] = pattern if pattern else f"^{level}$"
+        
+        # 匹配在网络线程中进行，一个会灾难性回溯的正则表达式就能卡住接收弹幕
+        unsafe_patterns = vote_matcher.find_unsafe_patterns(patterns)
+        if unsafe_patterns:
+            lines = [
+                f"等级 {level} 的正则表达式 '{patterns[level]}'：{'；'.join(risks)}"
+                for level, risks in unsafe_patterns.items()
+            ]
+            SilentInfoDialog(
+                self, "以下正则表达式匹配长弹幕时可能卡死，设置没有更新：\n" + "\n".join(lines)
+            ).ShowModal()
+            return False
+        
+        self.vote_levels.update(patterns)
+        self.engine.set_patterns(self.vote_levels, self.get_matcher_options())
         if not(event is None):
             SilentInfoDialog(self, "投票设置已更新！").ShowModal()
+        return True
+    
+    def get_matcher_options(self):
+        """匹配选项，是否规范化以界面为准，其他从config.json读取"""
+        matcher_options = vote_matcher.MatcherOptions.from_config(
+            config_module.get_section('regex', vote_matcher.DEFAULT_CONFIG)
+        )
+        return matcher_options._replace(normalize=self.normalize_checkbox.GetValue())
     
     def test_regex(self, level):
+        """检查一个等级的正则表达式，再用弹幕样本测试当前所有等级的正则表达式"""
         pattern = self.vote_entries[level].GetValue().strip()
         pattern = pattern if pattern else f"^{level}$"
         try:
             re.compile(pattern)
-            SilentInfoDialog(self, f"等级 {level} 的正则表达式 '{pattern}' 编译成功！").ShowModal()
         except re.error as e:
             SilentInfoDialog(self, f"等级 {level} 的正则表达式 '{pattern}' 编译失败：{e}").ShowModal()
+            return
+        risks = find_backtracking_risks(pattern)
+        if risks and vote_matcher.find_unsafe_patterns({level: pattern}):
+            SilentInfoDialog(
+                self, f"等级 {level} 的正则表达式 '{pattern}' 有灾难性回溯的风险：{'；'.join(risks)}，不能使用"
+            ).ShowModal()
+            return
+        
+        patterns = {}
+        for other_level, entry in self.vote_entries.items():
+            other_pattern = entry.GetValue().strip()
+            patterns[other_level] = other_pattern if other_pattern else f"^{other_level}$"
+        unsafe_patterns = vote_matcher.find_unsafe_patterns(patterns)
+        
+        # 测试是调试功能，用到时才导入
+        import regex_bench
+        lines = [f"等级 {level} 的正则表达式 '{pattern}' 编译成功！"]
+        if risks:
+            lines.append(f"有灾难性回溯的风险：{'；'.join(risks)}，将使用线性时间正则引擎匹配")
+        if unsafe_patterns:
+            # 有风险的正则表达式可能在测试时卡住界面
+            lines.append(f"等级 {'、'.join(map(str, unsafe_patterns))} 的正则表达式有灾难性回溯的风险，没有测试匹配率和耗时")
+        else:
+            with wx.BusyCursor():
+                corpus_name, contents = regex_bench.load_corpus()
+                result = regex_bench.bench_patterns(patterns, contents, corpus_name, self.get_matcher_options())
+            lines.append("")
+            lines.append(regex_bench.format_result(result))
+        ReportDialog(self, "\n".join(lines)).ShowModal()
     
     def start_countdown_timer(self):
         """启动倒计时定时器"""
-        if self.countdown_timer:
-            self.countdown_timer.Stop()
-        
-        self.countdown_timer = wx.Timer(self)
-        self.Bind(wx.EVT_TIMER, self.on_countdown_timer, self.countdown_timer)
-        self.countdown_timer.Start(1000)  # 每秒更新一次
         self.is_countdown_active = True
+        self.on_countdown_timer(None)
     
     def on_countdown_timer(self, event):
-        """倒计时定时器回调"""
-        if self.countdown_seconds > 0:
-            self.countdown_seconds -= 1
-            minutes = self.countdown_seconds // 60
-            seconds = self.countdown_seconds % 60
-            self.countdown_label.SetLabel(f"倒计时: {minutes:02d}:{seconds:02d}")
-        else:
-            # 倒计时结束，自动停止统计
+        """倒计时定时器回调，按截止时间计算剩余时间，定时器延迟不会累积"""
+        if not self.is_countdown_active:
+            return
+        now = time.monotonic()
+        if now >= self.engine.close_time:
+            # 倒计时结束，自动停止统计。网络线程在截止时间已经停止接收投票，这里晚一点执行也不影响结果
             # SilentInfoDialog(self, "倒计时结束，统计已自动停止！").ShowModal()
             self.stop_counting(None)
+            return
+        
+        remaining = max(self.engine.deadline - now, 0.0)
+        remaining_seconds = math.ceil(remaining)
+        minutes = remaining_seconds // 60
+        seconds = remaining_seconds % 60
+        self.countdown_label.SetLabel(f"倒计时: {minutes:02d}:{seconds:02d}")
+        
+        # 在显示的秒数变化或者停止接收投票时再次触发
+        if remaining > 0:
+            next_tick = remaining - (remaining_seconds - 1)
+        else:
+            next_tick = self.engine.close_time - now
+        self.countdown_timer.StartOnce(max(int(next_tick * 1000) + 1, 1))
+    
+    def on_vote_deadline(self):
+        """网络线程到达截止时间后调用"""
+        if self.is_countdown_active:
+            self.stop_counting(None)
     
     def stop_countdown_timer(self):
         """停止倒计时定时器"""
-        if self.countdown_timer:
-            self.countdown_timer.Stop()
-            self.countdown_timer = None
+        self.countdown_timer.Stop()
         self.is_countdown_active = False
         self.countdown_label.SetLabel("倒计时: 未开始")
     
@@ -320,20 +546,26 @@ class VoteFrame(wx.Frame):
             SilentInfoDialog(self, "请设置有效的倒计时时间！").ShowModal()
             return
         
-        self.is_counting = True
-        self.vote_counts = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-        self.vote_records.clear()
-        self.total_votes = 0
         try:
-            self.total_count = int(self.initial_count_entry.GetValue())
+            initial_count = int(self.initial_count_entry.GetValue())
         except ValueError:
-            self.total_count = 0
+            initial_count = 0
+        
+        # 应用正则表达式设置
+        if not self.apply_settings(None):
+            return
+        
+        # 截止时间在网络线程中逐条检查，和GUI线程的负载无关。开始时清空上一次的统计结果
+        deadline_config = config_module.get_section('deadline', listener.DEFAULT_DEADLINE_CONFIG)
+        self.engine.start(
+            self.countdown_seconds, initial_count, timestamp_cutoff=deadline_config['timestamp_cutoff'],
+            late_grace_seconds=float(deadline_config['late_grace_seconds'])
+        )
+        logger.info(f"开始统计，正则表达式匹配方式: {self.engine.matcher.mode}")
 
         # 将输出的html文件恢复成所有数值为0
         self.show_results(None, mode="traditional")
-
-        # 应用正则表达式设置
-        self.apply_settings(None)
+        self.update_display()
         
         # 启动倒计时
         self.start_countdown_timer()
@@ -347,7 +579,6 @@ class VoteFrame(wx.Frame):
         self.stop_btn.Enable(True)
         self.btn_niconico.Enable(False)
         self.btn_traditional.Enable(False)
-        listener.update_vote_patterns()
         
         
         # wx.MessageBox("开始统计投票！", "提示", wx.OK | wx.ICON_INFORMATION)
@@ -356,11 +587,11 @@ class VoteFrame(wx.Frame):
         # wx.MessageBox("开始统计投票！", "提示", wx.OK | wx.ICON_INFORMATION)
     
     def stop_counting(self, event):
-        self.is_counting = False
-        self.total_count = max(self.total_count, self.total_votes)
+        self.engine.stop()
         
         # 停止倒计时
         self.stop_countdown_timer()
+        self.update_display()
         
         # 如果是手动停止（不是倒计时结束），显示提示
         if event is not None:
@@ -370,7 +601,6 @@ class VoteFrame(wx.Frame):
         self.stop_btn.Enable(False)
         self.btn_niconico.Enable(True)
         self.btn_traditional.Enable(True)
-        listener.update_vote_patterns()
         
         
         # wx.MessageBox("统计已结束！", "提示", wx.OK | wx.ICON_INFORMATION)
@@ -378,40 +608,196 @@ class VoteFrame(wx.Frame):
     
         # wx.MessageBox("统计已结束！", "提示", wx.OK | wx.ICON_INFORMATION)
     
-    def process_vote_by_level(self, uid: str, level: int):
-        if not self.is_counting:
-            return
-        if uid not in self.vote_records:
-            self.vote_records[uid] = level
-            self.vote_counts[level] += 1
-            self.total_votes += 1
+    def request_refresh(self, change_time=None):
+        """
+        请求刷新显示，已经在等待刷新时不重复启动定时器
+
+        :param change_time: 统计结果变化时的time.perf_counter()，界面设置修改时为None
+        """
+        if change_time is not None and self._pending_change_time is None:
+            self._pending_change_time = change_time
+        if not self.update_timer.IsRunning():
+            self.update_timer.StartOnce(self._refresh_interval)
     
     def on_update_timer(self, event):
+        start_time = time.perf_counter()
         self.update_display()
+        end_time = time.perf_counter()
+        if self._pending_change_time is not None:
+            metrics.RESULT_APPLY_SECONDS.observe(end_time - self._pending_change_time)
+            self._pending_change_time = None
+        cost_ms = (end_time - start_time) * 1000
+        # 按这次刷新的耗时调整下次刷新的间隔，投票密集时降低刷新频率
+        self._refresh_interval = int(min(max(cost_ms * _REFRESH_COST_FACTOR, _MIN_REFRESH_INTERVAL), _MAX_REFRESH_INTERVAL))
+    
+    def sync_rooms(self):
+        """按快照更新房间选择框，已删除的房间从实时结果页面移除"""
+        room_keys = list(self.snapshot.rooms.keys())
+        if room_keys == self.display_room_keys[1:]:
+            return
+        for room_key in self.display_room_keys[1:]:
+            if room_key not in self.snapshot.rooms:
+                result_server.unpublish(room_slug(room_key))
+        
+        selected_room_key = self.get_display_room_key()
+        self.display_room_keys = [None, *room_keys]
+        self.room_choice.Set(["全部房间(去重)", *(f"房间 {room_slug(room_key)}" for room_key in room_keys)])
+        if selected_room_key in self.snapshot.rooms:
+            self.room_choice.SetSelection(self.display_room_keys.index(selected_room_key))
+        else:
+            self.room_choice.SetSelection(0)
+        # 房间可能删除后又重新添加，版本号不能用来比较
+        self._displayed_version = -1
+    
+    def get_display_room_key(self):
+        """实时统计表格当前显示的房间，None表示合并视图"""
+        index = self.room_choice.GetSelection()
+        if index <= 0 or index >= len(self.display_room_keys):
+            return None
+        return self.display_room_keys[index]
+    
+    def get_display_tally(self):
+        """实时统计表格当前显示的房间的统计结果"""
+        room_key = self.get_display_room_key()
+        if room_key is None:
+            return self.snapshot.merged
+        return self.snapshot.rooms.get(room_key, self.snapshot.merged)
     
     def update_display(self):
+        self.snapshot = self.engine.snapshot()
+        self.sync_rooms()
+        # 推送到实时结果页面，内容没变时不会推送
+        self.publish_results()
+
+        if self.snapshot.merged.version != self._displayed_timeline_version:
+            self._displayed_timeline_version = self.snapshot.merged.version
+            timeline = self.engine.timeline_snapshot()
+            if timeline is not None:
+                self.timeline_chart.set_points(timeline.get_cumulative_points(self.get_timeline_max_points()))
+
+        room_key = self.get_display_room_key()
+        tally = self.get_display_tally()
+        if room_key == self._displayed_room_key and tally.version == self._displayed_version:
+            return
+        self._displayed_room_key = room_key
+        self._displayed_version = tally.version
+
+        cells = {}
         for level in range(1, 6):
-            count = self.vote_counts[level]
-            percentage = (count / max(self.total_votes, 1)) * 100
-            self.table.SetCellValue(level-1, 0, f"等级 {level}")
-            self.table.SetCellValue(level-1, 1, str(count))
-            self.table.SetCellValue(level-1, 2, f"{percentage:.1f}%")
-        self.total_label.SetLabel(f"总票数: {self.total_votes}")
+            count = tally.vote_counts[level]
+            percentage = (count / max(tally.total_votes, 1)) * 100
+            cells[(level-1, 0)] = f"等级 {level}"
+            cells[(level-1, 1)] = str(count)
+            cells[(level-1, 2)] = f"{percentage:.1f}%"
+        changed_cells = [(pos, value) for pos, value in cells.items() if self._displayed_cells.get(pos) != value]
+        if changed_cells:
+            # 一次批量更新，表格只重绘一次
+            self.table.BeginBatch()
+            try:
+                for (row, col), value in changed_cells:
+                    self.table.SetCellValue(row, col, value)
+            finally:
+                self.table.EndBatch()
+            self._displayed_cells.update(changed_cells)
+
+        total_text = f"总票数: {tally.total_votes}"
+        if total_text != self._displayed_total:
+            self.total_label.SetLabel(total_text)
+            self._displayed_total = total_text
     
-    def show_results(self, event, mode="niconico"):
-        vote_counts = [self.vote_counts[i] for i in range(1,6)]
+    def publish_results(self):
+        """把合并视图和每个房间的结果推送到实时结果页面"""
+        result_server.publish(self.compute_result(self.result_mode, timeline_points=self.get_timeline_points()))
+        for room_key, tally in self.snapshot.rooms.items():
+            result_server.publish(self.compute_result(self.result_mode, tally), room_slug(room_key))
+    
+    def get_result_params(self, tally=None, total_count=None):
+        """
+        结果页面的参数：标题、各等级票数、初始人数、默认等级、标签、是否包含项目地址
+
+        :param tally: 统计结果快照，默认是合并视图
+        :param total_count: 初始人数，默认按tally计算
+        """
+        if tally is None:
+            tally = self.snapshot.merged
+        if total_count is None:
+            total_count = self.snapshot.get_total_count(tally)
+        vote_counts = [tally.vote_counts[i] for i in range(1,6)]
         labels = []
         for level, entry in self.label_entries.items():
             label = entry.GetValue().strip()
             labels.append(label)
         include_repo = self.include_repo_checkbox.GetValue()
+        return (
+            self.title_entry.GetValue(), vote_counts, total_count, int(self.default_level_entry.GetValue()), labels,
+            include_repo
+        )
+    
+    def compute_result(self, mode, tally=None, total_count=None, timeline_points=None):
+        title, vote_counts, total_count, default_level, labels, include_repo = self.get_result_params(tally, total_count)
+        return result_exporter.compute_result(
+            title, vote_counts, total_count, default_level, labels, mode=mode, include_repo=include_repo,
+            timeline_points=timeline_points
+        )
+    
+    def get_timeline_max_points(self):
+        return int(self.timeline_config["max_points"])
+    
+    def get_timeline_points(self, timeline=None):
+        """合并视图结果页面上的累计票数曲线，配置为不显示或者还没有开始过统计时返回None"""
+        if not self.timeline_config["show_on_result_page"]:
+            return None
+        if timeline is None:
+            timeline = self.engine.timeline_snapshot()
+            if timeline is None:
+                return None
+        return timeline.get_cumulative_points(self.get_timeline_max_points())
+    
+    def show_results(self, event, mode="niconico"):
+        self.result_mode = mode
+        self.snapshot = self.engine.snapshot()
+        timeline = self.engine.timeline_snapshot()
+        title, vote_counts, total_count, default_level, labels, include_repo = self.get_result_params()
         result_exporter.export_result_html(
-            self.title_entry.GetValue(), vote_counts, self.total_count, int(self.default_level_entry.GetValue()), labels,
-            filename=self.result_html_path, mode=mode, include_repo=include_repo
+            title, vote_counts, total_count, default_level, labels,
+            filename=self.result_html_path, mode=mode, include_repo=include_repo,
+            timeline_points=self.get_timeline_points(timeline)
         )
+        # 合并视图每秒的票数导出到 timeline.csv、timeline.json
+        result_dir = os.path.dirname(self.result_html_path)
+        result_exporter.export_timeline(timeline, result_dir)
+        # 每个房间单独导出 result_<房间>.html
+        for room_key, tally in self.snapshot.rooms.items():
+            title, vote_counts, total_count, default_level, labels, include_repo = self.get_result_params(tally)
+            result_exporter.export_result_html(
+                title, vote_counts, total_count, default_level, labels,
+                filename=os.path.join(result_dir, f"result_{room_slug(room_key)}.html"), mode=mode,
+                include_repo=include_repo
+            )
+        self.publish_results()
         if not(event is None):
             SilentInfoDialog(self, f"HTML结果已导出\n请在OBS中使用浏览器源查看下方URL\n浏览器源推荐尺寸:900*600\n请注意，浏览器源的尺寸会影响投票结果的显示效果").ShowModal()
     
+    def start_profiling(self, event):
+        """分析网络线程或界面线程一段时间，到时间后结果写到log目录"""
+        try:
+            seconds = float(self.profile_seconds_entry.GetValue())
+        except ValueError:
+            SilentInfoDialog(self, "请输入有效的秒数").ShowModal()
+            return
+        thread_name = _PROFILE_THREAD_CHOICES[self.profile_thread_choice.GetSelection()][0]
+        mode = _PROFILE_MODE_CHOICES[self.profile_mode_choice.GetSelection()][0]
+        try:
+            path_prefix = app.start_profiling(mode, seconds, thread_name)
+        except ValueError as e:
+            SilentInfoDialog(self, f"无法开始性能分析：{e}").ShowModal()
+            return
+        SilentInfoDialog(self, f"性能分析已开始，{seconds:g} 秒后结果写到\n{os.path.abspath(path_prefix)}.*").ShowModal()
+    
+    def on_open_admin_ui(self):
+        self.Raise()
+        self.SetFocus()
+    
     def on_close(self, event):
         SilentInfoDialog(self, "为防止误操作，此界面无法被关闭！\n如需关闭，请直接关闭blivechat主程序！").ShowModal()
     
@@ -429,7 +815,12 @@ class VoteFrame(wx.Frame):
                 "title": self.title_entry.GetValue(),
                 "labels": {},
                 "default_level": self.default_level_entry.GetValue(),
-                "include_repo": self.include_repo_checkbox.GetValue()
+                "include_repo": self.include_repo_checkbox.GetValue(),
+                # 匹配设置，保留界面上没有的项
+                "regex": {
+                    **config_module.get_section('regex', vote_matcher.DEFAULT_CONFIG),
+                    "normalize": self.normalize_checkbox.GetValue(),
+                },
             }
             
             # 保存投票正则表达式
@@ -440,9 +831,8 @@ class VoteFrame(wx.Frame):
             for level, entry in self.label_entries.items():
                 config["labels"][str(level)] = entry.GetValue()
             
-            # 写入配置文件
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
+            # 写入配置文件，保留GUI界面以外的配置项
+            config_module.save_config(config)
             
             SilentInfoDialog(self, f"配置已保存到插件目录下").ShowModal()
             
@@ -456,8 +846,7 @@ class VoteFrame(wx.Frame):
                 SilentInfoDialog(self, f"配置文件不存在").ShowModal()
                 return
             
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = config_module.load_config()
             
             # 加载投票正则表达式
             if "vote_patterns" in config:
@@ -486,8 +875,72 @@ class VoteFrame(wx.Frame):
                 self.default_level_entry.SetValue(config["default_level"])
             if "include_repo" in config:
                 self.include_repo_checkbox.SetValue(config["include_repo"])
+            if isinstance(config.get("regex"), dict) and "normalize" in config["regex"]:
+                self.normalize_checkbox.SetValue(bool(config["regex"]["normalize"]))
             
             SilentInfoDialog(self, f"配置已从插件目录下加载").ShowModal()
             
         except Exception as e:
             SilentInfoDialog(self, f"加载配置失败：{str(e)}").ShowModal()
+
+
+def run(network_worker):
+    """GUI模式的入口，见main.py"""
+    global app
+    app = VoteApp(network_worker)
+
+    logger.info('Running event loop')
+    app.MainLoop()
+
+
+def start_shut_down():
+    if app is not None and app.IsMainLoopRunning():
+        app.ExitMainLoop()
+    else:
+        wx.Exit()
+
+
+class VoteApp(wx.App):
+    def __init__(self, network_worker, *args, **kwargs):
+        self._network_worker = network_worker
+        self._vote_frame: Optional[VoteFrame] = None
+        
+        super().__init__(*args, clearSigInt=False, **kwargs)
+        self.SetExitOnFrameDelete(False)
+
+    def OnInit(self):
+        # 收到SIGINT、SIGTERM或者blivechat断开时，在网络线程中通知主线程退出
+        self._network_worker.set_on_signal(lambda _signum: wx.CallAfter(start_shut_down))
+        listener.set_shut_down_handler(lambda: wx.CallAfter(start_shut_down))
+        # 先启动网络线程（main.py中可能已经启动了），连接blivechat的同时创建窗口
+        self._network_worker.start()
+
+        # 创建投票窗口
+        self._vote_frame = VoteFrame(None)
+        self._vote_frame.Show()
+
+        # 等待网络工作线程初始化完成
+        self._network_worker.wait_init()
+        return True
+
+    def start_profiling(self, mode, seconds, thread_name="network"):
+        """
+        分析网络线程或GUI线程一段时间，在GUI线程调用，见profiling.start_profiling
+
+        :return: 输出文件的路径前缀
+        :raises ValueError: 参数不对，或者同样的分析正在进行
+        """
+        if thread_name == "network":
+            return self._network_worker.start_profiling(mode, seconds)
+        # 性能分析是调试功能，用到时才导入
+        import profiling
+        target = profiling.ProfileTarget("gui", threading.get_ident(), wx.CallAfter)
+        return profiling.start_profiling(mode, seconds, target)
+
+    def OnExit(self):
+        logger.info('Start to shut down')
+        
+        self._network_worker.start_shut_down()
+        self._network_worker.join(10)
+        
+        return super().OnExit()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+无界面模式，不导入wxPython，适合在没有图形界面的机器或容器中和blivechat一起运行
+
+统计参数从config.json读取（和GUI保存的配置相同），可以用命令行参数覆盖。开始、结束统计的方式：
+    - 信号：SIGUSR1开始统计，SIGUSR2结束统计（仅限支持这两个信号的系统）
+    - 本地控制端口（默认不开启，用--control-port或配置的control_port开启）：每行一条命令，返回一行JSON，命令有
+      start [秒数]、stop、status、export [niconico|traditional]、profile [sample|cprofile|tracemalloc] [秒数]、shutdown。
+      例如 echo start 60 | nc 127.0.0.1 12452
+
+用法：
+    python main.py --headless [--start] [--countdown 300] [--pattern 1=^1$ ...] [--label 1=とても良かった ...]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from typing import *
+
+import blcsdk
+import config
+import listener
+import metrics
+import result_exporter
+import result_server
+import vote_matcher
+import vote_timeline
+from vote_engine import TallySnapshot, VoteSnapshot
+from vote_session import VOTE_LEVELS, room_slug
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+DEFAULT_CONFIG = {
+    'control_host': '127.0.0.1',
+    # 0表示不开启控制端口，需要时一般用12452
+    'control_port': 0,
+    # 统计结果变化后最多等待这么多秒推送到实时结果页面
+    'publish_interval': 0.2,
+    # 统计结束后导出的结果页面风格
+    'result_mode': 'niconico',
+}
+"""配置文件中headless项的默认值"""
+
+RESULT_MODES = ('niconico', 'traditional')
+
+DEFAULT_LABELS = ['とても良かった', 'まぁまぁ良かった', 'ふつうだった', 'あまり良くなかった', '良くなかった']
+
+
+class PollSettings(NamedTuple):
+    """一次统计的参数"""
+    patterns: Dict[int, str]
+    countdown_seconds: int
+    initial_count: int
+    title: str
+    labels: List[str]
+    default_level: int
+    include_repo: bool
+
+
+def _parse_level_value(text: str) -> Tuple[int, str]:
+    """解析 等级=值"""
+    level_str, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'格式应该是 等级=值: {text}')
+    try:
+        level = int(level_str)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'等级应该是1-5: {text}')
+    if level not in VOTE_LEVELS:
+        raise argparse.ArgumentTypeError(f'等级应该是1-5: {text}')
+    return level, value
+
+
+def parse_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='main.py --headless', description='niconico风格弹幕投票系统 无界面模式')
+    parser.add_argument('--start', action='store_true', help='连接blivechat后立即开始一次统计')
+    parser.add_argument(
+        '--pattern', type=_parse_level_value, action='append', default=[], metavar='等级=正则表达式',
+        help='等级对应的正则表达式，可以指定多次'
+    )
+    parser.add_argument('--countdown', type=int, help='倒计时秒数')
+    parser.add_argument('--initial-count', type=int, help='初始人数')
+    parser.add_argument('--title', help='结果页面标题')
+    parser.add_argument(
+        '--label', type=_parse_level_value, action='append', default=[], metavar='等级=标签',
+        help='等级在结果页面上显示的标签，可以指定多次'
+    )
+    parser.add_argument('--default-level', type=int, choices=VOTE_LEVELS, help='niconico风格统计的默认等级')
+    parser.add_argument('--include-repo', action='store_true', default=None, help='在结果中包含github项目地址')
+    parser.add_argument('--mode', choices=RESULT_MODES, help='统计结束后导出的结果页面风格')
+    parser.add_argument('--control-port', type=int, help='本地控制端口，0表示不开启')
+    return parser.parse_args(argv)
+
+
+def load_poll_settings(config_dict: dict, args: argparse.Namespace) -> PollSettings:
+    """从GUI保存的配置读取统计参数，命令行参数优先"""
+    def get_int(key, default):
+        try:
+            return int(config_dict.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    config_patterns = config_dict.get('vote_patterns', {})
+    config_labels = config_dict.get('labels', {})
+    patterns = {}
+    labels = []
+    for level in VOTE_LEVELS:
+        pattern = str(config_patterns.get(str(level), '')).strip()
+        patterns[level] = pattern if pattern else f'^{level}$'
+        labels.append(str(config_labels.get(str(level), DEFAULT_LABELS[level - 1])).strip())
+    for level, pattern in args.pattern:
+        patterns[level] = pattern.strip() or f'^{level}$'
+    for level, label in args.label:
+        labels[level - 1] = label.strip()
+
+    if args.countdown is not None:
+        countdown_seconds = args.countdown
+    else:
+        countdown_seconds = get_int('countdown_minutes', 5) * 60 + get_int('countdown_seconds', 0)
+    if countdown_seconds <= 0:
+        countdown_seconds = 300  # 默认5分钟
+
+    return PollSettings(
+        patterns=patterns,
+        countdown_seconds=countdown_seconds,
+        initial_count=args.initial_count if args.initial_count is not None else get_int('initial_count', 0),
+        title=args.title if args.title is not None else str(config_dict.get('title', '')),
+        labels=labels,
+        default_level=args.default_level if args.default_level is not None else get_int('default_level', 1),
+        include_repo=args.include_repo if args.include_repo is not None else bool(config_dict.get('include_repo', False)),
+    )
+
+
+class HeadlessController:
+    """
+    无界面模式下控制统计，代替GUI。所有方法都在NetworkWorker的事件循环中调用
+
+    :param settings: 统计参数
+    :param result_mode: 统计结束后导出的结果页面风格
+    :param publish_interval: 统计结果变化后最多等待这么多秒推送到实时结果页面
+    :param auto_start: 启动后立即开始一次统计
+    :param on_shut_down: 收到SIGINT、SIGTERM或者shutdown命令时调用
+    :param on_profile: 收到profile命令时调用，参数是分析模式和秒数，返回输出文件的路径前缀，见NetworkWorker.start_profiling
+    """
+
+    def __init__(
+        self,
+        settings: PollSettings,
+        result_mode: str = 'niconico',
+        publish_interval: float = 0.2,
+        auto_start: bool = False,
+        on_shut_down: Optional[Callable[[], None]] = None,
+        on_profile: Optional[Callable[[str, float], str]] = None,
+    ):
+        self._settings = settings
+        self._result_mode = result_mode
+        self._publish_interval = publish_interval
+        self._auto_start = auto_start
+        self._on_shut_down = on_shut_down
+        self._on_profile = on_profile
+
+        self._engine = listener.vote_engine
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._publish_handle: Optional[asyncio.TimerHandle] = None
+        self._close_handle: Optional[asyncio.TimerHandle] = None
+        self._published_rooms: Set[str] = set()
+        # 从start_poll到stop_poll之间为True。引擎可能已经在截止时间自己停止了，但是还没有导出最终结果
+        self._is_poll_active = False
+        # 正在统计时实时结果页面使用传统风格，和GUI一样
+        self._live_mode = 'traditional'
+        self._timeline_config = config.get_section('timeline', vote_timeline.DEFAULT_CONFIG)
+
+        result_dir = os.path.abspath('result')
+        os.makedirs(result_dir, exist_ok=True)
+        self._result_html_path = os.path.join(result_dir, 'result.html')
+
+    async def start(self):
+        self._loop = loop = asyncio.get_running_loop()
+        # 引擎的回调可能在其他线程调用
+        self._engine.set_on_changed(lambda: loop.call_soon_threadsafe(self._schedule_publish, time.perf_counter()))
+        self._engine.set_on_closed(lambda: loop.call_soon_threadsafe(self._on_close_timer))
+        matcher_options = vote_matcher.MatcherOptions.from_config(
+            config.get_section('regex', vote_matcher.DEFAULT_CONFIG)
+        )
+        self._engine.set_patterns(self._settings.patterns, matcher_options)
+        self._publish()
+        logger.info(f'无界面模式已启动，结果页面: {self._result_html_path}')
+        if self._auto_start:
+            self.start_poll()
+
+    async def stop(self):
+        for handle in (self._publish_handle, self._close_handle):
+            if handle is not None:
+                handle.cancel()
+        self._engine.set_on_changed(None)
+        self._engine.set_on_closed(None)
+
+    def on_signal(self, signum: int):
+        """NetworkWorker收到信号时调用"""
+        if signum == getattr(signal, 'SIGUSR1', None):
+            self.start_poll()
+        elif signum == getattr(signal, 'SIGUSR2', None):
+            self.stop_poll()
+        elif signum in (signal.SIGINT, signal.SIGTERM):
+            self.shut_down()
+
+    def shut_down(self):
+        if self._on_shut_down is not None:
+            self._on_shut_down()
+
+    def profile(self, mode: str, seconds: float) -> str:
+        """
+        分析网络线程一段时间，结果写到log目录
+
+        :return: 输出文件的路径前缀
+        :raises ValueError: 参数不对，或者同样的分析正在进行
+        """
+        if self._on_profile is None:
+            raise ValueError('profiling is not available')
+        return self._on_profile(mode, seconds)
+
+    def start_poll(self, countdown_seconds: Optional[int] = None) -> bool:
+        """
+        开始统计
+
+        :param countdown_seconds: 倒计时秒数，默认使用统计参数中的
+        :return: 是否开始了统计，已经在统计时返回False
+        """
+        if self._is_poll_active:
+            return False
+        settings = self._settings
+        if countdown_seconds is None or countdown_seconds <= 0:
+            countdown_seconds = settings.countdown_seconds
+
+        deadline_config = config.get_section('deadline', listener.DEFAULT_DEADLINE_CONFIG)
+        self._engine.start(
+            countdown_seconds, settings.initial_count, timestamp_cutoff=deadline_config['timestamp_cutoff'],
+            late_grace_seconds=float(deadline_config['late_grace_seconds'])
+        )
+        logger.info(f'开始统计，倒计时 {countdown_seconds} 秒，正则表达式匹配方式: {self._engine.matcher.mode}')
+
+        # 将输出的html文件恢复成所有数值为0
+        self._is_poll_active = True
+        self._live_mode = 'traditional'
+        self.export('traditional')
+        self._schedule_close_timer()
+        return True
+
+    def stop_poll(self) -> bool:
+        """
+        结束统计并导出结果
+
+        :return: 是否结束了统计，不在统计时返回False
+        """
+        if self._close_handle is not None:
+            self._close_handle.cancel()
+            self._close_handle = None
+        if not self._is_poll_active:
+            return False
+        self._is_poll_active = False
+        self._engine.stop()
+        snapshot = self._engine.snapshot()
+        logger.info(f'统计结束，共 {snapshot.merged.total_votes} 票')
+        self._live_mode = self._result_mode
+        self.export(self._result_mode)
+        return True
+
+    def _schedule_close_timer(self):
+        if self._close_handle is not None:
+            self._close_handle.cancel()
+        delay = max(self._engine.close_time - time.monotonic(), 0.0)
+        self._close_handle = self._loop.call_later(delay, self._on_close_timer)
+
+    def _on_close_timer(self):
+        self._close_handle = None
+        if self._engine.is_counting and time.monotonic() < self._engine.close_time:
+            # 定时器提前触发了
+            self._schedule_close_timer()
+            return
+        self.stop_poll()
+
+    def status(self) -> dict:
+        snapshot = self._engine.snapshot()
+        status = {
+            'is_counting': snapshot.is_counting,
+            'remaining_seconds': max(self._engine.deadline - time.monotonic(), 0.0) if snapshot.is_counting else 0.0,
+            'merged': self._compute_result(snapshot, snapshot.merged, self._live_mode),
+            'rooms': {
+                room_slug(room_key): self._compute_result(snapshot, tally, self._live_mode)
+                for room_key, tally in snapshot.rooms.items()
+            },
+            'match_cache': self._engine.matcher.get_cache_stats() if self._engine.matcher is not None else None,
+            'ingest': blcsdk.get_ingest_stats(),
+        }
+        return status
+
+    def export(self, mode: Optional[str] = None):
+        """导出结果页面，合并视图导出到result.html，每个房间导出到result_<房间>.html"""
+        if mode is None:
+            mode = self._live_mode
+        snapshot = self._engine.snapshot()
+        timeline = self._engine.timeline_snapshot()
+        result_dir = os.path.dirname(self._result_html_path)
+        self._export_tally(snapshot, snapshot.merged, self._result_html_path, mode, self._get_timeline_points(timeline))
+        for room_key, tally in snapshot.rooms.items():
+            filename = os.path.join(result_dir, f'result_{room_slug(room_key)}.html')
+            self._export_tally(snapshot, tally, filename, mode)
+        result_exporter.export_timeline(timeline, result_dir)
+        self._publish(snapshot)
+
+    def _export_tally(
+        self, snapshot: VoteSnapshot, tally: TallySnapshot, filename: str, mode: str,
+        timeline_points: Optional[list] = None
+    ):
+        settings = self._settings
+        result_exporter.export_result_html(
+            settings.title, [tally.vote_counts[level] for level in VOTE_LEVELS], snapshot.get_total_count(tally),
+            settings.default_level, settings.labels, filename=filename, mode=mode, include_repo=settings.include_repo,
+            timeline_points=timeline_points
+        )
+
+    def _compute_result(
+        self, snapshot: VoteSnapshot, tally: TallySnapshot, mode: str, timeline_points: Optional[list] = None
+    ) -> dict:
+        settings = self._settings
+        return result_exporter.compute_result(
+            settings.title, [tally.vote_counts[level] for level in VOTE_LEVELS], snapshot.get_total_count(tally),
+            settings.default_level, settings.labels, mode=mode, include_repo=settings.include_repo,
+            timeline_points=timeline_points
+        )
+
+    def _get_timeline_points(self, timeline: Optional[vote_timeline.VoteTimeline] = None) -> Optional[list]:
+        """合并视图的累计票数曲线，只显示在合并视图的结果页面上。配置为不显示或者还没有开始过统计时返回None"""
+        if not self._timeline_config['show_on_result_page']:
+            return None
+        if timeline is None:
+            timeline = self._engine.timeline_snapshot()
+            if timeline is None:
+                return None
+        return timeline.get_cumulative_points(int(self._timeline_config['max_points']))
+
+    def _schedule_publish(self, change_time: float):
+        """
+        合并短时间内的多次变化，只推送一次
+
+        :param change_time: 统计结果变化时的time.perf_counter()
+        """
+        if self._publish_handle is None:
+            self._publish_handle = self._loop.call_later(self._publish_interval, self._publish, None, change_time)
+
+    def _publish(self, snapshot: Optional[VoteSnapshot] = None, change_time: Optional[float] = None):
+        """
+        把合并视图和每个房间的结果推送到实时结果页面
+
+        :param change_time: 由统计结果变化触发时是变化时的time.perf_counter()
+        """
+        self._publish_handle = None
+        if snapshot is None:
+            snapshot = self._engine.snapshot()
+        mode = self._live_mode
+        result_server.publish(self._compute_result(snapshot, snapshot.merged, mode, self._get_timeline_points()))
+        rooms = set()
+        for room_key, tally in snapshot.rooms.items():
+            room = room_slug(room_key)
+            rooms.add(room)
+            result_server.publish(self._compute_result(snapshot, tally, mode), room)
+        for room in self._published_rooms - rooms:
+            result_server.unpublish(room)
+        self._published_rooms = rooms
+        if change_time is not None:
+            metrics.RESULT_APPLY_SECONDS.observe(time.perf_counter() - change_time)
+
+
+class ControlServer:
+    """
+    本地控制端口，每行一条命令，每条命令返回一行JSON
+
+    运行在NetworkWorker的事件循环中。没有认证，只应该监听本地地址
+
+    :param controller: 执行命令的HeadlessController
+    :param host: 监听地址
+    :param port: 监听端口
+    """
+
+    def __init__(self, controller: HeadlessController, host: str = '127.0.0.1', port: int = 12452):
+        self._controller = controller
+        self._host = host
+        self._port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+        # 连接 -> 处理连接的任务，关闭时等待它们结束
+        self._clients: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+
+    async def start(self):
+        try:
+            self._server = await asyncio.start_server(self._handle_client, self._host, self._port)
+        except OSError as e:
+            # 端口被占用时仍然可以用信号控制
+            logger.error(f'控制端口启动失败: {e}')
+            return
+        logger.info(f'控制端口已启动: {self._host}:{self._port}')
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        # 关闭连接后readline会返回空，处理连接的任务会自己结束
+        for writer in self._clients:
+            writer.close()
+        await asyncio.gather(*self._clients.values(), return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                response = self._handle_command(line)
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self._clients[writer]
+            writer.close()
+
+    def _handle_command(self, line: str) -> dict:
+        controller = self._controller
+        command, *args = line.split()
+        command = command.lower()
+        try:
+            if command == 'start':
+                countdown_seconds = int(args[0]) if args else None
+                return {'ok': controller.start_poll(countdown_seconds)}
+            elif command == 'stop':
+                return {'ok': controller.stop_poll()}
+            elif command == 'status':
+                return {'ok': True, **controller.status()}
+            elif command == 'export':
+                mode = args[0] if args else None
+                if mode is not None and mode not in RESULT_MODES:
+                    return {'ok': False, 'error': f'unknown mode: {mode}'}
+                controller.export(mode)
+                return {'ok': True}
+            elif command == 'profile':
+                mode = args[0].lower() if args else 'sample'
+                seconds = float(args[1]) if len(args) > 1 else 30.0
+                return {'ok': True, 'output': controller.profile(mode, seconds)}
+            elif command == 'shutdown':
+                controller.shut_down()
+                return {'ok': True}
+        except ValueError as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': False, 'error': f'unknown command: {command}'}
+
+
+def run(argv: Sequence[str], network_worker) -> int:
+    """无界面模式的入口，见main.py"""
+    args = parse_args(argv)
+    try:
+        config_dict = config.load_config()
+    except (OSError, ValueError):
+        logger.exception('读取配置文件失败，使用默认配置')
+        config_dict = {}
+    settings = load_poll_settings(config_dict, args)
+    # 匹配在网络线程中进行，一个会灾难性回溯的正则表达式就能卡住接收弹幕
+    unsafe_patterns = vote_matcher.find_unsafe_patterns(settings.patterns)
+    if unsafe_patterns:
+        for level, risks in unsafe_patterns.items():
+            logger.error(f'等级 {level} 的正则表达式匹配长弹幕时可能卡死: {settings.patterns[level]}, {"; ".join(risks)}')
+        return 1
+    options = config.get_section('headless', DEFAULT_CONFIG)
+    result_mode = args.mode or options['result_mode']
+    if result_mode not in RESULT_MODES:
+        result_mode = 'niconico'
+    control_port = args.control_port if args.control_port is not None else int(options['control_port'])
+
+    controller = HeadlessController(
+        settings, result_mode=result_mode, publish_interval=float(options['publish_interval']),
+        auto_start=args.start, on_shut_down=network_worker.start_shut_down,
+        on_profile=network_worker.start_profiling
+    )
+    network_worker.set_on_signal(controller.on_signal)
+    listener.set_shut_down_handler(network_worker.start_shut_down)
+    network_worker.add_service(controller)
+    if control_port:
+        network_worker.add_service(ControlServer(controller, options['control_host'], control_port))
+
+    network_worker.init()
+    logger.info('Running headless')
+    network_worker.join()
+    logger.info('Shut down')
+    return 0
@@ -1,39 +1,63 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import __main__
 import logging
-import re
-from typing import Optional, TYPE_CHECKING
-
-import wx
+import time
+from typing import Callable, Optional
 
 import blcsdk
 import blcsdk.api as sdk_api
 import blcsdk.models as sdk_models
-
-if TYPE_CHECKING:
-    from gui import VoteFrame
+import metrics
+from vote_engine import VoteEngine
 
 logger = logging.getLogger('niconico-rating.' + __name__)
 
 _msg_handler: Optional['VoteHandler'] = None
-_vote_frame: Optional['VoteFrame'] = None
+_shut_down_handler: Optional[Callable[[], None]] = None
+"""blivechat断开时调用，在网络线程中"""
+_open_admin_ui_handler: Optional[Callable[[], None]] = None
+"""blivechat请求打开插件管理界面时调用，在网络线程中"""
+vote_engine = VoteEngine()
+"""投票统计的核心，网络线程直接计入投票，GUI线程读取快照"""
+
+
+def _get_match_cache_stat(key: str) -> Optional[float]:
+    matcher = vote_engine.matcher
+    cache_stats = matcher.get_cache_stats() if matcher is not None else None
+    return cache_stats[key] if cache_stats is not None else None
+
+
+# 更新正则表达式时缓存会清空，所以是gauge
+metrics.Gauge('niconico_match_cache_hits', '当前正则表达式的匹配缓存命中次数', lambda: _get_match_cache_stat('hits'))
+metrics.Gauge('niconico_match_cache_misses', '当前正则表达式的匹配缓存未命中次数', lambda: _get_match_cache_stat('misses'))
+metrics.Gauge('niconico_match_cache_size', '当前正则表达式的匹配缓存条数', lambda: _get_match_cache_stat('size'))
+
+DEFAULT_DEADLINE_CONFIG = {
+    # 按弹幕的发送时间戳截止：截止时间之后才到达、但是在截止时间之前发送的弹幕也计入
+    'timestamp_cutoff': False,
+    # 按时间戳截止时，截止之后最多再等待这么多秒的迟到弹幕
+    'late_grace_seconds': 3.0,
+}
 
 
-async def init():
+async def init(metrics_enabled: bool = False):
+    """
+    :param metrics_enabled: 是否记录匹配的耗时和计数，见metrics.py
+    """
     global _msg_handler
     
     print("📡 设置消息处理器...")
-    _msg_handler = VoteHandler()
+    _msg_handler = VoteHandler(metrics_enabled)
     blcsdk.set_msg_handler(_msg_handler)
     print("✅ 消息处理器设置完成")
     
-    # 房间管理（仅日志记录，不创建文件）
+    # 为已有的房间创建独立的统计
     try:
         blc_rooms = await sdk_api.get_rooms()
         for blc_room in blc_rooms:
             if blc_room.room_id is not None:
                 logger.info(f'发现已有房间: {blc_room.room_id}')
+            vote_engine.add_room(blc_room.room_key)
     except sdk_api.SdkError:
         pass
     
@@ -45,78 +69,106 @@ def shut_down():
     blcsdk.set_msg_handler(None)
 
 
-def set_vote_frame(frame):
-    """设置投票窗口引用"""
-    global _vote_frame
-    _vote_frame = frame
+def set_shut_down_handler(handler: Optional[Callable[[], None]]):
+    """设置blivechat断开时的回调，GUI和无界面模式各自决定怎么退出"""
+    global _shut_down_handler
+    _shut_down_handler = handler
+
+
+def set_open_admin_ui_handler(handler: Optional[Callable[[], None]]):
+    """设置打开插件管理界面的回调"""
+    global _open_admin_ui_handler
+    _open_admin_ui_handler = handler
 
 
 class VoteHandler(blcsdk.BaseHandler):
-    def __init__(self):
+    # 投票只用到弹幕的content和uid，用只读视图代替完整的消息对象，减少对象分配
+    _CMD_CALLBACK_DICT = {
+        **blcsdk.BaseHandler._CMD_CALLBACK_DICT,
+        sdk_models.Command.ADD_TEXT: blcsdk.make_msg_callback('_on_add_text', sdk_models.AddTextMsgView),
+    }
+
+    def __init__(self, metrics_enabled: bool = False):
         super().__init__()
-        # 缓存编译后的正则表达式，提高性能
-        self._compiled_patterns = {}
-        self._is_counting = False
-        self._update_patterns()
+        self._metrics_enabled = metrics_enabled
+        # 预过滤时匹配的结果，避免构造消息对象后重复匹配
+        self._filtered_content: Optional[str] = None
+        self._filtered_level: Optional[int] = None
+        # 大部分弹幕都不是投票，在构造消息对象之前就排除。不记录指标时用不计时的版本，热路径上没有额外开销
+        self.set_command_filter(
+            sdk_models.Command.ADD_TEXT,
+            self._filter_add_text_with_metrics if metrics_enabled else self._filter_add_text
+        )
         logger.info("VoteHandler初始化完成")
     
-    def _update_patterns(self):
-        """更新编译后的正则表达式"""
-        if not _vote_frame:
-            logger.warning("GUI应用未初始化，无法更新正则表达式")
-            return
-            
-        self._compiled_patterns.clear()
-        self._is_counting = _vote_frame.is_counting
-        
-        if not self._is_counting:
-            logger.info("当前未在统计状态，正则表达式已清空")
-            return
-        
-        # 获取GUI中的投票等级设置并编译
-        for level, pattern in _vote_frame.vote_levels.items():
-            try:
-                self._compiled_patterns[level] = re.compile(pattern)
-                logger.debug(f"等级 {level} 正则表达式编译成功: {pattern}")
-            except re.error as e:
-                logger.warning(f'等级 {level} 的正则表达式编译失败: {pattern}, 错误: {e}')
-        logger.info(f"正则表达式更新完成，共 {len(self._compiled_patterns)} 个模式")
-    
-    def _should_process_vote(self, content: str) -> bool:
-        """判断是否需要处理投票消息"""
-        if not self._is_counting:
+    def _get_vote_level(self, content: str, timestamp: int) -> Optional[int]:
+        """获取投票等级，如果不在统计状态或不匹配则返回None"""
+        if content is self._filtered_content:
+            return self._filtered_level
+        return vote_engine.match(content, timestamp)
+
+    def _filter_add_text(self, command: dict) -> bool:
+        """在构造弹幕消息对象之前，用原始数据判断是否可能是投票"""
+        if not vote_engine.is_counting:
             return False
-            
-        content = content.strip()
-        if not content:
+        extra = command.get('extra', None)
+        if extra is not None and extra.get('isFromPlugin', False):
+            return False
+
+        data = command['data']
+        # 已经投过票的账号刷的弹幕占了投票弹幕的大部分，不用再匹配。RoomKey是NamedTuple，可以直接用元组查找
+        room_key_dict = extra.get('roomKey', None) if extra is not None else None
+        room_key = (room_key_dict['type'], room_key_dict['value']) if room_key_dict is not None else None
+        if vote_engine.has_voted(room_key, data[16]):  # AddTextMsg.uid
+            return False
+
+        content = data[4]  # AddTextMsg.content
+        # 截止时间在这里逐条检查，和GUI线程的负载无关
+        level = vote_engine.match(content, data[1])  # AddTextMsg.timestamp
+        if level is None:
+            return False
+        self._filtered_content = content
+        self._filtered_level = level
+        return True
+
+    def _filter_add_text_with_metrics(self, command: dict) -> bool:
+        """和_filter_add_text相同，另外记录匹配的耗时和计数"""
+        if not vote_engine.is_counting:
+            return False
+        extra = command.get('extra', None)
+        if extra is not None and extra.get('isFromPlugin', False):
+            return False
+
+        data = command['data']
+        room_key_dict = extra.get('roomKey', None) if extra is not None else None
+        room_key = (room_key_dict['type'], room_key_dict['value']) if room_key_dict is not None else None
+        if vote_engine.has_voted(room_key, data[16]):  # AddTextMsg.uid
+            metrics.VOTED_SKIPS.inc()
             return False
-            
-        # 检查是否匹配任何投票等级
-        for level, pattern in self._compiled_patterns.items():
-            if pattern.match(content):
-                return True
-                
-        return False
-    
-    def _get_vote_level(self, content: str) -> Optional[int]:
-        """获取投票等级，如果不匹配则返回None"""
-        content = content.strip()
-        for level, pattern in self._compiled_patterns.items():
-            if pattern.match(content):
-                return level
-        return None
+
+        content = data[4]  # AddTextMsg.content
+        start_time = time.perf_counter()
+        level = vote_engine.match(content, data[1])  # AddTextMsg.timestamp
+        metrics.MATCH_SECONDS.observe(time.perf_counter() - start_time)
+        if level is None:
+            metrics.MATCH_MISSES.inc()
+            return False
+        metrics.MATCH_VOTES.inc()
+        self._filtered_content = content
+        self._filtered_level = level
+        return True
 
     def on_client_stopped(self, client: blcsdk.BlcPluginClient, exception: Optional[Exception]):
         logger.info('blivechat disconnected')
-        wx.CallAfter(__main__.start_shut_down)
+        if _shut_down_handler is not None:
+            _shut_down_handler()
 
     def _on_open_plugin_admin_ui(
         self, client: blcsdk.BlcPluginClient, message: sdk_models.OpenPluginAdminUiMsg, extra: sdk_models.ExtraData
     ):
         # 打开GUI窗口
-        if _vote_frame:
-            wx.CallAfter(_vote_frame.Raise)
-            wx.CallAfter(_vote_frame.SetFocus)
+        if _open_admin_ui_handler is not None:
+            _open_admin_ui_handler()
 
     def _on_add_room(
         self, client: blcsdk.BlcPluginClient, message: sdk_models.AddRoomMsg, extra: sdk_models.ExtraData
@@ -125,6 +177,7 @@ class VoteHandler(blcsdk.BaseHandler):
         if extra.is_from_plugin:
             return
         logger.info(f'添加房间: {extra.room_key}')
+        vote_engine.add_room(extra.room_key)
 
     def _on_room_init(
         self, client: blcsdk.BlcPluginClient, message: sdk_models.RoomInitMsg, extra: sdk_models.ExtraData
@@ -139,6 +192,7 @@ class VoteHandler(blcsdk.BaseHandler):
             return
         if extra.room_id is not None:
             logger.info(f'房间 {extra.room_id} 已删除')
+        vote_engine.del_room(extra.room_key)
 
     def _on_add_text(self, client: blcsdk.BlcPluginClient, message: sdk_models.AddTextMsg, extra: sdk_models.ExtraData):
         if extra.is_from_plugin:
@@ -147,20 +201,13 @@ class VoteHandler(blcsdk.BaseHandler):
         # 记录所有非插件弹幕
         # logger.info(f'收到弹幕: {message.author_name}: {message.content}')
 
-        # 预过滤：只处理可能匹配的弹幕
-        if self._should_process_vote(message.content):
-            # 获取投票等级
-            vote_level = self._get_vote_level(message.content)
-            if vote_level and _vote_frame:
-                # 使用wx.CallAfter确保在主线程中更新GUI
-                wx.CallAfter(_vote_frame.process_vote_by_level, message.uid, vote_level)
-                # logger.debug(f'投票弹幕: {message.author_name}: {message.content} -> 等级 {vote_level}')
-            else:
-                # logger.warning(f'投票弹幕处理失败: vote_level={vote_level}, _vote_frame={_vote_frame is not None}')
-                pass
-        else:
-            # logger.debug(f'弹幕不匹配投票规则: {message.content}')
-            pass
+        # 一次匹配得到投票等级，不匹配则为None
+        vote_level = self._get_vote_level(message.content, message.timestamp)
+        if vote_level:
+            # 直接计入，GUI线程只在统计结果变化后读取快照，按房间分开统计
+            if vote_engine.ingest(extra.room_key, message.uid, vote_level) and self._metrics_enabled:
+                metrics.VOTES_COUNTED.inc()
+            # logger.debug(f'投票弹幕: {message.author_name}: {message.content} -> 等级 {vote_level}')
 
     def _on_add_gift(self, client: blcsdk.BlcPluginClient, message: sdk_models.AddGiftMsg, extra: sdk_models.ExtraData):
         # 礼物消息不参与投票
@@ -178,10 +225,3 @@ class VoteHandler(blcsdk.BaseHandler):
         # 醒目留言不参与投票
         pass
 
-
-# 提供给GUI调用的函数，用于更新listener中的正则表达式缓存
-def update_vote_patterns():
-    """更新投票正则表达式缓存"""
-    if _msg_handler:
-        _msg_handler._update_patterns()
-        logger.debug('投票正则表达式缓存已更新')
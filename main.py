@@ -1,50 +1,112 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import argparse
 import asyncio
 import concurrent.futures
 import logging
 import logging.handlers
 import os
 import signal
+import socket
 import sys
 import threading
 from typing import *
 
-import wx
-
 import blcsdk
+import config
 import listener
-from gui import VoteFrame
+import metrics
+import result_server
+
+if TYPE_CHECKING:
+    import recorder
 
 logger = logging.getLogger('niconico-rating')
 
-app: Optional['VoteApp'] = None
+RECORD_ENV_NAME = 'NICONICO_RATING_RECORD'
+"""设置这个环境变量为1时录制收到的原始消息到log/recordings目录"""
+PROFILE_ENV_NAME = 'NICONICO_RATING_PROFILE'
+"""设置这个环境变量为“模式[:秒数]”时，连接blivechat后分析网络线程，如sample:60，见profiling.py"""
+
+DEFAULT_INGEST_CONFIG = {
+    # 接收队列中最多的房间内消息数，0表示不用队列，在接收消息的协程中直接统计
+    'queue_size': 0,
+    # 队列满时的处理方式：block暂停接收，drop_non_text丢弃礼物等弹幕以外的消息，drop_oldest丢弃最早的消息
+    'overflow_policy': 'block',
+}
+
+_signal_wakeup_send_sock: Optional[socket.socket] = None
 
 
 def main():
-    init_signal_handlers()
+    # 其他参数由无界面模式解析
+    parser = argparse.ArgumentParser(description='niconico风格弹幕投票系统', add_help=False)
+    parser.add_argument('--headless', action='store_true', help='不启动GUI，不导入wxPython，见headless.py')
+    args, remaining_args = parser.parse_known_args()
+
+    if args.headless:
+        # 无界面模式中SIGUSR1开始统计，SIGUSR2结束统计
+        signums = [signal.SIGINT, signal.SIGTERM]
+        for name in ('SIGUSR1', 'SIGUSR2'):
+            if hasattr(signal, name):
+                signums.append(getattr(signal, name))
+    else:
+        signums = [signal.SIGINT, signal.SIGTERM]
+    signal_wakeup_sock = init_signal_handlers(signums)
     init_logging()
-    
-    global app
-    app = VoteApp()
-    
-    logger.info('Running event loop')
-    app.MainLoop()
-
 
-def init_signal_handlers():
+    network_worker = NetworkWorker(signal_wakeup_sock)
+    if args.headless:
+        import headless
+        return headless.run(remaining_args, network_worker)
+
+    # 先开始连接blivechat，导入wx和创建窗口的同时网络线程在等待连接
+    network_worker.start()
+    # 只有GUI模式才导入wx
+    import gui
+    return gui.run(network_worker)
+
+
+def get_ingest_options() -> dict:
+    """从配置读取blcsdk.init的接收队列参数"""
+    ingest_config = config.get_section('ingest', DEFAULT_INGEST_CONFIG)
+    overflow_policy = ingest_config['overflow_policy']
+    try:
+        overflow_policy = blcsdk.OverflowPolicy(overflow_policy)
+    except ValueError:
+        logger.error(f'未知的接收队列溢出处理方式: {overflow_policy!r}，使用默认值')
+        overflow_policy = blcsdk.OverflowPolicy(DEFAULT_INGEST_CONFIG['overflow_policy'])
+    return {
+        'ingest_queue_size': max(int(ingest_config['queue_size']), 0),
+        'overflow_policy': overflow_policy,
+    }
+
+
+def init_signal_handlers(signums: Iterable[int]) -> socket.socket:
+    """
+    设置信号处理函数
+
+    主线程阻塞在wx的事件循环里或者等待网络线程结束时，Python的信号处理函数不能及时执行。所以用wakeup fd把信号写到
+    socket里，由网络线程读取并处理，这样不需要为了响应信号定时唤醒主线程
+
+    :return: 收到信号时可读的socket，读到的每个字节是一个信号编号
+    """
     def signal_handler(*_args):
-        wx.CallAfter(start_shut_down)
+        # 信号由网络线程处理，见NetworkWorker._watch_signals
+        pass
 
-    for signum in (signal.SIGINT, signal.SIGTERM):
+    for signum in signums:
         signal.signal(signum, signal_handler)
 
-
-def start_shut_down():
-    if app is not None and app.IsMainLoopRunning():
-        app.ExitMainLoop()
-    else:
-        wx.Exit()
+    # Windows上wakeup fd只能是socket，所以不用pipe
+    recv_sock, send_sock = socket.socketpair()
+    recv_sock.setblocking(False)
+    send_sock.setblocking(False)
+    signal.set_wakeup_fd(send_sock.fileno())
+    # 保持引用，防止被回收后fd失效
+    global _signal_wakeup_send_sock
+    _signal_wakeup_send_sock = send_sock
+    return recv_sock
 
 
 def init_logging():
@@ -67,51 +129,71 @@ def init_logging():
     )
 
 
-class VoteApp(wx.App):
-    def __init__(self, *args, **kwargs):
-        self._network_worker = NetworkWorker()
-        self._dummy_timer: Optional[wx.Timer] = None
-        self._vote_frame: Optional[VoteFrame] = None
-        
-        super().__init__(*args, clearSigInt=False, **kwargs)
-        self.SetExitOnFrameDelete(False)
-
-    def OnInit(self):
-        # 这个定时器只是为了及时响应信号，因为只有处理UI事件时才会唤醒主线程
-        self._dummy_timer = wx.Timer(self)
-        self._dummy_timer.Start(1000)
-        self.Bind(wx.EVT_TIMER, lambda _event: None, self._dummy_timer)
-
-        # 创建投票窗口
-        self._vote_frame = VoteFrame(None)
-        self._vote_frame.Show()
-
-        # 初始化网络工作线程
-        self._network_worker.init()
-        return True
-
-    def OnExit(self):
-        logger.info('Start to shut down')
-        
-        self._network_worker.start_shut_down()
-        self._network_worker.join(10)
-        
-        return super().OnExit()
+class NetworkWorker:
+    """
+    在单独的线程运行asyncio事件循环，连接blivechat，运行结果页面服务器等
 
+    :param signal_wakeup_sock: 收到信号时可读的socket，见init_signal_handlers
+    """
 
-class NetworkWorker:
-    def __init__(self):
+    def __init__(self, signal_wakeup_sock: Optional[socket.socket] = None):
+        # 在线程中才创建协程，没有启动网络线程就退出时不会有协程没有被await的警告
         self._worker_thread = threading.Thread(
-            target=asyncio.run, args=(self._worker_thread_func(),), daemon=True
+            target=lambda: asyncio.run(self._worker_thread_func()), daemon=True
         )
         self._thread_init_future = concurrent.futures.Future()
         
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._shut_down_event: Optional[asyncio.Event] = None
+        self._frame_recorder: Optional['recorder.FrameRecorder'] = None
+        self._result_server: Optional[result_server.ResultServer] = None
+        self._metrics_server: Optional[metrics.MetricsServer] = None
+        self._signal_wakeup_sock = signal_wakeup_sock
+        self._on_signal: Optional[Callable[[int], None]] = None
+        self._services: List[Any] = []
+
+    def set_on_signal(self, on_signal: Optional[Callable[[int], None]]):
+        """设置收到信号时的回调，在网络线程中调用，参数是信号编号"""
+        self._on_signal = on_signal
+
+    def add_service(self, service):
+        """
+        添加在网络线程中运行的服务，要在start之前调用
+
+        :param service: 有async start()和async stop()方法的对象，start在连接blivechat之后调用
+        """
+        self._services.append(service)
+
+    @property
+    def loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        return self._loop
+
+    def start_profiling(self, mode: str, seconds: float) -> str:
+        """
+        分析网络线程一段时间，可以在任意线程调用，见profiling.start_profiling
+
+        :return: 输出文件的路径前缀
+        :raises ValueError: 参数不对，或者同样的分析正在进行
+        """
+        if self._loop is None or not self._worker_thread.is_alive():
+            raise ValueError('network thread is not running')
+        # 性能分析是调试功能，用到时才导入
+        import profiling
+        target = profiling.ProfileTarget('network', self._worker_thread.ident, self._loop.call_soon_threadsafe)
+        return profiling.start_profiling(mode, seconds, target)
 
     def init(self):
-        self._worker_thread.start()
-        self._thread_init_future.result(10)
+        self.start()
+        self.wait_init()
+
+    def start(self):
+        """启动网络线程，不等待初始化完成"""
+        if self._worker_thread.ident is None:
+            self._worker_thread.start()
+
+    def wait_init(self, timeout: Optional[float] = 10):
+        """等待网络线程初始化完成，初始化失败时抛出异常"""
+        self._thread_init_future.result(timeout)
 
     def start_shut_down(self):
         if self._shut_down_event is not None:
@@ -136,24 +218,106 @@ class NetworkWorker:
             await self._shut_down()
 
     async def _init_in_worker_thread(self):
-        await blcsdk.init()
+        if os.environ.get(RECORD_ENV_NAME, '') == '1':
+            # 录制是调试功能，用到时才导入
+            import recorder
+            self._frame_recorder = recorder.FrameRecorder(recorder.DEFAULT_RECORDINGS_DIR)
+            self._frame_recorder.start()
+            blcsdk.set_frame_recorder(self._frame_recorder.record)
+
+        metrics_config = config.get_section('metrics', metrics.DEFAULT_CONFIG)
+        if metrics_config['enabled']:
+            blcsdk.set_stats_hook(metrics.SdkStatsHook())
+
+        await blcsdk.init(**get_ingest_options())
         if not blcsdk.is_sdk_version_compatible():
             raise RuntimeError('SDK version is not compatible')
 
-        await listener.init()
+        await listener.init(metrics_enabled=bool(metrics_config['enabled']))
+
+        await self._start_result_server()
+        if metrics_config['enabled']:
+            await self._start_metrics_server(metrics_config)
+        for service in self._services:
+            await service.start()
+
+        profile_spec = os.environ.get(PROFILE_ENV_NAME, '')
+        if profile_spec:
+            import profiling
+            try:
+                self.start_profiling(*profiling.parse_spec(profile_spec))
+            except ValueError as e:
+                logger.error(f'{PROFILE_ENV_NAME}={profile_spec} 无效: {e}')
         
         self._shut_down_event = asyncio.Event()
 
+    async def _start_result_server(self):
+        server_config = config.get_section('result_server', result_server.DEFAULT_CONFIG)
+        if not server_config['enabled']:
+            return
+        server = result_server.ResultServer(port=int(server_config['port']), fps=float(server_config['fps']))
+        try:
+            await server.start()
+        except OSError as e:
+            # 端口被占用等情况不影响投票统计，可以继续使用静态结果页面
+            logger.error(f'结果页面服务启动失败: {e}')
+            await server.stop()
+            return
+        self._result_server = server
+
+    async def _start_metrics_server(self, metrics_config: dict):
+        server = metrics.MetricsServer(host=metrics_config['host'], port=int(metrics_config['port']))
+        try:
+            await server.start()
+        except OSError as e:
+            # 指标只用于监控，启动失败不影响投票统计
+            logger.error(f'运行指标服务启动失败: {e}')
+            await server.stop()
+            return
+        self._metrics_server = server
+
     async def _run(self):
         logger.info('Running network thread event loop')
-        await self._shut_down_event.wait()
+        signal_watcher = None
+        if self._signal_wakeup_sock is not None:
+            signal_watcher = asyncio.create_task(self._watch_signals())
+        try:
+            await self._shut_down_event.wait()
+        finally:
+            if signal_watcher is not None:
+                signal_watcher.cancel()
         logger.info('Network thread start to shut down')
 
-    @staticmethod
-    async def _shut_down():
+    async def _watch_signals(self):
+        """读取wakeup fd收到的信号，没有设置回调时SIGINT、SIGTERM结束网络线程"""
+        while True:
+            data = await self._loop.sock_recv(self._signal_wakeup_sock, 64)
+            if not data:
+                break
+            for signum in data:
+                logger.info(f'Received signal {signum}')
+                on_signal = self._on_signal
+                if on_signal is not None:
+                    on_signal(signum)
+                elif signum in (signal.SIGINT, signal.SIGTERM):
+                    self.start_shut_down()
+
+    async def _shut_down(self):
         listener.shut_down()
+        for service in reversed(self._services):
+            try:
+                await service.stop()
+            except Exception:  # noqa
+                logger.exception(f'Failed to stop service {service!r}')
+        if self._result_server is not None:
+            await self._result_server.stop()
+        if self._metrics_server is not None:
+            await self._metrics_server.stop()
         await blcsdk.shut_down()
+        if self._frame_recorder is not None:
+            blcsdk.set_frame_recorder(None)
+            await self._loop.run_in_executor(None, self._frame_recorder.close, 5)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
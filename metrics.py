@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+运行指标：弹幕处理各阶段的计数和耗时直方图，由MetricsServer以Prometheus文本格式在本地端口提供
+
+记录指标在每条弹幕的热路径上，所以要足够便宜，直播时可以一直开着：
+
+- 直方图的桶在创建时预分配，observe只做一次二分查找和两次加法，不分配对象
+- 不加锁。每个指标只由一个线程写入（网络线程或GUI线程），导出时读到的值最多差一次正在进行的记录
+"""
+import bisect
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, TYPE_CHECKING
+
+import blcsdk
+import blcsdk.models as sdk_models
+
+if TYPE_CHECKING:
+    # aiohttp.web导入比较慢，启动服务时才导入，不拖慢连接blivechat
+    from aiohttp import web
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+DEFAULT_CONFIG = {'enabled': False, 'host': '127.0.0.1', 'port': 12453}
+"""配置文件中metrics项的默认值"""
+
+STAGE_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+)
+"""处理一条消息的各阶段耗时的桶上限（秒）"""
+UI_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""刷新界面、导出结果页面等耗时的桶上限（秒）"""
+
+_registry: List['_Metric'] = []
+"""所有指标，按创建的顺序导出"""
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, help_text: str, labels: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.help_text = help_text
+        self.label_text = ','.join(f'{key}="{_escape_label_value(value)}"' for key, value in (labels or {}).items())
+        _registry.append(self)
+
+    def _format_sample(self, suffix: str, value: float, extra_label: str = '') -> str:
+        label_text = ','.join(text for text in (self.label_text, extra_label) if text)
+        if label_text:
+            return f'{self.name}{suffix}{{{label_text}}} {_format_value(value)}'
+        return f'{self.name}{suffix} {_format_value(value)}'
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type_name = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Optional[Dict[str, str]] = None):
+        super().__init__(name, help_text, labels)
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def render(self) -> List[str]:
+        return [self._format_sample('', self.value)]
+
+
+class Gauge(_Metric):
+    """
+    导出时才读取的值
+
+    :param get_value: 导出时调用，在网络线程中，返回None时不导出这个指标
+    """
+    type_name = 'gauge'
+
+    def __init__(
+        self, name: str, help_text: str, get_value: Callable[[], Optional[float]],
+        labels: Optional[Dict[str, str]] = None
+    ):
+        super().__init__(name, help_text, labels)
+        self._get_value = get_value
+
+    def render(self) -> List[str]:
+        try:
+            value = self._get_value()
+        except Exception:  # noqa
+            logger.exception(f'读取指标 {self.name} 失败:')
+            return []
+        if value is None:
+            return []
+        return [self._format_sample('', value)]
+
+
+class Histogram(_Metric):
+    """
+    耗时直方图
+
+    :param buckets: 桶的上限，从小到大，不包括+Inf
+    """
+    type_name = 'histogram'
+
+    def __init__(
+        self, name: str, help_text: str, buckets: Sequence[float] = STAGE_BUCKETS,
+        labels: Optional[Dict[str, str]] = None
+    ):
+        super().__init__(name, help_text, labels)
+        self._upper_bounds = tuple(buckets)
+        # 最后一个是+Inf桶。每个桶只计落在这个桶里的次数，导出时再累加
+        self._counts = [0] * (len(self._upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        # Prometheus的桶上限是闭区间，bisect_left找到第一个不小于value的上限
+        self._counts[bisect.bisect_left(self._upper_bounds, value)] += 1
+        self.sum += value
+
+    def render(self) -> List[str]:
+        counts = list(self._counts)
+        lines = []
+        cumulative_count = 0
+        for upper_bound, count in zip(self._upper_bounds, counts):
+            cumulative_count += count
+            lines.append(self._format_sample('_bucket', cumulative_count, f'le="{_format_value(upper_bound)}"'))
+        cumulative_count += counts[-1]
+        lines.append(self._format_sample('_bucket', cumulative_count, 'le="+Inf"'))
+        lines.append(self._format_sample('_sum', self.sum))
+        lines.append(self._format_sample('_count', cumulative_count))
+        return lines
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def render_text() -> str:
+    """生成Prometheus文本格式的所有指标，同名的指标（标签不同）放在一起"""
+    families: Dict[str, List[_Metric]] = {}
+    for metric in list(_registry):
+        families.setdefault(metric.name, []).append(metric)
+
+    lines = []
+    for name, family in families.items():
+        lines.append(f'# HELP {name} {family[0].help_text}')
+        lines.append(f'# TYPE {name} {family[0].type_name}')
+        for metric in family:
+            lines.extend(metric.render())
+    lines.append('')
+    return '\n'.join(lines)
+
+
+# 网络线程：SDK收到、解码、分发消息
+_frames_received: Dict[Optional[int], Counter] = {}
+"""cmd -> 收到的消息数，第一次收到这种消息时创建"""
+FRAME_DECODE_SECONDS = Histogram('niconico_frame_decode_seconds', '解码一条消息的耗时')
+DISPATCH_SECONDS = Histogram('niconico_dispatch_seconds', '消息处理器（BaseHandler.handle）处理一条消息的耗时，包括匹配和计入投票')
+INGEST_QUEUE_WAIT_SECONDS = Histogram(
+    'niconico_ingest_queue_wait_seconds', '消息在SDK的接收队列中等待处理的时间，只在开启接收队列时记录'
+)
+
+# 网络线程：匹配和计入投票
+MATCH_SECONDS = Histogram('niconico_match_seconds', '用正则表达式匹配一条弹幕的耗时，包括缓存命中的')
+MATCH_VOTES = Counter('niconico_match_total', '统计中匹配的弹幕数', {'result': 'vote'})
+MATCH_MISSES = Counter('niconico_match_total', '统计中匹配的弹幕数', {'result': 'miss'})
+VOTED_SKIPS = Counter('niconico_voted_skip_total', '已经投过票的账号的弹幕，不匹配直接跳过')
+VOTES_COUNTED = Counter('niconico_votes_counted_total', '计入房间统计的投票数')
+
+# GUI线程或无界面模式的网络线程：把统计结果交给界面和结果页面
+RESULT_APPLY_SECONDS = Histogram(
+    'niconico_result_apply_latency_seconds', '统计结果变化到界面和实时结果页面更新完成的时间', UI_BUCKETS
+)
+RESULT_EXPORT_SECONDS = Histogram('niconico_result_export_seconds', '导出一个结果页面文件的耗时', UI_BUCKETS)
+
+
+def _get_ingest_stat(key: str) -> Optional[float]:
+    stats = blcsdk.get_ingest_stats()
+    if stats is None:
+        return None
+    if key == 'dropped':
+        return sum(stats['dropped'].values())
+    return stats[key]
+
+
+Gauge('niconico_ingest_queue_depth', 'SDK接收队列中的消息数', lambda: _get_ingest_stat('depth'))
+Gauge('niconico_ingest_queue_max_depth', 'SDK接收队列最长时的消息数', lambda: _get_ingest_stat('max_depth'))
+Gauge('niconico_ingest_queue_blocks', 'SDK接收队列满时暂停接收的次数', lambda: _get_ingest_stat('block_count'))
+Gauge('niconico_ingest_queue_dropped', 'SDK接收队列满时丢弃的消息数', lambda: _get_ingest_stat('dropped'))
+
+
+class SdkStatsHook(blcsdk.StatsHookInterface):
+    """记录SDK各阶段的指标，在网络线程中调用"""
+
+    def on_frame_decoded(self, cmd: Optional[int], decode_seconds: float):
+        counter = _frames_received.get(cmd, None)
+        if counter is None:
+            try:
+                cmd_name = sdk_models.Command(cmd).name
+            except ValueError:
+                cmd_name = str(cmd)
+            counter = _frames_received[cmd] = Counter(
+                'niconico_frames_received_total', '收到的消息数', {'cmd': cmd_name}
+            )
+        counter.inc()
+        FRAME_DECODE_SECONDS.observe(decode_seconds)
+
+    def on_command_handled(self, cmd: Optional[int], handle_seconds: float, queue_seconds: Optional[float]):
+        DISPATCH_SECONDS.observe(handle_seconds)
+        if queue_seconds is not None:
+            INGEST_QUEUE_WAIT_SECONDS.observe(queue_seconds)
+
+
+class MetricsServer:
+    """
+    在本地提供Prometheus文本格式的指标：GET /metrics
+
+    运行在NetworkWorker的事件循环中。没有认证，只应该监听本地地址
+
+    :param host: 监听地址
+    :param port: 监听端口
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 12453):
+        self._host = host
+        self._port = port
+        self._runner: Optional['web.AppRunner'] = None
+
+    @property
+    def url(self):
+        return f'http://{self._host}:{self._port}/metrics'
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        # Prometheus每次采集都会请求，不写访问日志
+        self._runner = web.AppRunner(app, handle_signals=False, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        logger.info(f'运行指标服务已启动: {self.url}')
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    async def _handle_metrics(request: 'web.Request'):
+        from aiohttp import web
+        return web.Response(body=render_text().encode('utf-8'), headers={
+            'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+            'Cache-Control': 'no-cache',
+        })
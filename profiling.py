@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按需的性能分析：在运行中的插件里分析网络线程或GUI线程一段时间，结果写到log目录，不需要重启blivechat
+
+- sample：采样分析，后台线程定时读取目标线程的调用栈，目标线程几乎没有额外开销，投票高峰时也可以用。
+  输出折叠栈格式（.folded），可以用flamegraph.pl或speedscope查看。采样线程拿到GIL时才能采样，所以目标线程释放GIL的地方
+  （如select）更容易被采到，但是长时间占用CPU的函数，也就是卡顿的原因，每个GIL切换间隔都会被采到
+- cprofile：cProfile确定性分析，结果精确到每个函数的调用次数，但是会让目标线程慢几倍。
+  Python 3.12起cProfile基于sys.monitoring，会同时记录其他线程
+- tracemalloc：开始和结束时各取一次内存快照，输出增长最多的分配位置。分析整个进程，不区分线程
+
+触发方式：环境变量NICONICO_RATING_PROFILE（见main.PROFILE_ENV_NAME）、GUI的性能分析按钮、无界面模式控制端口的profile命令
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, NamedTuple, Set, Tuple
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+PROFILE_MODES = ('sample', 'cprofile', 'tracemalloc')
+DEFAULT_PROFILE_SECONDS = 30.0
+MAX_PROFILE_SECONDS = 3600.0
+DEFAULT_PROFILE_DIR = 'log'
+"""和日志文件放在一起"""
+
+SAMPLE_INTERVAL = 0.005
+"""采样间隔（秒）"""
+_TRACEMALLOC_FRAMES = 25
+"""tracemalloc每次分配记录的调用栈深度"""
+_TOP_COUNT = 50
+"""文本报告中列出的条数"""
+
+
+class ProfileTarget(NamedTuple):
+    """被分析的线程"""
+    name: str
+    """用在输出文件名中，如network、gui"""
+    thread_id: int
+    call_in_thread: Callable[[Callable[[], None]], None]
+    """在目标线程中调用一个函数，可以在任意线程调用，如loop.call_soon_threadsafe、wx.CallAfter"""
+
+
+_lock = threading.Lock()
+_running: Set[str] = set()
+"""正在进行的分析，cProfile和tracemalloc是进程级的，同时只能有一个，采样分析每个线程一个"""
+
+
+def parse_spec(spec: str) -> Tuple[str, float]:
+    """
+    解析“模式[:秒数]”，如sample:60
+
+    :raises ValueError: 格式不对
+    """
+    mode, _, seconds = spec.strip().partition(':')
+    mode = mode.strip().lower()
+    return mode, float(seconds) if seconds.strip() else DEFAULT_PROFILE_SECONDS
+
+
+def start_profiling(
+    mode: str, seconds: float, target: ProfileTarget, output_dir: str = DEFAULT_PROFILE_DIR
+) -> str:
+    """
+    开始分析，立即返回，到时间后在后台线程写结果
+
+    :param mode: 见PROFILE_MODES
+    :param seconds: 分析的时长
+    :param target: 被分析的线程，tracemalloc只用到它的名字
+    :param output_dir: 输出目录
+    :return: 输出文件的路径前缀，后缀见各个模式
+    :raises ValueError: 模式或时长不对，或者同样的分析正在进行
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f'unknown profile mode: {mode}, should be one of {", ".join(PROFILE_MODES)}')
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise ValueError(f'profile seconds should be in (0, {MAX_PROFILE_SECONDS:g}]')
+    key = f'sample:{target.name}' if mode == 'sample' else mode
+    with _lock:
+        if key in _running:
+            raise ValueError(f'{key} profiling is already running')
+        _running.add(key)
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        path_prefix = os.path.join(output_dir, f'profile-{time.strftime("%Y%m%d-%H%M%S")}-{target.name}-{mode}')
+        if mode == 'sample':
+            _start_thread(f'sample-{target.name}', key, lambda: _run_sampling(target, seconds, path_prefix))
+        elif mode == 'cprofile':
+            _start_cprofile(target, seconds, path_prefix, key)
+        else:
+            _start_tracemalloc(seconds, path_prefix, key)
+    except BaseException:
+        _finish(key)
+        raise
+    logger.info(f'开始性能分析: {mode}，线程 {target.name}，{seconds:g} 秒，结果写到 {path_prefix}.*')
+    return path_prefix
+
+
+def _finish(key: str):
+    with _lock:
+        _running.discard(key)
+
+
+def _start_thread(name: str, key: str, func: Callable[[], None], delay: float = 0.0):
+    """在后台线程中运行func，结束后才能开始下一次同样的分析"""
+    def thread_func():
+        try:
+            if delay > 0:
+                time.sleep(delay)
+            func()
+        except Exception:  # noqa
+            logger.exception(f'性能分析 {key} 失败:')
+        finally:
+            _finish(key)
+
+    # 退出时不等待分析结束
+    threading.Thread(target=thread_func, name=f'profiling-{name}', daemon=True).start()
+
+
+def _run_sampling(target: ProfileTarget, seconds: float, path_prefix: str):
+    # 调用栈（从外到内） -> 采样次数
+    stack_counts: Dict[Tuple[str, ...], int] = {}
+    # code对象 -> 折叠栈中的名字，每个函数只格式化一次
+    frame_names: Dict[object, str] = {}
+    sample_count = 0
+    thread_id = target.thread_id
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id, None)  # noqa
+        if frame is None:
+            # 线程已经退出
+            break
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            name = frame_names.get(code, None)
+            if name is None:
+                name = frame_names[code] = (
+                    f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ',')
+                )
+            stack.append(name)
+            frame = frame.f_back
+        stack.reverse()
+        stack = tuple(stack)
+        stack_counts[stack] = stack_counts.get(stack, 0) + 1
+        sample_count += 1
+        time.sleep(SAMPLE_INTERVAL)
+
+    with open(path_prefix + '.folded', 'w', encoding='utf-8') as f:
+        for stack, count in sorted(stack_counts.items(), key=lambda item: -item[1]):
+            f.write(f'{";".join(stack)} {count}\n')
+
+    self_counts: Dict[str, int] = {}
+    total_counts: Dict[str, int] = {}
+    for stack, count in stack_counts.items():
+        if stack:
+            self_counts[stack[-1]] = self_counts.get(stack[-1], 0) + count
+        # 递归调用只算一次
+        for name in set(stack):
+            total_counts[name] = total_counts.get(name, 0) + count
+    lines = [
+        f'线程 {target.name} 采样 {sample_count} 次，间隔 {SAMPLE_INTERVAL * 1000:g} ms',
+        '事件循环空闲时停在selector的select里，分析卡顿时看select以外的部分',
+        '',
+        '自身采样数最多的函数:',
+    ]
+    lines += _format_top_counts(self_counts, sample_count)
+    lines += ['', '包括调用的函数在内采样数最多的函数:']
+    lines += _format_top_counts(total_counts, sample_count)
+    _write_report(path_prefix + '.txt', lines)
+    logger.info(f'采样分析结果已写入 {path_prefix}.folded、.txt')
+
+
+def _format_top_counts(counts: Dict[str, int], sample_count: int):
+    return [
+        f'{count:8d} {count / max(sample_count, 1):6.1%}  {name}'
+        for name, count in sorted(counts.items(), key=lambda item: -item[1])[:_TOP_COUNT]
+    ]
+
+
+def _write_report(filename: str, lines):
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+        f.write('\n')
+
+
+def _start_cprofile(target: ProfileTarget, seconds: float, path_prefix: str, key: str):
+    # cProfile在调用enable的线程中生效，开始和结束都要在目标线程中调用
+    profiler = cProfile.Profile()
+    target.call_in_thread(profiler.enable)
+
+    def stop_in_target_thread():
+        profiler.disable()
+        # 统计排序和写文件不占用目标线程
+        _start_thread(f'cprofile-{target.name}-dump', key, lambda: _dump_cprofile(profiler, path_prefix))
+
+    def request_stop():
+        try:
+            target.call_in_thread(stop_in_target_thread)
+        except Exception:  # noqa
+            # 目标线程已经退出了
+            logger.exception('结束cProfile分析失败:')
+            _finish(key)
+
+    timer = threading.Timer(seconds, request_stop)
+    timer.daemon = True
+    timer.start()
+
+
+def _dump_cprofile(profiler: cProfile.Profile, path_prefix: str):
+    profiler.dump_stats(path_prefix + '.prof')
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs()
+    stream.write('按累计耗时排序:\n')
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_TOP_COUNT)
+    stream.write('按自身耗时排序:\n')
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(_TOP_COUNT)
+    with open(path_prefix + '.txt', 'w', encoding='utf-8') as f:
+        f.write(stream.getvalue())
+    logger.info(f'cProfile分析结果已写入 {path_prefix}.prof、.txt')
+
+
+def _start_tracemalloc(seconds: float, path_prefix: str, key: str):
+    # 已经用-X tracemalloc或者PYTHONTRACEMALLOC开启时不关闭
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(_TRACEMALLOC_FRAMES)
+    try:
+        first_snapshot = _take_tracemalloc_snapshot()
+    except BaseException:
+        if started:
+            tracemalloc.stop()
+        raise
+
+    def finish():
+        try:
+            last_snapshot = _take_tracemalloc_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+        last_snapshot.dump(path_prefix + '.tracemalloc')
+        lines = [f'{seconds:g} 秒内增长最多的分配位置:']
+        lines += [str(stat) for stat in last_snapshot.compare_to(first_snapshot, 'lineno')[:_TOP_COUNT]]
+        lines += ['', '结束时占用最多的分配位置:']
+        lines += [str(stat) for stat in last_snapshot.statistics('lineno')[:_TOP_COUNT]]
+        lines += ['', f'结束时跟踪的内存: {current / 1024 / 1024:.1f} MiB，峰值: {peak / 1024 / 1024:.1f} MiB']
+        _write_report(path_prefix + '.txt', lines)
+        logger.info(f'tracemalloc分析结果已写入 {path_prefix}.tracemalloc、.txt')
+
+    _start_thread('tracemalloc', key, finish, delay=seconds)
+
+
+def _take_tracemalloc_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
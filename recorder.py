@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import glob
+import gzip
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+SEGMENT_SUFFIX = '.rec.gz'
+"""录制文件的后缀"""
+DEFAULT_RECORDINGS_DIR = os.path.join('log', 'recordings')
+"""插件录制弹幕的目录"""
+
+# 文件格式：gzip压缩的 魔数 + 若干条记录，每条记录是 接收时间戳(float64) + 长度(uint32) + UTF-8编码的原始消息
+_MAGIC = b'NRREC\x001\n'
+_RECORD_HEADER = struct.Struct('<dI')
+
+_STOP = object()
+
+
+class FrameRecorder:
+    """
+    把收到的原始WebSocket消息追加写入压缩的录制文件
+
+    record在网络线程调用，只是把消息放进有界队列；压缩和写文件在单独的线程进行，不会阻塞事件循环。
+    队列满时丢弃新消息并计数，保证录制不会拖慢投票处理
+
+    :param directory: 录制文件目录
+    :param max_segment_bytes: 每个录制文件的最大未压缩字节数，超过后写入新文件
+    :param max_buffered_frames: 队列中最多缓存的消息数
+    :param flush_interval: 把缓冲写入文件的间隔（秒）
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        max_buffered_frames: int = 10000,
+        flush_interval: float = 1.0,
+    ):
+        self._directory = directory
+        self._max_segment_bytes = max_segment_bytes
+        self._flush_interval = flush_interval
+        self._queue: 'queue.Queue' = queue.Queue(max_buffered_frames)
+        self._thread = threading.Thread(target=self._writer_thread_func, name='FrameRecorder', daemon=True)
+        self._segment_index = 0
+
+        self.recorded_count = 0
+        """已写入的消息数"""
+        self.dropped_count = 0
+        """因为队列满而丢弃的消息数"""
+
+    def start(self):
+        os.makedirs(self._directory, exist_ok=True)
+        self._thread.start()
+        logger.info(f'开始录制弹幕到 {self._directory}')
+
+    def close(self, timeout: Optional[float] = None):
+        """停止录制，写完队列中剩余的消息"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        logger.info(f'停止录制弹幕，共写入 {self.recorded_count} 条，丢弃 {self.dropped_count} 条')
+
+    def record(self, data: str, recv_time: float):
+        """记录一条原始消息，在网络线程调用"""
+        try:
+            self._queue.put_nowait((recv_time, data))
+        except queue.Full:
+            self.dropped_count += 1
+
+    def _new_segment_path(self):
+        # 文件名按时间和序号排序就是录制顺序
+        now = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        while True:
+            self._segment_index += 1
+            path = os.path.join(self._directory, f'danmaku-{now}-{self._segment_index:04d}{SEGMENT_SUFFIX}')
+            if not os.path.exists(path):
+                return path
+
+    def _writer_thread_func(self):
+        file = None
+        segment_bytes = 0
+        next_flush_time = 0.0
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=self._flush_interval)
+                except queue.Empty:
+                    item = None
+
+                if item is _STOP:
+                    break
+                if item is not None:
+                    if file is None or segment_bytes >= self._max_segment_bytes:
+                        if file is not None:
+                            file.close()
+                        file = gzip.open(self._new_segment_path(), 'wb', compresslevel=6)
+                        file.write(_MAGIC)
+                        segment_bytes = 0
+
+                    recv_time, data = item
+                    body = data.encode('utf-8')
+                    file.write(_RECORD_HEADER.pack(recv_time, len(body)))
+                    file.write(body)
+                    segment_bytes += _RECORD_HEADER.size + len(body)
+                    self.recorded_count += 1
+
+                now = time.monotonic()
+                if file is not None and now >= next_flush_time:
+                    file.flush()
+                    next_flush_time = now + self._flush_interval
+        except Exception:  # noqa
+            logger.exception('录制弹幕失败:')
+        finally:
+            if file is not None:
+                file.close()
+
+
+def iter_segment(path: str) -> Iterator[Tuple[float, str]]:
+    """读取一个录制文件，返回(接收时间戳, 原始消息)。文件末尾不完整的记录会被忽略"""
+    with gzip.open(path, 'rb') as file:
+        try:
+            if file.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f'Not a recording file: {path}')
+            while True:
+                header = file.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                recv_time, length = _RECORD_HEADER.unpack(header)
+                body = file.read(length)
+                if len(body) < length:
+                    break
+                yield recv_time, body.decode('utf-8')
+        except EOFError:
+            # 程序异常退出时文件可能没有正常结束
+            pass
+
+
+def iter_recordings(paths: Iterable[str]) -> Iterator[Tuple[float, str]]:
+    """按顺序读取多个录制文件或目录"""
+    for path in paths:
+        if os.path.isdir(path):
+            segment_paths = sorted(glob.glob(os.path.join(path, '*' + SEGMENT_SUFFIX)))
+        else:
+            segment_paths = [path]
+        for segment_path in segment_paths:
+            yield from iter_segment(segment_path)
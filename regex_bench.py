@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+用真实弹幕测试一组正则表达式：各等级的匹配率、被优先级决定结果的重叠、每条弹幕的匹配耗时
+
+弹幕样本优先使用录制的弹幕（见recorder.py），没有录制时使用插件自带的sample_danmaku.txt
+"""
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import blcsdk.models as sdk_models
+import recorder
+from vote_matcher import MatcherOptions, VoteMatcher
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+SAMPLE_CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'sample_danmaku.txt')
+"""插件自带的弹幕样本，每行一条弹幕"""
+
+MAX_CORPUS_SIZE = 20000
+"""最多使用这么多条弹幕"""
+MIN_SAMPLE_COUNT = 10000
+"""弹幕样本太少时重复测试，至少测量这么多次匹配耗时"""
+
+
+class PatternBenchResult(NamedTuple):
+    corpus_name: str
+    message_count: int
+    mode: str
+    """VoteMatcher的匹配方式"""
+    level_counts: Dict[int, int]
+    """等级 -> 按优先级计入这个等级的弹幕数"""
+    overlaps: Dict[Tuple[int, int], int]
+    """(优先的等级, 被覆盖的等级) -> 两个正则表达式都匹配、按优先级计入前者的弹幕数"""
+    mean_cost: float
+    """每条弹幕的平均匹配耗时（秒）"""
+    p99_cost: float
+    max_cost: float
+
+
+def load_corpus(
+    recordings_dir: str = recorder.DEFAULT_RECORDINGS_DIR, max_size: int = MAX_CORPUS_SIZE
+) -> Tuple[str, List[str]]:
+    """
+    读取弹幕样本
+
+    :return: (样本名称, 弹幕内容列表)
+    """
+    contents = []
+    if os.path.isdir(recordings_dir):
+        try:
+            for _recv_time, frame in recorder.iter_recordings([recordings_dir]):
+                command = json.loads(frame)
+                if command['cmd'] != sdk_models.Command.ADD_TEXT:
+                    continue
+                contents.append(command['data'][4])
+                if len(contents) >= max_size:
+                    break
+        except (OSError, ValueError, KeyError, IndexError):
+            logger.exception('读取录制的弹幕失败:')
+        if contents:
+            return f'录制的弹幕（{recordings_dir}）', contents
+
+    with open(SAMPLE_CORPUS_PATH, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                contents.append(line)
+            if len(contents) >= max_size:
+                break
+    return '自带的弹幕样本', contents
+
+
+def bench_patterns(
+    patterns: Dict[int, str],
+    contents: List[str],
+    corpus_name: str = '',
+    options: Optional[MatcherOptions] = None,
+) -> PatternBenchResult:
+    """
+    :param patterns: 等级 -> 正则表达式，按优先级从高到低排列，应该已经检查过灾难性回溯的风险
+                     （见vote_matcher.find_unsafe_patterns）
+    :param contents: 弹幕内容
+    :param corpus_name: 样本名称
+    :param options: 匹配选项，和统计时使用的一样
+    """
+    # 都用统计时实际使用的VoteMatcher匹配，有风险的正则表达式和统计时一样交给线性时间引擎。
+    # 重复测试时缓存都会命中，所以不用缓存，测的是不用缓存的耗时
+    if options is not None:
+        options = options._replace(match_cache_size=0)
+    matcher = VoteMatcher(patterns, options)
+
+    level_counts = {level: 0 for level in patterns}
+    overlaps: Dict[Tuple[int, int], int] = {}
+    for content in contents:
+        matched_levels = matcher.match_levels(content)
+        if not matched_levels:
+            continue
+        winner = matched_levels[0]
+        level_counts[winner] += 1
+        for level in matched_levels[1:]:
+            overlaps[(winner, level)] = overlaps.get((winner, level), 0) + 1
+
+    # 耗时包括规范化和strip
+    match = matcher.match
+    perf_counter = time.perf_counter
+    costs = []
+    if contents:
+        for _ in range(math.ceil(MIN_SAMPLE_COUNT / len(contents))):
+            for content in contents:
+                start_time = perf_counter()
+                match(content)
+                costs.append(perf_counter() - start_time)
+    costs.sort()
+
+    return PatternBenchResult(
+        corpus_name=corpus_name,
+        message_count=len(contents),
+        mode=matcher.mode,
+        level_counts=level_counts,
+        overlaps=overlaps,
+        mean_cost=sum(costs) / len(costs) if costs else 0.0,
+        p99_cost=costs[min(int(len(costs) * 0.99), len(costs) - 1)] if costs else 0.0,
+        max_cost=costs[-1] if costs else 0.0,
+    )
+
+
+def format_result(result: PatternBenchResult) -> str:
+    """生成给人看的测试报告"""
+    message_count = max(result.message_count, 1)
+    lines = [f'样本: {result.corpus_name}，{result.message_count} 条弹幕', '']
+    total_votes = 0
+    for level, count in result.level_counts.items():
+        total_votes += count
+        lines.append(f'等级 {level}: {count} 条，{count / message_count:.1%}')
+    lines.append(f'不是投票: {result.message_count - total_votes} 条，'
+                 f'{(result.message_count - total_votes) / message_count:.1%}')
+
+    lines.append('')
+    if result.overlaps:
+        lines.append('重叠（多个等级都匹配，按优先级计入前者）:')
+        for (winner, level), count in sorted(result.overlaps.items()):
+            lines.append(f'等级 {winner} 覆盖等级 {level}: {count} 条')
+    else:
+        lines.append('各等级之间没有重叠')
+
+    lines.append('')
+    lines.append(f'匹配方式: {result.mode}')
+    lines.append(f'每条弹幕匹配耗时: 平均 {result.mean_cost * 1e6:.2f} us，p99 {result.p99_cost * 1e6:.2f} us，'
+                 f'最大 {result.max_cost * 1e6:.1f} us')
+    if result.mean_cost > 0:
+        lines.append(f'估计吞吐量: {1 / result.mean_cost:,.0f} 弹幕/秒')
+    return '\n'.join(lines)
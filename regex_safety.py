@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查正则表达式有没有灾难性回溯的风险
+
+Python的re是回溯引擎，像(a+)+$这样的正则表达式匹配长弹幕时耗时是指数级的，而匹配在网络线程中同步进行，
+会卡住接收消息。这里分析re解析后的语法树，找出两种常见的写法：
+
+- 嵌套的无上限量词，如(a+)+、(\\w+\\s?)*
+- 无上限量词里的分支可以匹配相同的开头，如(a|a)*、(a|aa)*
+
+分析是保守的近似，可能误报，不保证找出所有会超线性回溯的写法。占有量词（a++）和原子分组（(?>...)）不会回溯，不算风险
+"""
+import re
+from typing import FrozenSet, List, Optional, Tuple
+
+try:
+    # Python 3.11+
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+_REPEAT_OPS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+# Python 3.11以前没有
+_POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+
+_UNBOUNDED_REPEAT = 16
+"""上限不小于这个值的量词当作无上限，如a{1,100}"""
+
+_BASE_PROBE_CHARS = frozenset(
+    [chr(i) for i in range(0x20, 0x7f)] + list('\t\n　０１２３４５６７８９ｗあア中草')
+)
+"""判断两个字符集有没有交集时用到的字符，再加上正则表达式中出现的字面值"""
+
+_CATEGORY_PATTERNS = {
+    sre_constants.CATEGORY_DIGIT: re.compile(r'\d'),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile(r'\D'),
+    sre_constants.CATEGORY_SPACE: re.compile(r'\s'),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile(r'\S'),
+    sre_constants.CATEGORY_WORD: re.compile(r'\w'),
+    sre_constants.CATEGORY_NOT_WORD: re.compile(r'\W'),
+}
+
+NESTED_QUANTIFIER = '嵌套的无上限量词，如(a+)+'
+AMBIGUOUS_BRANCH = '量词里的分支可以匹配相同的开头，如(a|a)*'
+
+
+def find_backtracking_risks(pattern: str) -> List[str]:
+    """
+    分析正则表达式有没有灾难性回溯的风险
+
+    :return: 风险的说明，没有风险时返回空列表
+    :raises re.error: 正则表达式有语法错误
+    """
+    parsed = sre_parse.parse(pattern)
+    analyzer = _Analyzer(_BASE_PROBE_CHARS | _collect_literals(parsed))
+    analyzer.walk(parsed, None)
+    return analyzer.risks
+
+
+def _collect_literals(parsed) -> FrozenSet[str]:
+    literals = set()
+    stack = [parsed]
+    while stack:
+        for op, av in stack.pop():
+            if op is sre_constants.LITERAL or op is sre_constants.NOT_LITERAL:
+                literals.add(chr(av))
+            else:
+                stack.extend(_iter_subpatterns(op, av))
+    return frozenset(literals)
+
+
+def _iter_subpatterns(op, av):
+    """取一个节点的所有子模式"""
+    if op in _REPEAT_OPS or op is _POSSESSIVE_REPEAT:
+        yield av[2]
+    elif op is sre_constants.SUBPATTERN:
+        yield av[-1]
+    elif op is _ATOMIC_GROUP:
+        yield av
+    elif op is sre_constants.BRANCH:
+        yield from av[1]
+    elif op is sre_constants.ASSERT or op is sre_constants.ASSERT_NOT:
+        yield av[1]
+    elif op is sre_constants.GROUPREF_EXISTS:
+        yield from (sub for sub in av[1:] if sub is not None)
+
+
+def _get_min_width(item) -> int:
+    op, av = item
+    if op is sre_constants.AT or op is sre_constants.ASSERT or op is sre_constants.ASSERT_NOT:
+        return 0
+    if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+        return 1
+    if op in _REPEAT_OPS or op is _POSSESSIVE_REPEAT:
+        return av[0] * av[2].getwidth()[0]
+    if op is sre_constants.SUBPATTERN:
+        return av[-1].getwidth()[0]
+    if op is _ATOMIC_GROUP:
+        return av.getwidth()[0]
+    if op is sre_constants.BRANCH:
+        return min(sub.getwidth()[0] for sub in av[1])
+    return 0
+
+
+class _Analyzer:
+    def __init__(self, probe_chars: FrozenSet[str]):
+        self._probe_chars = probe_chars
+        self.risks: List[str] = []
+
+    def _add_risk(self, risk: str):
+        if risk not in self.risks:
+            self.risks.append(risk)
+
+    def walk(self, parsed, repeat_first: Optional[FrozenSet[str]], separators: Tuple[FrozenSet[str], ...] = ()):
+        """
+        :param repeat_first: 在无上限量词里面时，是量词的内容可以匹配的第一个字符，否则为None
+        :param separators: 在无上限量词里面时，量词的内容中和当前位置同时必须匹配的字符集
+        """
+        items = list(parsed)
+        for index, (op, av) in enumerate(items):
+            if repeat_first is not None:
+                # 同一序列中其他必须匹配的部分也是当前位置的分隔符
+                child_separators = separators + tuple(
+                    self.all_chars([item]) for i, item in enumerate(items)
+                    if i != index and _get_min_width(item) > 0
+                )
+            else:
+                child_separators = ()
+
+            if op in _REPEAT_OPS:
+                _lo, hi, sub = av
+                if hi >= _UNBOUNDED_REPEAT and sub.getwidth()[1] > 0:
+                    # 有内层量词不能匹配的分隔符时，每次重复的边界是确定的，如(\d+\.)+
+                    if repeat_first is not None:
+                        inner_chars = self.all_chars(sub)
+                        if not any(separator and not (separator & inner_chars) for separator in child_separators):
+                            self._add_risk(NESTED_QUANTIFIER)
+                    self.walk(sub, self.first_chars(sub)[0])
+                else:
+                    self.walk(sub, repeat_first, child_separators)
+            elif op is sre_constants.BRANCH:
+                if repeat_first is not None and self._is_ambiguous_branch(av[1], repeat_first):
+                    self._add_risk(AMBIGUOUS_BRANCH)
+                for sub in av[1]:
+                    self.walk(sub, repeat_first, child_separators)
+            elif op is _POSSESSIVE_REPEAT or op is _ATOMIC_GROUP:
+                # 匹配后不会再回溯到里面，但里面的内容自己也可能回溯
+                for sub in _iter_subpatterns(op, av):
+                    self.walk(sub, None)
+            elif op is sre_constants.ASSERT or op is sre_constants.ASSERT_NOT:
+                self.walk(av[1], None)
+            else:
+                for sub in _iter_subpatterns(op, av):
+                    self.walk(sub, repeat_first, child_separators)
+
+    def _is_ambiguous_branch(self, alternatives, repeat_first: FrozenSet[str]) -> bool:
+        """分支在无上限量词里面时，同一段文本有多种匹配方式就会成倍增加回溯"""
+        firsts = [self.first_chars(sub) for sub in alternatives]
+        nullable_count = sum(1 for _chars, nullable in firsts if nullable)
+        if nullable_count >= 2:
+            return True
+        seen = set()
+        for chars, _nullable in firsts:
+            if seen & chars:
+                return True
+            seen |= chars
+        # 有可以匹配空串的分支时，其他分支和下一次重复可以匹配同样的开头，如(a(|a))*
+        return nullable_count == 1 and bool(seen & repeat_first)
+
+    def first_chars(self, parsed) -> Tuple[FrozenSet[str], bool]:
+        """
+        :return: (可以匹配的第一个字符, 是否可以匹配空串)
+        """
+        chars = frozenset()
+        for op, av in parsed:
+            char_set = self._char_set(op, av)
+            if char_set is not None:
+                return chars | char_set, False
+
+            if op is sre_constants.AT or op is sre_constants.ASSERT or op is sre_constants.ASSERT_NOT:
+                # 不占宽度
+                continue
+            if op in _REPEAT_OPS or op is _POSSESSIVE_REPEAT:
+                sub_chars, sub_nullable = self.first_chars(av[2])
+                chars |= sub_chars
+                if av[0] > 0 and not sub_nullable:
+                    return chars, False
+            elif op is sre_constants.SUBPATTERN or op is _ATOMIC_GROUP:
+                sub_chars, sub_nullable = self.first_chars(av[-1] if op is sre_constants.SUBPATTERN else av)
+                chars |= sub_chars
+                if not sub_nullable:
+                    return chars, False
+            elif op is sre_constants.BRANCH or op is sre_constants.GROUPREF_EXISTS:
+                subs = av[1] if op is sre_constants.BRANCH else [sub for sub in av[1:] if sub is not None]
+                nullable = op is sre_constants.GROUPREF_EXISTS and av[2] is None
+                for sub in subs:
+                    sub_chars, sub_nullable = self.first_chars(sub)
+                    chars |= sub_chars
+                    nullable = nullable or sub_nullable
+                if not nullable:
+                    return chars, False
+            else:
+                # 反向引用等，不知道会匹配什么
+                chars |= self._probe_chars
+        return chars, True
+
+    def all_chars(self, parsed) -> FrozenSet[str]:
+        """可以匹配的所有字符"""
+        chars = set()
+        stack = [parsed]
+        while stack:
+            for op, av in stack.pop():
+                char_set = self._char_set(op, av)
+                if char_set is not None:
+                    chars |= char_set
+                elif op is sre_constants.GROUPREF:
+                    chars |= self._probe_chars
+                else:
+                    stack.extend(_iter_subpatterns(op, av))
+        return frozenset(chars)
+
+    def _char_set(self, op, av) -> Optional[FrozenSet[str]]:
+        """匹配一个字符的节点可以匹配的字符，不是这种节点时返回None"""
+        if op is sre_constants.LITERAL:
+            return frozenset((chr(av),))
+        if op is sre_constants.NOT_LITERAL:
+            return self._probe_chars - {chr(av)}
+        if op is sre_constants.ANY:
+            return self._probe_chars - {'\n'}
+        if op is not sre_constants.IN:
+            return None
+
+        negate = False
+        chars = set()
+        for item_op, item_av in av:
+            if item_op is sre_constants.NEGATE:
+                negate = True
+            elif item_op is sre_constants.LITERAL:
+                chars.add(chr(item_av))
+            elif item_op is sre_constants.RANGE:
+                lo, hi = item_av
+                chars.update(char for char in self._probe_chars if lo <= ord(char) <= hi)
+            elif item_op is sre_constants.CATEGORY and item_av in _CATEGORY_PATTERNS:
+                category_pattern = _CATEGORY_PATTERNS[item_av]
+                chars.update(char for char in self._probe_chars if category_pattern.match(char))
+            else:
+                chars.update(self._probe_chars)
+        if negate:
+            return self._probe_chars - chars
+        return frozenset(chars)
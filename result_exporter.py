@@ -1,12 +1,19 @@
+import hashlib
+import json
 import os
+import re
+import time
 
-def export_result_html(title, vote_counts, total_count, default_level, labels, filename=None, mode="niconico", include_repo=False):
-    if filename is None:
-        result_dir = os.path.abspath("result")
-        if not os.path.exists(result_dir):
-            os.makedirs(result_dir)
-        filename = os.path.join(result_dir, "result.html")
+import metrics
+
+def compute_result(
+    title, vote_counts, total_count, default_level, labels, mode="niconico", include_repo=False, timeline_points=None
+):
+    """
+    计算结果页面上显示的数据
 
+    :param timeline_points: VoteTimeline.get_cumulative_points的返回值，显示在总票数下方，None表示不显示
+    """
     sum_raw_votes = sum(vote_counts)
     if mode == "niconico":
         nico_counts = vote_counts.copy()
@@ -16,38 +23,108 @@ def export_result_html(title, vote_counts, total_count, default_level, labels, f
         counts = vote_counts
     sum_votes = sum(counts)
 
-    html = f"""
+    percents = [(counts[i] / max(sum_votes, 1) * 100) if sum_votes else 0 for i in range(5)]
+    return {
+        "title": title,
+        "labels": list(labels),
+        "counts": counts,
+        "percents": percents,
+        "sum_votes": sum_votes,
+        "sum_raw_votes": sum_raw_votes,
+        "include_repo": include_repo,
+        "timeline_svg": render_timeline_svg(timeline_points) if timeline_points else "",
+    }
+
+
+# 各等级曲线的颜色，和卡片的序号颜色区分开
+TIMELINE_COLORS = ("#E53935", "#FB8C00", "#FDD835", "#43A047", "#1E88E5")
+_TIMELINE_WIDTH = 600
+_TIMELINE_HEIGHT = 120
+_TIMELINE_PADDING = 4
+
+
+def render_timeline_svg(points):
+    """
+    把各等级的累计票数曲线画成内联SVG，是实际投票的票数，不包括niconico风格补到默认等级的人数
+
+    :param points: VoteTimeline.get_cumulative_points的返回值
+    """
+    last_second = max(points[-1][0], 1)
+    max_count = max(max(points[-1][1]), 1)
+    plot_width = _TIMELINE_WIDTH - _TIMELINE_PADDING * 2
+    plot_height = _TIMELINE_HEIGHT - _TIMELINE_PADDING * 2
+    xs = [f"{_TIMELINE_PADDING + second / last_second * plot_width:.1f}" for second, _ in points]
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_TIMELINE_WIDTH}" height="{_TIMELINE_HEIGHT + 20}"'
+        f' viewBox="0 0 {_TIMELINE_WIDTH} {_TIMELINE_HEIGHT + 20}">',
+        f'<rect x="0" y="0" width="{_TIMELINE_WIDTH}" height="{_TIMELINE_HEIGHT}" rx="8" fill="#ffffff" fill-opacity="0.8"/>',
+    ]
+    for level_index, color in enumerate(TIMELINE_COLORS):
+        coords = " ".join(
+            f"{x},{_TIMELINE_PADDING + plot_height - counts[level_index] / max_count * plot_height:.1f}"
+            for x, (_, counts) in zip(xs, points)
+        )
+        parts.append(f'<polyline points="{coords}" fill="none" stroke="{color}" stroke-width="2"/>')
+        legend_x = _TIMELINE_WIDTH // 2 - 120 + level_index * 50
+        parts.append(f'<rect x="{legend_x}" y="{_TIMELINE_HEIGHT + 8}" width="10" height="10" fill="{color}"/>')
+        parts.append(
+            f'<text x="{legend_x + 14}" y="{_TIMELINE_HEIGHT + 17}" font-size="12" fill="#222">{level_index + 1}</text>'
+        )
+    parts.append(
+        f'<text x="{_TIMELINE_WIDTH - _TIMELINE_PADDING - 2}" y="{_TIMELINE_HEIGHT + 17}" font-size="12" fill="#888"'
+        f' text-anchor="end">{points[-1][0]}s</text>'
+    )
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+_PLACEHOLDER_PATTERN = re.compile(r"\$\{(\w+)\}")
+
+
+def _compile_template(source):
+    """把模板切分成 [静态文本, 变量名, 静态文本, 变量名, ..., 静态文本]，渲染时只需要填入变量再拼接"""
+    return tuple(_PLACEHOLDER_PATTERN.split(source))
+
+
+def _render_template(compiled_template, values):
+    parts = list(compiled_template)
+    parts[1::2] = [values[name] for name in compiled_template[1::2]]
+    return "".join(parts)
+
+
+# 结果页面模板，静态的CSS和HTML骨架只在导入时编译一次，每次导出只渲染标题、标签、百分比和总票数
+_PAGE_TEMPLATE = _compile_template("""
     <html>
     <head>
         <meta charset="utf-8">
-        <title>{title}</title>
+        <title>${title}</title>
         <style>
-            body {{
+            body {
                 background: #f7f7f7;
                 font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif;
                 margin: 0;
                 padding: 0;
-            }}
-            .container {{
+            }
+            .container {
                 max-width: 1000px;
                 margin: 40px auto;
                 padding: 20px;
                 text-align: center;
-            }}
-            .title {{
+            }
+            .title {
                 font-size: 1.8em;
                 margin-bottom: 30px;
                 font-weight: bold;
                 color: #000000;
                 text-shadow: 0px 0px 4px #ffffff;
-            }}
-            .cards {{
+            }
+            .cards {
                 display: flex;
                 flex-wrap: wrap;
                 justify-content: center;
                 gap: 40px 40px;
-            }}
-            .card {{
+            }
+            .card {
                 position: relative;
                 width: 200px;
                 height: 120px;
@@ -59,8 +136,8 @@ def export_result_html(title, vote_counts, total_count, default_level, labels, f
                 align-items: center;
                 justify-content: center;
                 box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-            }}
-            .card-index {{
+            }
+            .card-index {
                 position: absolute;
                 top: -10px;
                 left: -10px;
@@ -75,8 +152,8 @@ def export_result_html(title, vote_counts, total_count, default_level, labels, f
                 align-items: center;
                 justify-content: center;
                 box-shadow: 0 1px 4px rgba(0,0,0,0.2);
-            }}
-            .percent-badge {{
+            }
+            .percent-badge {
                 position: absolute;
                 bottom: -20px;
                 left: 50%;
@@ -87,60 +164,179 @@ def export_result_html(title, vote_counts, total_count, default_level, labels, f
                 color: #FFD700;
                 font-size: 20px;
                 font-weight: bold;
-            }}
-            .label {{
+            }
+            .label {
                 font-size: 20px;
                 color: #222;
                 font-weight: bold;
-            }}
-            .total {{
+            }
+            .total {
                 margin-top: 40px;
                 font-size: 1.1em;
                 font-weight: bold;
                 text-shadow: 0px 0px 1px #ffffff;
-            }}
-            .repo {{
+            }
+            .timeline {
+                margin-top: 20px;
+            }
+            .repo {
                 font-size: 0.85em;
                 color: #888;
                 margin-top: 10px;
                 text-shadow: 0px 0px 1px #ffffff;
-            }}
-            .repo a {{
+            }
+            .repo a {
                 color: #888;
                 text-decoration: none;
                 text-shadow: 0px 0px 1px #ffffff;
-            }}
+            }
         </style>
     </head>
     <body>
         <div class="container">
-            <div class="title">{title}</div>
+            <div class="title" id="title">${title}</div>
             <div class="cards">
-    """
-    for i in range(5):
-        percent = (counts[i] / max(sum_votes, 1) * 100) if sum_votes else 0
-        html += f"""
                 <div class="card">
-                    <div class="card-index">{i + 1}</div>
-                    <div class="label">{labels[i]}</div>
-                    <div class="percent-badge">{percent:.1f}%</div>
+                    <div class="card-index">1</div>
+                    <div class="label" id="label-1">${label_1}</div>
+                    <div class="percent-badge" id="percent-1">${percent_1}</div>
+                </div>
+                <div class="card">
+                    <div class="card-index">2</div>
+                    <div class="label" id="label-2">${label_2}</div>
+                    <div class="percent-badge" id="percent-2">${percent_2}</div>
+                </div>
+                <div class="card">
+                    <div class="card-index">3</div>
+                    <div class="label" id="label-3">${label_3}</div>
+                    <div class="percent-badge" id="percent-3">${percent_3}</div>
+                </div>
+                <div class="card">
+                    <div class="card-index">4</div>
+                    <div class="label" id="label-4">${label_4}</div>
+                    <div class="percent-badge" id="percent-4">${percent_4}</div>
+                </div>
+                <div class="card">
+                    <div class="card-index">5</div>
+                    <div class="label" id="label-5">${label_5}</div>
+                    <div class="percent-badge" id="percent-5">${percent_5}</div>
                 </div>
-        """
-    html += f"""
             </div>
-            <div class="total">总票数: {sum_votes} <br>实际投票票数: {sum_raw_votes}</div>
-    """
-    if include_repo:
-        html += """
-            <div class="repo">
+            <div class="total">总票数: <span id="sum-votes">${sum_votes}</span> <br>实际投票票数: <span id="sum-raw-votes">${sum_raw_votes}</span></div>
+            <div class="timeline" id="timeline">${timeline_svg}</div>
+            <div class="repo" id="repo"${repo_style}>
                 项目地址： <a href="https://github.com/KingRayCao/blivechat-niconico-rating" target="_blank">https://github.com/KingRayCao/blivechat-niconico-rating</a>
             </div>
-        """
-    html += """
         </div>
+    ${live_script}
     </body>
     </html>
+    """)
+
+
+def render_result_html(result, events_url=None):
+    """
+    生成结果页面
+
+    :param result: compute_result的返回值
+    :param events_url: 实时推送结果的Server-Sent Events地址，页面会订阅它并实时更新，None表示静态页面
+    """
+    values = {
+        "title": result["title"],
+        "sum_votes": str(result["sum_votes"]),
+        "sum_raw_votes": str(result["sum_raw_votes"]),
+        "timeline_svg": result["timeline_svg"],
+        "repo_style": "" if result["include_repo"] else ' style="display: none"',
+        "live_script": "" if events_url is None else _LIVE_SCRIPT_TEMPLATE.replace("__EVENTS_URL__", json.dumps(events_url)),
+    }
+    for i in range(5):
+        values[f"label_{i + 1}"] = result["labels"][i]
+        values[f"percent_{i + 1}"] = f"{result['percents'][i]:.1f}%"
+    return _render_template(_PAGE_TEMPLATE, values)
+
+
+# 文件名 -> 最后一次写入的内容的哈希
+_published_digests = {}
+
+
+def publish_file(filename, content):
+    """
+    原子地写入文件：先写临时文件再重命名，OBS不会读到写了一半的文件。内容和上次写入的相同时跳过
+
+    :return: 是否写入了文件
     """
+    digest = hashlib.sha1(content.encode("utf-8")).digest()
+    if _published_digests.get(filename) == digest and os.path.exists(filename):
+        return False
+
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        f.write(content)
+    # Windows上目标文件正在被读取时重命名可能失败，稍等重试
+    for retry in range(5):
+        try:
+            os.replace(tmp_filename, filename)
+            break
+        except PermissionError:
+            if retry == 4:
+                os.remove(tmp_filename)
+                raise
+            time.sleep(0.05)
+    _published_digests[filename] = digest
+    return True
+
+
+def export_result_html(
+    title, vote_counts, total_count, default_level, labels, filename=None, mode="niconico", include_repo=False,
+    timeline_points=None
+):
+    if filename is None:
+        result_dir = os.path.abspath("result")
+        if not os.path.exists(result_dir):
+            os.makedirs(result_dir)
+        filename = os.path.join(result_dir, "result.html")
+
+    start_time = time.perf_counter()
+    result = compute_result(
+        title, vote_counts, total_count, default_level, labels, mode=mode, include_repo=include_repo,
+        timeline_points=timeline_points
+    )
+    publish_file(filename, render_result_html(result))
+    metrics.RESULT_EXPORT_SECONDS.observe(time.perf_counter() - start_time)
+    return result
+
+
+def export_timeline(timeline, result_dir):
+    """
+    导出合并视图的投票时间线：timeline.csv每秒一行，timeline.json是同样的数据
+
+    :param timeline: VoteTimeline，None时不导出
+    """
+    if timeline is None:
+        return
+    if not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+    publish_file(os.path.join(result_dir, "timeline.csv"), timeline.to_csv())
+    publish_file(os.path.join(result_dir, "timeline.json"), json.dumps(timeline.to_dict()))
+
 
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(html)
\ No newline at end of file
+_LIVE_SCRIPT_TEMPLATE = """
+        <script>
+            (function () {
+                var source = new EventSource(__EVENTS_URL__);
+                source.onmessage = function (event) {
+                    var result = JSON.parse(event.data);
+                    document.title = result.title;
+                    document.getElementById("title").textContent = result.title;
+                    for (var i = 0; i < 5; i++) {
+                        document.getElementById("label-" + (i + 1)).textContent = result.labels[i];
+                        document.getElementById("percent-" + (i + 1)).textContent = result.percents[i].toFixed(1) + "%";
+                    }
+                    document.getElementById("sum-votes").textContent = result.sum_votes;
+                    document.getElementById("sum-raw-votes").textContent = result.sum_raw_votes;
+                    document.getElementById("timeline").innerHTML = result.timeline_svg;
+                    document.getElementById("repo").style.display = result.include_repo ? "" : "none";
+                };
+            })();
+        </script>
+"""
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+from typing import Callable, Dict, Optional, TYPE_CHECKING
+
+import result_exporter
+
+if TYPE_CHECKING:
+    # aiohttp.web导入比较慢，启动服务时才导入，不拖慢连接blivechat
+    from aiohttp import web
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+DEFAULT_CONFIG = {'enabled': True, 'port': 12451, 'fps': 10}
+"""配置文件中result_server项的默认值"""
+
+_KEEP_ALIVE_INTERVAL = 15
+"""没有更新时发送注释保持连接的间隔（秒）"""
+
+_latest_results: Dict[Optional[str], dict] = {}
+"""房间标识 -> 最新的结果（compute_result的返回值），None表示合并所有房间的结果"""
+_latest_versions: Dict[Optional[str], int] = {}
+"""房间标识 -> 版本，每次发布新结果加1"""
+_on_published: Optional[Callable[[], None]] = None
+"""发布新结果后调用，唤醒正在运行的ResultServer的推送，可以在任意线程调用"""
+
+
+def publish(result: dict, room: Optional[str] = None):
+    """
+    发布新的结果，可以在任意线程调用
+
+    只是替换引用并唤醒网络线程，推送由ResultServer按帧率节流，结果没变时什么都不做
+
+    :param result: compute_result的返回值
+    :param room: 房间标识，见vote_session.room_slug，None表示合并所有房间的结果
+    """
+    if result == _latest_results.get(room, None):
+        return
+    _latest_results[room] = result
+    _latest_versions[room] = _latest_versions.get(room, 0) + 1
+    on_published = _on_published
+    if on_published is not None:
+        try:
+            on_published()
+        except RuntimeError:
+            # 事件循环已经关闭
+            pass
+
+
+def unpublish(room: str):
+    """房间删除后不再提供它的结果"""
+    _latest_results.pop(room, None)
+
+
+class ResultServer:
+    """
+    在本地提供结果页面，并用Server-Sent Events实时推送结果，OBS浏览器源不需要手动刷新
+
+    运行在NetworkWorker的事件循环中。没有新结果时推送的协程只等待事件，不会定时唤醒（保持连接的注释除外）
+
+    :param host: 监听地址
+    :param port: 监听端口
+    :param fps: 每秒最多推送的次数
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 12451, fps: float = 10):
+        self._host = host
+        self._port = port
+        self._push_interval = 1 / max(fps, 0.1)
+        self._runner: Optional['web.AppRunner'] = None
+        self._published_event: Optional[asyncio.Event] = None
+        """发布新结果时设置，然后换成新的事件，所以每个推送的协程都能被唤醒"""
+
+    @property
+    def url(self):
+        return f'http://{self._host}:{self._port}/'
+
+    async def start(self):
+        global _on_published
+        from aiohttp import web
+        self._published_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        _on_published = lambda: loop.call_soon_threadsafe(self._wake_up_clients)  # noqa
+        app = web.Application()
+        app.router.add_get('/', self._handle_page)
+        app.router.add_get('/events', self._handle_events)
+        app.router.add_get('/rooms/{room}', self._handle_page)
+        app.router.add_get('/rooms/{room}/events', self._handle_events)
+        self._runner = web.AppRunner(app, handle_signals=False)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        logger.info(f'结果页面服务已启动: {self.url}')
+
+    async def stop(self):
+        global _on_published
+        _on_published = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _wake_up_clients(self):
+        self._published_event.set()
+        self._published_event = asyncio.Event()
+
+    @staticmethod
+    async def _handle_page(request: 'web.Request'):
+        from aiohttp import web
+        room = request.match_info.get('room', None)
+        result = _latest_results.get(room, None)
+        if result is None:
+            if room is not None:
+                raise web.HTTPNotFound()
+            result = result_exporter.compute_result('', [0] * 5, 0, 1, [''] * 5, mode='traditional')
+        events_url = '/events' if room is None else f'/rooms/{room}/events'
+        html = result_exporter.render_result_html(result, events_url=events_url)
+        return web.Response(text=html, content_type='text/html', headers={'Cache-Control': 'no-cache'})
+
+    async def _handle_events(self, request: 'web.Request'):
+        from aiohttp import web
+        room = request.match_info.get('room', None)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        })
+        await response.prepare(request)
+
+        sent_version = -1
+        try:
+            while True:
+                # 先取事件再读版本，读完之后发布的结果一定会唤醒下面的等待
+                published_event = self._published_event
+                version = _latest_versions.get(room, 0)
+                result = _latest_results.get(room, None)
+                if version != sent_version and result is not None:
+                    sent_version = version
+                    data = json.dumps(result, ensure_ascii=False)
+                    await response.write(f'data: {data}\n\n'.encode('utf-8'))
+                    # 按帧率节流，两次推送之间的更新会合并
+                    await asyncio.sleep(self._push_interval)
+                    continue
+
+                try:
+                    await asyncio.wait_for(published_event.wait(), _KEEP_ALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    await response.write(b': keep-alive\n\n')
+        except ConnectionResetError:
+            pass
+        return response
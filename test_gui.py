@@ -11,20 +11,26 @@ import os
 # 添加当前目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from vote_engine import VoteEngine
+
 # 模拟必要的模块
 class MockListener:
+    vote_engine = VoteEngine()
+    DEFAULT_DEADLINE_CONFIG = {'timestamp_cutoff': False, 'late_grace_seconds': 3.0}
+
     @staticmethod
-    def set_vote_frame(frame):
-        pass
-    
-    @staticmethod
-    def update_vote_patterns():
+    def set_open_admin_ui_handler(handler):
         pass
 
 class MockResultExporter:
+    @staticmethod
+    def compute_result(*args, **kwargs):
+        return {}
+
     @staticmethod
     def export_result_html(*args, **kwargs):
         print("模拟导出结果")
+        return {}
 
 # 替换导入
 sys.modules['listener'] = MockListener()
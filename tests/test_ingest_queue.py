@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+import blcsdk.handlers as sdk_handlers
+import blcsdk.models as sdk_models
+from blcsdk.client import BlcPluginClient, OverflowPolicy, _IngestQueue
+
+QUEUE_SIZE = 50
+BURST_SIZE = 30000
+
+
+
+class _CountingHandler(sdk_handlers.HandlerInterface):
+    def __init__(self):
+        self.handled_count = 0
+
+    def handle(self, client, command: dict):
+        self.handled_count += 1
+
+
+class IngestQueueBurstTest(unittest.IsolatedAsyncioTestCase):
+    """处理器跟得上时，一次性收到的大量消息不应该因为接收协程不让出事件循环而被丢弃"""
+
+    async def _run_burst(self, policy: OverflowPolicy):
+        client = BlcPluginClient('ws://127.0.0.1:0/', ingest_queue_size=QUEUE_SIZE, overflow_policy=policy)
+        handler = _CountingHandler()
+        client.set_handler(handler)
+        ingest_queue = _IngestQueue(QUEUE_SIZE, policy)
+        consumer_future = asyncio.create_task(client._consumer_coroutine(ingest_queue))  # noqa
+        try:
+            # 和_receive_to_queue一样，连续放入已经缓冲的消息，只在put里可能让出事件循环。
+            # 混入礼物消息，drop_non_text队列满时会丢弃它们
+            for index in range(BURST_SIZE):
+                cmd = sdk_models.Command.ADD_GIFT if index % 10 == 0 else sdk_models.Command.ADD_TEXT
+                await ingest_queue.put({'cmd': cmd, 'data': [index]})
+            while len(ingest_queue) > 0:
+                await asyncio.sleep(0)
+        finally:
+            consumer_future.cancel()
+            await asyncio.wait([consumer_future])
+            await client.close()
+        return handler.handled_count, ingest_queue.dropped_counts
+
+    async def test_drop_oldest_burst(self):
+        handled_count, dropped_counts = await self._run_burst(OverflowPolicy.DROP_OLDEST)
+        self.assertEqual(dropped_counts, {})
+        self.assertEqual(handled_count, BURST_SIZE)
+
+    async def test_drop_non_text_burst(self):
+        handled_count, dropped_counts = await self._run_burst(OverflowPolicy.DROP_NON_TEXT)
+        self.assertEqual(dropped_counts, {})
+        self.assertEqual(handled_count, BURST_SIZE)
+
+    async def test_block_burst(self):
+        handled_count, dropped_counts = await self._run_burst(OverflowPolicy.BLOCK)
+        self.assertEqual(dropped_counts, {})
+        self.assertEqual(handled_count, BURST_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from vote_matcher import VoteMatcher
+
+# 等级 -> 正则表达式，按优先级从高到低排列
+PATTERN_SETS = [
+    {1: '^1$', 2: '^2$', 3: '^3$', 4: '^4$', 5: '^5$'},
+    {1: '^[1１]$', 2: '^(2|二)$', 3: '3', 4: '^4+$', 5: '^5'},
+    {1: '^1', 2: '^[12]$', 3: '^(3)(3)?$', 4: '^(?:好|棒)+$', 5: '^5$'},
+    # 按编号引用分组，合并之后编号会变
+    {1: r'^(1)\1$', 2: '^1+$', 3: '^3$', 4: '^4$', 5: '^5$'},
+    {1: '(1)?(?(1)a|b)', 2: '^b$'},
+    {1: '^(a)?(?(1)1|2)$', 2: '^2$', 3: '^a2$'},
+]
+
+CONTENTS = [
+    '1', '2', '3', '4', '5', '11', '12', '1111', '１', '二', '33', '333', '44', '55', '好棒', '好',
+    '1a', 'b', 'a1', 'a2', '2a', 'ab', '', ' 1 ', '不是投票',
+]
+
+
+class VoteMatcherTest(unittest.TestCase):
+    def test_combined_matches_sequential(self):
+        """合并成一个正则表达式的匹配结果要和按等级顺序逐个匹配的相同"""
+        for patterns in PATTERN_SETS:
+            matcher = VoteMatcher(patterns)
+            for content in CONTENTS:
+                with self.subTest(patterns=patterns, content=content):
+                    # match_levels按等级顺序逐个匹配
+                    matched_levels = matcher.match_levels(content)
+                    expected_level = matched_levels[0] if matched_levels else None
+                    self.assertEqual(matcher.match(content), expected_level)
+
+    def test_numbered_conditional_is_not_combined(self):
+        matcher = VoteMatcher({1: '(1)?(?(1)a|b)', 2: '^b$'})
+        self.assertEqual(matcher.mode, 'sequential')
+        self.assertEqual(matcher.match('1a'), 1)
+        self.assertEqual(matcher.match('b'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
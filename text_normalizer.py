@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+匹配投票之前规范化弹幕内容，让全角数字（１）、圈数字（①）、半角假名（ｶﾞ）、零宽字符等写法也能匹配上
+
+规范化用str.translate一次完成，转换表在更新正则表达式时生成，每条弹幕只多一次translate，纯ASCII的弹幕直接跳过
+"""
+import functools
+import itertools
+import logging
+import unicodedata
+from typing import Dict, Optional
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+_ZERO_WIDTH_CODE_POINTS = (
+    0x00AD,  # 软连字符
+    0x034F,  # 组合用字形连接符
+    0x061C,
+    0x180E,
+    *range(0x200B, 0x2010),  # 零宽空格、零宽连接符、从左到右标记等
+    *range(0x202A, 0x202F),
+    *range(0x2060, 0x2065),
+    *range(0x2066, 0x206A),
+    0x20E3,  # 组合用键帽，1️⃣去掉之后是1
+    *range(0xFE00, 0xFE10),  # 异体字选择符
+    0xFEFF,
+)
+"""删除的不可见字符"""
+
+_EXTRA_RANGES = (
+    range(0x1D400, 0x1D800),  # 数学字母数字符号，如𝟏
+    range(0x1F100, 0x1F200),  # 带圈字母数字补充，如🄁
+)
+"""BMP以外也做NFKC的范围"""
+
+_EXTRA_DIGIT_RANGES = (
+    0x2776,  # ❶-❿
+    0x2780,  # ➀-➉
+    0x278A,  # ➊-➓
+    0x24F5,  # ⓵-⓾
+)
+"""NFKC不转换的带圈数字，每个范围是1到10"""
+
+_COMBINING_KANA_MARKS = ('\u3099', '\u309a')
+"""半角浊点、半濁点NFKC之后是组合字符，需要和前面的假名合成"""
+
+
+@functools.lru_cache(maxsize=None)
+def _get_nfkc_table() -> Dict[int, str]:
+    """逐个字符的NFKC转换表，包括全角转半角、半角假名转全角，和正则表达式无关，只生成一次"""
+    table = {}
+    # ASCII字符NFKC之后不变
+    for code_point in itertools.chain(range(0x80, 0xD800), range(0xE000, 0x10000), *_EXTRA_RANGES):
+        char = chr(code_point)
+        normalized = unicodedata.normalize('NFKC', char)
+        if normalized != char:
+            table[code_point] = normalized
+    for start in _EXTRA_DIGIT_RANGES:
+        for number in range(1, 11):
+            table[start + number - 1] = str(number)
+    return table
+
+
+def build_translation_table(digit_map: Optional[Dict[str, str]] = None) -> Dict[int, Optional[str]]:
+    """
+    生成规范化用的str.translate转换表
+
+    :param digit_map: NFKC之后再做的替换，键是单个字符，如{'一': '1'}
+    """
+    digit_table = {}
+    for key, value in (digit_map or {}).items():
+        if len(key) != 1:
+            logger.warning(f'数字映射的键应该是单个字符，忽略: {key!r}')
+            continue
+        digit_table[ord(key)] = str(value)
+
+    table: Dict[int, Optional[str]] = {
+        code_point: normalized.translate(digit_table) for code_point, normalized in _get_nfkc_table().items()
+    }
+    for code_point, value in digit_table.items():
+        if code_point not in table:
+            table[code_point] = value
+    for code_point in _ZERO_WIDTH_CODE_POINTS:
+        table[code_point] = None
+    return table
+
+
+class TextNormalizer:
+    """
+    规范化弹幕内容：NFKC（包括全角半角转换）、删除零宽字符、数字映射
+
+    逐个字符转换，和对整个字符串做NFKC的区别只在组合字符上，半角假名的浊点会单独合成
+
+    :param digit_map: NFKC之后再做的替换，键是单个字符，如{'一': '1'}
+    """
+
+    def __init__(self, digit_map: Optional[Dict[str, str]] = None):
+        self._table = build_translation_table(digit_map)
+        # 数字映射里有ASCII字符时不能跳过ASCII弹幕
+        self._skip_ascii = all(not key.isascii() for key in (digit_map or {}))
+
+    def normalize(self, text: str) -> str:
+        if self._skip_ascii and text.isascii():
+            return text
+        text = text.translate(self._table)
+        if _COMBINING_KANA_MARKS[0] in text or _COMBINING_KANA_MARKS[1] in text:
+            text = unicodedata.normalize('NFC', text)
+        return text
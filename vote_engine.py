@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional
+
+import blcsdk.models as sdk_models
+from vote_ledger import VoteLedger
+from vote_matcher import MatcherOptions, VoteMatcher
+from vote_session import VoteSessionManager, VoteTally
+from vote_timeline import VoteTimeline
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+
+class TallySnapshot(NamedTuple):
+    """一个房间或合并视图在某一时刻的统计结果"""
+    vote_counts: Dict[int, int]
+    total_votes: int
+    version: int
+
+    @classmethod
+    def from_tally(cls, tally: VoteTally):
+        return cls(dict(tally.vote_counts), tally.total_votes, tally.version)
+
+
+class VoteSnapshot(NamedTuple):
+    """VoteEngine在某一时刻的状态，生成后不会再变化，可以在任意线程读取"""
+    version: int
+    """引擎的状态每次变化时加1"""
+    is_counting: bool
+    initial_count: int
+    merged: TallySnapshot
+    """所有房间按uid去重的合并视图"""
+    rooms: Dict[Optional[sdk_models.RoomKey], TallySnapshot]
+
+    def get_total_count(self, tally: TallySnapshot) -> int:
+        """结果页面使用的初始人数，统计结束后不小于实际投票数"""
+        if self.is_counting:
+            return self.initial_count
+        return max(self.initial_count, tally.total_votes)
+
+
+class _MatchState(NamedTuple):
+    """网络线程匹配弹幕时用到的状态，整体替换，读取时不需要加锁"""
+    matcher: VoteMatcher
+    close_time: float
+    cutoff_timestamp: Optional[float]
+    room_ledgers: Dict[Optional[sdk_models.RoomKey], VoteLedger]
+    """房间 -> 这个房间统计中的VoteLedger，用于在匹配之前排除已经投过票的账号。不另外保存投票者，
+    开始统计时是新的字典，第一次计入这个房间的投票时加入"""
+
+
+class VoteEngine:
+    """
+    投票统计的核心，持有所有统计状态，不依赖wx
+
+    网络线程调用has_voted、match和ingest计入投票，GUI线程调用start、stop控制统计，调用snapshot读取一致的统计结果。
+    匹配在锁外进行，只有计入投票时短暂加锁
+
+    :param on_changed: 统计结果从上次snapshot之后第一次变化时调用（在变化的线程中），用于合并唤醒GUI线程
+    :param on_closed: 网络线程发现已经到达截止时间时调用一次
+    """
+
+    def __init__(
+        self,
+        on_changed: Optional[Callable[[], None]] = None,
+        on_closed: Optional[Callable[[], None]] = None,
+    ):
+        self._lock = threading.Lock()
+        self._on_changed = on_changed
+        self._on_closed = on_closed
+        self._change_notified = False
+        """已经通知变化，但是还没有snapshot"""
+
+        self._patterns: Dict[int, str] = {}
+        self._matcher_options: Optional[MatcherOptions] = None
+        self._matcher: Optional[VoteMatcher] = None
+        self._match_state: Optional[_MatchState] = None
+        """不在统计时为None"""
+
+        self._sessions = VoteSessionManager()
+        self._timeline: Optional[VoteTimeline] = None
+        """合并视图每秒的新增票数，开始统计时创建，结束后保留到下次开始"""
+        self._version = 0
+        self._initial_count = 0
+        self._deadline = 0.0
+        self._close_time = 0.0
+
+    def set_on_changed(self, on_changed: Optional[Callable[[], None]]):
+        self._on_changed = on_changed
+
+    def set_on_closed(self, on_closed: Optional[Callable[[], None]]):
+        self._on_closed = on_closed
+
+    @property
+    def is_counting(self) -> bool:
+        return self._match_state is not None
+
+    @property
+    def deadline(self) -> float:
+        """统计的截止时间，time.monotonic()"""
+        return self._deadline
+
+    @property
+    def close_time(self) -> float:
+        """停止接收投票的时间，time.monotonic()。按弹幕时间戳截止时比deadline晚一个宽限时间"""
+        return self._close_time
+
+    @property
+    def matcher(self) -> Optional[VoteMatcher]:
+        return self._matcher
+
+    def set_patterns(self, patterns: Dict[int, str], options: Optional[MatcherOptions] = None):
+        """
+        设置各等级的正则表达式，统计过程中修改会立即生效。有灾难性回溯风险的正则表达式要在调用之前检查，
+        见vote_matcher.find_unsafe_patterns
+        """
+        matcher = VoteMatcher(patterns, options)
+        with self._lock:
+            self._patterns = dict(patterns)
+            self._matcher_options = options
+            self._matcher = matcher
+            match_state = self._match_state
+            if match_state is not None:
+                self._match_state = match_state._replace(matcher=matcher)
+
+    def start(
+        self,
+        duration: float,
+        initial_count: int = 0,
+        timestamp_cutoff: bool = False,
+        late_grace_seconds: float = 0.0,
+    ):
+        """
+        清空统计结果并开始统计
+
+        :param duration: 统计的秒数
+        :param initial_count: 初始人数
+        :param timestamp_cutoff: 是否按弹幕的发送时间戳截止，截止之后到达、但是在截止之前发送的弹幕也计入
+        :param late_grace_seconds: 按时间戳截止时，截止之后最多再等待这么多秒的迟到弹幕
+        """
+        matcher = self._matcher
+        if matcher is None:
+            matcher = VoteMatcher(self._patterns, self._matcher_options)
+        with self._lock:
+            self._sessions.reset()
+            self._initial_count = initial_count
+            start_time = time.monotonic()
+            self._deadline = start_time + duration
+            if timestamp_cutoff:
+                cutoff_timestamp = time.time() + duration
+                self._close_time = self._deadline + late_grace_seconds
+            else:
+                cutoff_timestamp = None
+                self._close_time = self._deadline
+            self._timeline = VoteTimeline(self._close_time - start_time, start_time)
+            self._matcher = matcher
+            self._match_state = _MatchState(matcher, self._close_time, cutoff_timestamp, {
+                room_key: tally.vote_records for room_key, tally in self._sessions.rooms.items()
+            })
+            self._mark_changed()
+        self._notify_changed()
+
+    def stop(self):
+        """结束统计，之后不再计入投票"""
+        with self._lock:
+            match_state = self._match_state
+            if match_state is None:
+                return
+            self._match_state = None
+            self._timeline.close()
+            self._mark_changed()
+        self._notify_changed()
+        _log_match_stats(match_state.matcher)
+
+    def match(self, content: str, timestamp: Optional[float] = None) -> Optional[int]:
+        """
+        在网络线程调用，判断弹幕是不是有效的投票
+
+        :param content: 弹幕内容
+        :param timestamp: 弹幕的发送时间戳（秒）
+        :return: 投票等级，不在统计状态、已经截止或者不匹配时返回None
+        """
+        match_state = self._match_state
+        if match_state is None:
+            return None
+        if time.monotonic() >= match_state.close_time:
+            self._close(match_state)
+            return None
+        cutoff_timestamp = match_state.cutoff_timestamp
+        if cutoff_timestamp is not None and timestamp is not None and timestamp > cutoff_timestamp:
+            return None
+        return match_state.matcher.match(content)
+
+    def _close(self, match_state: _MatchState):
+        with self._lock:
+            # 可能已经被其他线程结束或者重新开始了
+            if self._match_state is not match_state:
+                return
+            self._match_state = None
+            self._timeline.close()
+            self._mark_changed()
+        self._notify_changed()
+        _log_match_stats(match_state.matcher)
+        on_closed = self._on_closed
+        if on_closed is not None:
+            on_closed()
+
+    def has_voted(self, room_key: Optional[sdk_models.RoomKey], uid: str) -> bool:
+        """
+        在网络线程调用，这个账号在这次统计中是否已经在这个房间投过票，投过票的账号之后的弹幕不需要再匹配
+
+        不加锁，直接查房间的VoteLedger，比匹配和计入便宜。和计入同时发生时可能漏判，漏判的弹幕会照常匹配，
+        计入时再由VoteLedger排除。room_key也可以是和RoomKey相等的元组
+        """
+        match_state = self._match_state
+        if match_state is None:
+            return False
+        ledger = match_state.room_ledgers.get(room_key, None)
+        return ledger is not None and ledger.contains_lock_free(uid)
+
+    def ingest(self, room_key: Optional[sdk_models.RoomKey], uid: str, level: int) -> bool:
+        """
+        计入一张match过的投票
+
+        :return: 是否计入了房间的统计
+        """
+        with self._lock:
+            # match之后可能已经结束统计
+            match_state = self._match_state
+            if match_state is None:
+                return False
+            sessions = self._sessions
+            merged = sessions.merged
+            merged_votes = merged.total_votes
+            if not sessions.process_vote(room_key, uid, level):
+                return False
+            if room_key not in match_state.room_ledgers:
+                match_state.room_ledgers[room_key] = sessions.rooms[room_key].vote_records
+            # 同一个账号在其他房间投过票时不计入合并视图，时间线和合并视图一致
+            if merged.total_votes != merged_votes:
+                self._timeline.record(level)
+            self._mark_changed()
+        self._notify_changed()
+        return True
+
+    def add_room(self, room_key: Optional[sdk_models.RoomKey]):
+        with self._lock:
+            if room_key in self._sessions.rooms:
+                return
+            self._sessions.add_room(room_key)
+            self._mark_changed()
+        self._notify_changed()
+
+    def del_room(self, room_key: Optional[sdk_models.RoomKey]):
+        """删除房间的统计结果，已经计入合并视图的投票保留"""
+        with self._lock:
+            if room_key not in self._sessions.rooms:
+                return
+            self._sessions.del_room(room_key)
+            # 重新添加房间时重新统计
+            if self._match_state is not None:
+                self._match_state.room_ledgers.pop(room_key, None)
+            self._mark_changed()
+        self._notify_changed()
+
+    def _mark_changed(self):
+        """需要持有锁"""
+        self._version += 1
+
+    def _notify_changed(self):
+        """不能持有锁，回调里可能会调用snapshot"""
+        if self._change_notified:
+            return
+        self._change_notified = True
+        on_changed = self._on_changed
+        if on_changed is not None:
+            on_changed()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def timeline_snapshot(self) -> Optional[VoteTimeline]:
+        """取合并视图时间线的副本，还没有开始过统计时返回None"""
+        with self._lock:
+            return self._timeline.copy() if self._timeline is not None else None
+
+    def snapshot(self) -> VoteSnapshot:
+        """取当前的统计结果"""
+        with self._lock:
+            # 先清除标志再取，这样之后的变化一定会触发下一次通知
+            self._change_notified = False
+            sessions = self._sessions
+            return VoteSnapshot(
+                version=self._version,
+                is_counting=self._match_state is not None,
+                initial_count=self._initial_count,
+                merged=TallySnapshot.from_tally(sessions.merged),
+                rooms={room_key: TallySnapshot.from_tally(tally) for room_key, tally in sessions.rooms.items()},
+            )
+
+
+def _log_match_stats(matcher: VoteMatcher):
+    cache_stats = matcher.get_cache_stats()
+    if cache_stats is not None:
+        logger.info(
+            f'匹配缓存命中率: {cache_stats["hit_rate"]:.1%}，命中 {cache_stats["hits"]} 次，'
+            f'未命中 {cache_stats["misses"]} 次，缓存 {cache_stats["size"]}/{cache_stats["max_size"]} 条'
+        )
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import array
+from typing import Iterator, Optional, Tuple
+
+_INITIAL_CAPACITY = 1024
+"""初始槽位数，必须是2的幂"""
+_EMPTY = 0
+"""空槽位的键"""
+
+
+class VoteLedger:
+    """
+    记录每个账号投的第一张有效票
+
+    用开放寻址哈希表实现，不保存uid字符串，只保存uid的64位哈希和等级，分别放在array('q')和bytearray里。
+    每个槽位9字节，装载因子在1/3到2/3之间，所以每个投票者占用约14~27字节（100万投票者约19MB）；
+    而用dict保存完整的Open ID时，每个投票者要占用约116字节（字符串本身加上dict的槽位）。
+    插入比dict慢，约1.5us，只在第一次投票时发生。基准测试见benchmarks/bench_vote_ledger.py
+
+    不同uid的64位哈希相同时，后投票的会被当成已经投过票，100万投票者时发生的概率约为3e-8，可以忽略
+    """
+
+    __slots__ = ('_keys', '_levels', '_mask', '_size', '_grow_threshold')
+
+    def __init__(self):
+        self._keys: 'array.array[int]' = array.array('q')
+        self._levels = bytearray()
+        self._mask = 0
+        self._size = 0
+        self._grow_threshold = 0
+        self.clear()
+
+    def clear(self):
+        """清空，直接换成新的小数组，耗时和已有的投票数无关"""
+        self._keys = array.array('q', [_EMPTY]) * _INITIAL_CAPACITY
+        self._levels = bytearray(_INITIAL_CAPACITY)
+        self._mask = _INITIAL_CAPACITY - 1
+        self._size = 0
+        self._grow_threshold = _INITIAL_CAPACITY * 2 // 3
+
+    @staticmethod
+    def _hash(uid: str) -> int:
+        # 0表示空槽位
+        return hash(uid) or 1
+
+    def _find_slot(self, key: int) -> int:
+        """返回key所在的槽位，或者应该插入的空槽位"""
+        keys = self._keys
+        mask = self._mask
+        index = key & mask
+        while True:
+            slot_key = keys[index]
+            if slot_key == key or slot_key == _EMPTY:
+                return index
+            index = (index + 1) & mask
+
+    def add(self, uid: str, level: int) -> bool:
+        """
+        记录一张投票，只有这个账号第一次投票时才会记录
+
+        :return: 是否是第一次投票
+        """
+        key = hash(uid) or 1
+        keys = self._keys
+        mask = self._mask
+        index = key & mask
+        while True:
+            slot_key = keys[index]
+            if slot_key == key:
+                return False
+            if slot_key == _EMPTY:
+                break
+            index = (index + 1) & mask
+
+        keys[index] = key
+        self._levels[index] = level
+        self._size += 1
+        if self._size > self._grow_threshold:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old_keys = self._keys
+        old_levels = self._levels
+        capacity = len(old_keys) * 2
+        keys = array.array('q', [_EMPTY]) * capacity
+        levels = bytearray(capacity)
+        mask = capacity - 1
+
+        for old_index, key in enumerate(old_keys):
+            if key == _EMPTY:
+                continue
+            index = key & mask
+            while keys[index] != _EMPTY:
+                index = (index + 1) & mask
+            keys[index] = key
+            levels[index] = old_levels[old_index]
+
+        self._keys = keys
+        self._levels = levels
+        self._mask = mask
+        self._grow_threshold = capacity * 2 // 3
+
+    def get(self, uid: str, default: Optional[int] = None) -> Optional[int]:
+        """取这个账号投的等级"""
+        key = self._hash(uid)
+        index = self._find_slot(key)
+        if self._keys[index] == key:
+            return self._levels[index]
+        return default
+
+    def __contains__(self, uid: str) -> bool:
+        key = self._hash(uid)
+        return self._keys[self._find_slot(key)] == key
+
+    def contains_lock_free(self, uid: str) -> bool:
+        """
+        不加锁的查找，可以在写入的线程以外调用
+
+        只读取一次键数组，用它自身的长度算掩码，所以和扩容、清空同时发生时也不会越界。
+        这时可能漏掉刚写入的账号而返回False，但是不会把没有记录的账号判断成已经记录
+        """
+        keys = self._keys
+        mask = len(keys) - 1
+        key = hash(uid) or 1
+        index = key & mask
+        while True:
+            slot_key = keys[index]
+            if slot_key == key:
+                return True
+            if slot_key == _EMPTY:
+                return False
+            index = (index + 1) & mask
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        """遍历所有投票者uid的哈希"""
+        for key in self._keys:
+            if key != _EMPTY:
+                yield key
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        """遍历(uid的哈希, 等级)"""
+        levels = self._levels
+        for index, key in enumerate(self._keys):
+            if key != _EMPTY:
+                yield key, levels[index]
+
+    @property
+    def memory_bytes(self) -> int:
+        """键和等级数组占用的字节数"""
+        return self._keys.itemsize * len(self._keys) + len(self._levels)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import re
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import regex_safety
+from text_normalizer import TextNormalizer
+
+logger = logging.getLogger('niconico-rating.' + __name__)
+
+DEFAULT_CONFIG = {
+    'match_time_budget_ms': 50,
+    'normalize': False,
+    'digit_map': {},
+    'match_cache_size': 4096,
+}
+"""config.json中regex的默认配置"""
+
+_MIN_CONTENT_LENGTH_LIMIT = 20
+"""超过匹配时间预算后限制弹幕长度时，最多限制到这么多字，投票弹幕一般不会更长"""
+
+# 除此之外的字符在正则表达式中都表示字面值
+_REGEX_META_CHARS = frozenset('.^$*+?{}[]|()\\')
+# 按编号引用分组：反向引用\1和条件(?(1)...)。合并成一个正则表达式后分组编号会变，不能合并
+_GROUP_NUMBER_REF_PATTERN = re.compile(r'(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?\(\d+\))')
+# 匹配缓存中没有这条弹幕
+_CACHE_MISS = object()
+
+
+def _parse_anchored_literal(pattern: str) -> Optional[str]:
+    """
+    如果正则表达式只是一个锚定的字面值（如^1$），返回这个字面值，否则返回None
+
+    因为使用match匹配，开头的^可以省略，但结尾必须有$或\\Z
+    """
+    if pattern.startswith('^'):
+        body = pattern[1:]
+    elif pattern.startswith('\\A'):
+        body = pattern[2:]
+    else:
+        body = pattern
+    if body.endswith('\\Z') and not body.endswith('\\\\Z'):
+        body = body[:-2]
+    elif body.endswith('$') and not body.endswith('\\$'):
+        body = body[:-1]
+    else:
+        return None
+
+    chars = []
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == '\\':
+            # 只接受转义的非字母数字字符，如\.、\+
+            if i + 1 >= len(body) or body[i + 1].isalnum() or body[i + 1] == '_':
+                return None
+            chars.append(body[i + 1])
+            i += 2
+            continue
+        if char in _REGEX_META_CHARS:
+            return None
+        chars.append(char)
+        i += 1
+    literal = ''.join(chars)
+    # 匹配前弹幕会先strip，首尾有空白的字面值永远匹配不到，交给正则处理
+    if not literal or literal != literal.strip():
+        return None
+    return literal
+
+
+def get_linear_time_engine():
+    """
+    取线性时间的正则引擎，没有安装时返回None
+
+    google-re2的匹配耗时和弹幕长度成线性关系，不会灾难性回溯，但是不支持反向引用、环视等
+    """
+    try:
+        import re2
+        return re2
+    except ImportError:
+        return None
+
+
+def find_unsafe_patterns(patterns: Dict[int, str]) -> Dict[int, List[str]]:
+    """
+    找出有灾难性回溯风险、而且不能用线性时间引擎匹配的正则表达式，应用之前要检查
+
+    :param patterns: 等级 -> 正则表达式
+    :return: 等级 -> 风险的说明，编译失败的正则表达式不包含在内
+    """
+    linear_time_engine = get_linear_time_engine()
+    unsafe_patterns = {}
+    for level, pattern in patterns.items():
+        try:
+            risks = regex_safety.find_backtracking_risks(pattern)
+        except re.error:
+            continue
+        if not risks:
+            continue
+        if linear_time_engine is not None:
+            try:
+                linear_time_engine.compile(pattern)
+                continue
+            except linear_time_engine.error:
+                pass
+        unsafe_patterns[level] = risks
+    return unsafe_patterns
+
+
+class MatcherOptions(NamedTuple):
+    match_time_budget: float = 0.0
+    """
+    单条弹幕匹配的时间预算（秒），0表示不限制。超过时改用线性时间引擎，没有线性时间引擎时跳过更长的弹幕。
+    Python的re不能中断，超过预算的这一次匹配还是会执行完
+    """
+    normalize: bool = False
+    """匹配之前规范化弹幕内容，见text_normalizer.py"""
+    digit_map: Optional[Dict[str, str]] = None
+    """规范化时NFKC之后再做的替换，如{'一': '1'}"""
+    match_cache_size: int = 0
+    """弹幕内容 -> 匹配结果的LRU缓存大小，0表示不缓存。统计时大量弹幕内容相同，命中时不用再匹配"""
+
+    @classmethod
+    def from_config(cls, section: dict):
+        """
+        :param section: config.json中的regex，见DEFAULT_CONFIG
+        """
+        digit_map = section['digit_map']
+        return cls(
+            match_time_budget=max(float(section['match_time_budget_ms']), 0.0) / 1000,
+            normalize=bool(section['normalize']),
+            digit_map=dict(digit_map) if isinstance(digit_map, dict) else None,
+            match_cache_size=max(int(section['match_cache_size']), 0),
+        )
+
+
+class VoteMatcher:
+    """
+    把各等级的正则表达式编译成一个匹配器，一次匹配就能得到投票等级
+
+    - 所有模式都是锚定的字面值时（如默认的^1$到^5$），直接查哈希表
+    - 否则合并成一个带命名分组的正则表达式，一次match得到等级
+    - 无法合并时（如包含反向引用、按编号的条件、全局标志），退化为按等级顺序逐个匹配
+    - 有灾难性回溯风险、或者匹配超过时间预算时，如果安装了线性时间引擎，用它按等级顺序逐个匹配
+
+    这些方式都保证匹配优先级：等级在前的模式优先。开启规范化时，先规范化弹幕内容再匹配
+
+    开启缓存时，同样内容的弹幕只匹配一次。缓存属于这个匹配器，更新正则表达式时整个匹配器被替换，缓存也就一起失效了。
+    超过时间预算后限制弹幕长度或者改用线性时间引擎时，缓存也会清空
+
+    :param patterns: 等级 -> 正则表达式，按优先级从高到低排列
+    :param options: 匹配选项
+    """
+
+    def __init__(self, patterns: Dict[int, str], options: Optional[MatcherOptions] = None):
+        if options is None:
+            options = MatcherOptions()
+        self._time_budget = options.match_time_budget
+        # 转换表在更新正则表达式时生成一次
+        self._normalizer: Optional[TextNormalizer] = None
+        if options.normalize:
+            self._normalizer = TextNormalizer(options.digit_map)
+        self._max_content_length: Optional[int] = None
+        """超过匹配时间预算后限制的弹幕长度"""
+
+        self._patterns = dict(patterns)
+        self._compiled_patterns: Dict[int, re.Pattern] = {}
+        for level, pattern in patterns.items():
+            try:
+                self._compiled_patterns[level] = re.compile(pattern)
+                logger.debug(f"等级 {level} 正则表达式编译成功: {pattern}")
+            except re.error as e:
+                logger.warning(f'等级 {level} 的正则表达式编译失败: {pattern}, 错误: {e}')
+
+        self._literal_levels: Optional[Dict[str, int]] = None
+        """字面值 -> 等级，所有模式都是字面值时才使用"""
+        self._level_literals: Dict[int, str] = {}
+        """等级 -> 字面值，用于match_levels"""
+        self._combined_pattern: Optional[re.Pattern] = None
+        """合并后的正则表达式"""
+        self._group_levels: Dict[str, int] = {}
+        """合并后的分组名 -> 等级"""
+
+        if self._build_literal_levels(patterns):
+            self.mode = 'literal'
+        elif self._has_backtracking_risk() and self._use_linear_time_engine():
+            self.mode = 'linear'
+        elif self._build_combined_pattern(patterns):
+            self.mode = 'combined'
+        else:
+            self.mode = 'sequential'
+
+        # 弹幕内容 -> 等级的LRU缓存，dict按插入顺序排列，命中时重新插入到末尾，满时删除最前面的。
+        # 不规范化的字面值匹配本来就只是查一次哈希表，不需要缓存
+        self._match_cache: Optional[Dict[str, Optional[int]]] = None
+        self._match_cache_size = options.match_cache_size
+        self._cache_hits = 0
+        self._cache_misses = 0
+        if options.match_cache_size > 0 and (self.mode != 'literal' or self._normalizer is not None):
+            self._match_cache = {}
+
+    def __len__(self):
+        return len(self._compiled_patterns)
+
+    def _build_literal_levels(self, patterns: Dict[int, str]) -> bool:
+        literal_levels = {}
+        level_literals = {}
+        for level in self._compiled_patterns:
+            literal = _parse_anchored_literal(patterns[level])
+            if literal is None:
+                return False
+            if self._normalizer is not None:
+                # 弹幕规范化之后才查表，如^１$也要能匹配上１
+                literal = self._normalizer.normalize(literal)
+                if not literal or literal != literal.strip():
+                    return False
+            # 前面的等级优先
+            literal_levels.setdefault(literal, level)
+            level_literals[level] = literal
+        self._literal_levels = literal_levels
+        self._level_literals = level_literals
+        return True
+
+    def _build_combined_pattern(self, patterns: Dict[int, str]) -> bool:
+        if not self._compiled_patterns:
+            return False
+        parts = []
+        group_levels = {}
+        for level, compiled in self._compiled_patterns.items():
+            pattern = patterns[level]
+            if compiled.flags & ~re.UNICODE or _GROUP_NUMBER_REF_PATTERN.search(pattern):
+                return False
+            group_name = f'_vote_level_{level}'
+            group_levels[group_name] = level
+            parts.append(f'(?P<{group_name}>{pattern})')
+        try:
+            # 分支按等级顺序排列，match时前面的分支能匹配就不会尝试后面的分支
+            combined_pattern = re.compile('|'.join(parts))
+        except re.error:
+            return False
+        self._combined_pattern = combined_pattern
+        self._group_levels = group_levels
+        return True
+
+    def _has_backtracking_risk(self) -> bool:
+        for level in self._compiled_patterns:
+            risks = regex_safety.find_backtracking_risks(self._patterns[level])
+            if risks:
+                logger.warning(f'等级 {level} 的正则表达式有灾难性回溯的风险: {self._patterns[level]}, {"; ".join(risks)}')
+                return True
+        return False
+
+    def _use_linear_time_engine(self) -> bool:
+        """改用线性时间引擎逐个匹配，线性时间引擎不支持的正则表达式还用re。没有安装线性时间引擎时返回False"""
+        linear_time_engine = get_linear_time_engine()
+        if linear_time_engine is None:
+            return False
+        compiled_patterns = {}
+        for level, compiled in self._compiled_patterns.items():
+            try:
+                compiled_patterns[level] = linear_time_engine.compile(self._patterns[level])
+            except linear_time_engine.error:
+                logger.warning(f'线性时间引擎不支持等级 {level} 的正则表达式: {self._patterns[level]}')
+                compiled_patterns[level] = compiled
+        self._compiled_patterns = compiled_patterns
+        self._combined_pattern = None
+        self.mode = 'linear'
+        return True
+
+    def get_cache_stats(self) -> Optional[dict]:
+        """匹配缓存的统计，没有开启缓存时返回None"""
+        if self._match_cache is None:
+            return None
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            'hits': self._cache_hits,
+            'misses': self._cache_misses,
+            'size': len(self._match_cache),
+            'max_size': self._match_cache_size,
+            'hit_rate': self._cache_hits / lookups if lookups else 0.0,
+        }
+
+    def match(self, content: str) -> Optional[int]:
+        """获取投票等级，如果不匹配则返回None"""
+        cache = self._match_cache
+        if cache is None:
+            return self._match_uncached(content)
+        # 超过长度限制的弹幕不查缓存，由_match_uncached按规范化之后的长度判断
+        max_content_length = self._max_content_length
+        if max_content_length is not None and len(content) > max_content_length:
+            return self._match_uncached(content)
+
+        level = cache.pop(content, _CACHE_MISS)
+        if level is not _CACHE_MISS:
+            self._cache_hits += 1
+            cache[content] = level
+            return level
+        self._cache_misses += 1
+        level = self._match_uncached(content)
+        cache[content] = level
+        if len(cache) > self._match_cache_size:
+            del cache[next(iter(cache))]
+        return level
+
+    def _match_uncached(self, content: str) -> Optional[int]:
+        if self._normalizer is not None:
+            content = self._normalizer.normalize(content)
+        content = content.strip()
+        if not content:
+            return None
+
+        if self._literal_levels is not None:
+            return self._literal_levels.get(content, None)
+
+        max_content_length = self._max_content_length
+        if max_content_length is not None and len(content) > max_content_length:
+            return None
+        if self._time_budget <= 0:
+            return self._match_regex(content)
+
+        start_time = time.perf_counter()
+        level = self._match_regex(content)
+        cost = time.perf_counter() - start_time
+        if cost > self._time_budget:
+            self._on_over_budget(content, cost)
+        return level
+
+    def match_levels(self, content: str) -> List[int]:
+        """
+        所有匹配的等级，按优先级排列，用于测试各等级之间的重叠
+
+        和match使用同样的规范化和编译结果，有灾难性回溯风险时用的也是线性时间引擎。不使用缓存，不检查时间预算
+        """
+        if self._normalizer is not None:
+            content = self._normalizer.normalize(content)
+        content = content.strip()
+        if not content:
+            return []
+        if self._literal_levels is not None:
+            return [level for level, literal in self._level_literals.items() if literal == content]
+        return [level for level, pattern in self._compiled_patterns.items() if pattern.match(content)]
+
+    def _on_over_budget(self, content: str, cost: float):
+        # 缓存的结果是按之前的引擎和长度限制得到的
+        if self._match_cache is not None:
+            self._match_cache.clear()
+        if self.mode != 'linear' and self._use_linear_time_engine():
+            logger.warning(f'匹配一条 {len(content)} 字的弹幕耗时 {cost * 1000:.1f}ms，超过预算，改用线性时间正则引擎')
+            return
+        # 回溯的耗时随弹幕长度增长，跳过更长的弹幕
+        max_content_length = max(len(content) - 1, _MIN_CONTENT_LENGTH_LIMIT)
+        if self._max_content_length is None or max_content_length < self._max_content_length:
+            self._max_content_length = max_content_length
+            logger.warning(
+                f'匹配一条 {len(content)} 字的弹幕耗时 {cost * 1000:.1f}ms，超过预算，'
+                f'之后跳过超过 {max_content_length} 字的弹幕'
+            )
+
+    def _match_regex(self, content: str) -> Optional[int]:
+        if self._combined_pattern is not None:
+            m = self._combined_pattern.match(content)
+            if m is None:
+                return None
+            return self._group_levels[m.lastgroup]
+
+        for level, pattern in self._compiled_patterns.items():
+            if pattern.match(content):
+                return level
+        return None
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+from typing import Dict, List, Optional
+
+import blcsdk.models as sdk_models
+from vote_ledger import VoteLedger
+
+VOTE_LEVELS = (1, 2, 3, 4, 5)
+
+
+def room_slug(room_key: Optional[sdk_models.RoomKey]) -> str:
+    """房间在文件名和URL中使用的标识，身份码不直接出现"""
+    if room_key is None:
+        return 'default'
+    if room_key.type == sdk_models.RoomKeyType.AUTH_CODE:
+        return 'code-' + hashlib.sha1(str(room_key.value).encode('utf-8')).hexdigest()[:8]
+    return str(room_key.value)
+
+
+class VoteTally:
+    """一个房间或合并视图的统计结果，一个账号只取第一张有效票"""
+
+    def __init__(self):
+        self.vote_counts: Dict[int, int] = {level: 0 for level in VOTE_LEVELS}
+        self.vote_records = VoteLedger()
+        self.total_votes = 0
+        self.version = 0
+        """统计结果每次变化时加1，显示的一方比较版本号就知道需不需要重绘"""
+
+    def add(self, uid: str, level: int) -> bool:
+        """
+        记录一张投票
+
+        :return: 是否是这个账号的第一张有效票
+        """
+        if not self.vote_records.add(uid, level):
+            return False
+        self.vote_counts[level] += 1
+        self.total_votes += 1
+        self.version += 1
+        return True
+
+    def reset(self):
+        self.vote_counts = {level: 0 for level in VOTE_LEVELS}
+        self.vote_records.clear()
+        self.total_votes = 0
+        self.version += 1
+
+
+class VoteSessionManager:
+    """
+    按房间分开统计投票
+
+    每个RoomKey有独立的统计结果，另外merged合并所有房间的投票并按uid去重：同一个账号在多个房间投票时，
+    每个房间各算一票，合并视图只算最先收到的一票。没有房间信息的投票统计在None房间
+    """
+
+    def __init__(self):
+        self.rooms: Dict[Optional[sdk_models.RoomKey], VoteTally] = {}
+        self.merged = VoteTally()
+
+    def add_room(self, room_key: Optional[sdk_models.RoomKey]) -> VoteTally:
+        tally = self.rooms.get(room_key, None)
+        if tally is None:
+            tally = self.rooms[room_key] = VoteTally()
+        return tally
+
+    def del_room(self, room_key: Optional[sdk_models.RoomKey]):
+        """删除房间的统计结果，已经计入合并视图的投票保留"""
+        self.rooms.pop(room_key, None)
+
+    def room_keys(self) -> List[Optional[sdk_models.RoomKey]]:
+        return list(self.rooms.keys())
+
+    def process_vote(self, room_key: Optional[sdk_models.RoomKey], uid: str, level: int) -> bool:
+        """
+        记录一张投票，房间不存在时自动创建
+
+        :return: 是否计入了房间的统计
+        """
+        tally = self.rooms.get(room_key, None)
+        if tally is None:
+            tally = self.add_room(room_key)
+        if not tally.add(uid, level):
+            return False
+        self.merged.add(uid, level)
+        return True
+
+    def reset(self):
+        """清空所有统计结果，保留房间"""
+        for tally in self.rooms.values():
+            tally.reset()
+        self.merged.reset()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+投票时间线：统计开始后每秒每个等级新增的票数，用于导出和画累计曲线
+
+缓冲区在开始统计时按倒计时长度预分配，计入一票只是一次下标计算和一次加法，不追加列表、不创建元组，不拖慢计入投票
+"""
+import array
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from vote_session import VOTE_LEVELS
+
+DEFAULT_CONFIG = {
+    # 在结果页面上显示各等级的累计票数曲线
+    'show_on_result_page': True,
+    # 曲线最多的点数，时间线更长时降采样
+    'max_points': 60,
+}
+"""配置文件中timeline项的默认值"""
+
+_LEVEL_COUNT = len(VOTE_LEVELS)
+
+
+class VoteTimeline:
+    """
+    每秒每个等级新增的票数，一行一秒，按行存在一个array里
+
+    超过预分配时长的投票（按时间戳截止时的宽限时间等）计入最后一秒，所以计入永远是O(1)的。
+    不加锁，由VoteEngine在持有锁时写入，读取的一方用copy取得一致的副本
+
+    :param duration: 统计的秒数，决定缓冲区的大小
+    :param start_time: 开始统计的time.monotonic()
+    """
+
+    def __init__(self, duration: float, start_time: Optional[float] = None):
+        self.start_time = start_time if start_time is not None else time.monotonic()
+        self.end_time: Optional[float] = None
+        """结束统计的time.monotonic()，还在统计时为None"""
+        self.capacity = max(math.ceil(duration), 1)
+        """最多的秒数"""
+        self._counts = array.array('L', [0]) * (self.capacity * _LEVEL_COUNT)
+
+    def record(self, level: int, now: Optional[float] = None):
+        """计入一票，now是time.monotonic()"""
+        second = int((now if now is not None else time.monotonic()) - self.start_time)
+        if second >= self.capacity:
+            second = self.capacity - 1
+        elif second < 0:
+            second = 0
+        self._counts[second * _LEVEL_COUNT + level - 1] += 1
+
+    def close(self, now: Optional[float] = None):
+        """结束统计，之后的行数不再增加"""
+        if self.end_time is None:
+            self.end_time = now if now is not None else time.monotonic()
+
+    def copy(self) -> 'VoteTimeline':
+        timeline = VoteTimeline.__new__(VoteTimeline)
+        timeline.start_time = self.start_time
+        timeline.end_time = self.end_time
+        timeline.capacity = self.capacity
+        timeline._counts = array.array('L', self._counts)
+        return timeline
+
+    def get_length(self, now: Optional[float] = None) -> int:
+        """已经经过的秒数，即有效的行数，结束统计后固定"""
+        end_time = self.end_time
+        if end_time is None:
+            end_time = now if now is not None else time.monotonic()
+        return min(max(math.ceil(end_time - self.start_time), 1), self.capacity)
+
+    def get_rows(self, now: Optional[float] = None) -> List[List[int]]:
+        """每秒一行，每行是各等级新增的票数"""
+        counts = self._counts
+        return [
+            counts[start:start + _LEVEL_COUNT].tolist()
+            for start in range(0, self.get_length(now) * _LEVEL_COUNT, _LEVEL_COUNT)
+        ]
+
+    def get_cumulative_points(self, max_points: int = 60, now: Optional[float] = None) -> List[Tuple[int, List[int]]]:
+        """
+        降采样的累计票数曲线
+
+        :param max_points: 最多的点数（不包括起点），行数更多时每个点合并多秒
+        :return: [(秒数, 各等级到这一秒为止的累计票数)]，第一个点是(0, 全0)
+        """
+        rows = self.get_rows(now)
+        step = max(math.ceil(len(rows) / max(max_points, 1)), 1)
+        cumulative = [0] * _LEVEL_COUNT
+        points = [(0, list(cumulative))]
+        for index, row in enumerate(rows):
+            for level_index, count in enumerate(row):
+                cumulative[level_index] += count
+            if (index + 1) % step == 0 or index == len(rows) - 1:
+                points.append((index + 1, list(cumulative)))
+        return points
+
+    def to_csv(self, now: Optional[float] = None) -> str:
+        """每秒一行：秒数、各等级新增的票数、这一秒的合计"""
+        lines = ['second,' + ','.join(f'level_{level}' for level in VOTE_LEVELS) + ',total']
+        for second, row in enumerate(self.get_rows(now)):
+            lines.append(f'{second},' + ','.join(map(str, row)) + f',{sum(row)}')
+        lines.append('')
+        return '\n'.join(lines)
+
+    def to_dict(self, now: Optional[float] = None) -> Dict:
+        """导出JSON用"""
+        return {
+            'levels': list(VOTE_LEVELS),
+            'seconds': self.get_length(now),
+            'per_second': self.get_rows(now),
+        }